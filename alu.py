@@ -1,54 +1,143 @@
 #!/usr/bin/python3
+"""АЛУ процессора.
+
+Операция выбирается по коду `sel` (сигнал ALU микрокоманды) через таблицу
+`OPERATIONS`. По умолчанию результат -- целое Python без ограничения
+разрядности (так получены golden-тесты); с `wrap=True` результат
+приводится к знаковому 32-битному, как в аппаратном АЛУ, а флаги C и V
+считаются по точному результату.
+
+Флаги N, Z, V, C вычисляются лениво: операция запоминает свои операнды,
+точный результат и функцию флагов (`pending`), а сами флаги считаются
+при первом чтении. АЛУ работает каждый такт, а флаги читаются редко:
+Z -- при условном переходе (`SIGNIF`), C -- сложением и вычитанием в режиме `eam`.
+"""
+
+MASK32 = 0xFFFFFFFF
+SIGN32 = 0x80000000
+MAX_UINT32 = 0xFFFFFFFF
+MAX_INT32 = 0x7FFFFFFF
+MIN_INT32 = -0x80000000
+
+OPERATIONS = (
+    "plus_zero",
+    "plus",
+    "minus",
+    "multiply",
+    "divide",
+    "modulo",
+    "logical_and",
+    "logical_or",
+    "logical_not",
+    "equal",
+    "less",
+    "greater",
+)
+"Методы `ALU` по коду операции `sel`; остальные коды из 4 бит ничего не делают."
+
+FLAGS = ("n", "z", "v", "c")
+
+
+def _nz(result, wrap):
+    """Флаги N и Z по результату (с `wrap` -- по его знаковым 32 битам)."""
+    if wrap:
+        result = ((result + SIGN32) & MASK32) - SIGN32
+    return (1 if result < 0 else 0), (1 if result == 0 else 0)
+
+
+def plus_flags(right, left, result, wrap):
+    """Флаги сложения"""
+    n, z = _nz(result, wrap)
+    if left < 0 and right > 0:
+        c = 1 if abs(left) <= abs(right) else 0
+    elif left > 0 and right < 0:
+        c = 1 if abs(right) <= abs(left) else 0
+    else:
+        c = result > MAX_UINT32
+    v = (right > 0 and left > 0 and result > MAX_INT32) or (right < 0 and left < 0 and result < MIN_INT32)
+    return n, z, v, c
+
+
+def minus_flags(right, left, result, wrap):
+    """Флаги вычитания"""
+    n, z = _nz(result, wrap)
+    c = left < right  # Перенос при вычитании (если left < right)
+    # Переполнение для вычитания
+    v = (right >= 0 and left < 0 and result < 0) or (right < 0 and left >= 0 and result > 0)
+    return n, z, v, c
+
+
+def multiply_flags(right, left, result, wrap):
+    """Флаги умножения"""
+    n, z = _nz(result, wrap)
+    # Проверка переполнения для умножения
+    v = 1 if right != 0 and (result // right) != left else 0
+    return n, z, v, 0  # Для умножения перенос обычно не используется
+
+
+def logic_flags(right, left, result, wrap):
+    """Флаги остальных операций: N и Z по результату, V и C сброшены"""
+    n, z = _nz(result, wrap)
+    return n, z, 0, 0
 
 
 class ALU:
-    def __init__(self, eam):
+    pending = None
+    "Отложенные флаги последней операции: (функция флагов, right, left, точный результат) или None, если флаги уже посчитаны."
+
+    flags = None
+    "Посчитанные флаги (n, z, v, c)."
+
+    def __init__(self, eam, wrap=False):
         self.reset_flags()
         self.result = 0
         self.eam = eam
+        self.wrap = wrap
+        operations = [getattr(self, name) for name in OPERATIONS]
+        self.operations = tuple(operations + [self.nop] * (16 - len(operations)))
 
     def get_result(self):
         return self.result
 
     def reset_flags(self):
-        self.n = 0
-        self.z = 1
-        self.v = 0
-        self.c = 0
-
-    def _update_nz(self, result):
-        """Обновление флагов N и Z"""
+        self.flags = (0, 1, 0, 0)
+        self.pending = None
+
+    def get_flags(self):
+        """Флаги (n, z, v, c); при необходимости -- досчитать по последней операции."""
+        pending = self.pending
+        if pending is not None:
+            flags_of, right, left, result = pending
+            self.flags = flags_of(right, left, result, self.wrap)
+            self.pending = None
+        return self.flags
+
+    def _set_flag(self, index, value):
+        flags = list(self.get_flags())
+        flags[index] = value
+        self.flags = tuple(flags)
+
+    n = property(lambda self: self.get_flags()[0], lambda self, value: self._set_flag(0, value))
+    z = property(lambda self: self.get_flags()[1], lambda self, value: self._set_flag(1, value))
+    v = property(lambda self: self.get_flags()[2], lambda self, value: self._set_flag(2, value))
+    c = property(lambda self: self.get_flags()[3], lambda self, value: self._set_flag(3, value))
+
+    def _update(self, flags_of, right, left, result):
+        """Сохранить результат и отложить вычисление флагов"""
+        self.pending = (flags_of, right, left, result)
+        if self.wrap:
+            result = ((result + SIGN32) & MASK32) - SIGN32
         self.result = result
-        self.n = 1 if result < 0 else 0
-        self.z = 1 if result == 0 else 0
 
     def do_ALU(self, right, left, sel):
-        if sel == 0:
-            self.plus_zero(left)
-        elif sel == 1:
-            self.plus(right, left)
-        elif sel == 2:
-            self.minus(right, left)
-        elif sel == 3:
-            self.multiply(right, left)
-        elif sel == 4:
-            self.divide(right, left)
-        elif sel == 5:
-            self.modulo(right, left)
-        elif sel == 6:
-            self.logical_and(right, left)
-        elif sel == 7:
-            self.logical_or(right, left)
-        elif sel == 8:
-            self.logical_not(right)
-        elif sel == 9:
-            self.equal(right, left)
-        elif sel == 10:
-            self.less(right, left)
-        elif sel == 11:
-            self.greater(right, left)
-
-    def plus_zero(self, left):
+        self.operations[sel](right, left)
+
+    def nop(self, right, left):
+        pass
+
+    def plus_zero(self, right, left):
+        if self.wrap:
+            left = ((left + SIGN32) & MASK32) - SIGN32
         self.result = left
 
     def plus(self, right, left):
@@ -57,27 +146,7 @@ class ALU:
             result = right + left + self.c
         else:
             result = right + left
-        self._update_nz(result)
-
-        max_uint32 = 0xFFFFFFFF
-        max_int32 = 0x7FFFFFFF
-        min_int32 = -0x80000000
-
-        if left < 0 and right > 0:
-            if abs(left) <= abs(right):
-                self.c = 1
-            else:
-                self.c = 0
-        elif left > 0 and right < 0:
-            if abs(right) <= abs(left):
-                self.c = 1
-            else:
-                self.c = 0
-        else:
-            self.c = result > max_uint32
-        self.v = (right > 0 and left > 0 and result > max_int32) or (
-            right < 0 and left < 0 and result < min_int32
-        )
+        self._update(plus_flags, right, left, result)
 
     def minus(self, right, left):
         """Вычитание с установкой флагов"""
@@ -85,94 +154,46 @@ class ALU:
             result = left - right - self.c
         else:
             result = left - right
-        self._update_nz(result)
-        self.c = left < right  # Перенос при вычитании (если left < right)
-
-        # Переполнение для вычитания
-        self.v = (right >= 0 and left < 0 and result < 0) or (
-            right < 0 and left >= 0 and result > 0
-        )
+        self._update(minus_flags, right, left, result)
 
     def multiply(self, right, left):
         """Умножение с установкой флагов"""
-        result = left * right
-        self._update_nz(result)
-
-        # Проверка переполнения для умножения
-        if right != 0 and (result // right) != left:
-            self.v = 1
-        else:
-            self.v = 0
-
-        self.c = 0  # Для умножения перенос обычно не используется
+        self._update(multiply_flags, right, left, left * right)
 
     def divide(self, right, left):
         """Деление с установкой флагов"""
         if left == 0:
             raise ZeroDivisionError("Division by zero")  # noqa: TRY003
 
-        result = left // right
-        self._update_nz(result)
-        self.v = 0  # Деление не вызывает переполнения
-        self.c = 0  # Нет переноса
+        self._update(logic_flags, right, left, left // right)  # Деление не вызывает переполнения и переноса
 
     def modulo(self, right, left):
         """Остаток от деления с установкой флагов"""
         if left == 0:
             raise ZeroDivisionError("Modulo by zero")  # noqa: TRY003
 
-        result = left % right
-        self._update_nz(result)
-        self.v = 0
-        self.c = 0
+        self._update(logic_flags, right, left, left % right)
 
     def logical_and(self, right, left):
         """Логическое AND с установкой флагов"""
-        result = left & right
-        self._update_nz(result)
-        self.v = 0
-        self.c = 0
+        self._update(logic_flags, right, left, left & right)
 
     def logical_or(self, right, left):
         """Логическое OR с установкой флагов"""
-        result = left | right
-        self._update_nz(result)
-        self.v = 0
-        self.c = 0
+        self._update(logic_flags, right, left, left | right)
 
-    def logical_not(self, right):
+    def logical_not(self, right, left):
         """Логическое NOT с установкой флагов"""
-        result = ~right
-        self._update_nz(result)
-        self.v = 0
-        self.c = 0
+        self._update(logic_flags, right, left, ~right)
 
     def equal(self, right, left):
         """Проверка на равенство с установкой флагов"""
-        if right == left:
-            result = -1
-        else:
-            result = 0
-        self._update_nz(result)
-        self.v = 0
-        self.c = 0
+        self._update(logic_flags, right, left, -1 if right == left else 0)
 
     def less(self, right, left):
         """Меньше с установкой флагов"""
-        if left < right:
-            result = -1
-        else:
-            result = 0
-        self._update_nz(result)
-        self.v = 0
-        self.c = 0
+        self._update(logic_flags, right, left, -1 if left < right else 0)
 
     def greater(self, right, left):
         """Больше с установкой флагов"""
-        if left > right:
-            result = -1
-        else:
-            result = 0
-        self._update_nz(result)
-        self.v = 0
-        self.c = 0
+        self._update(logic_flags, right, left, -1 if left > right else 0)
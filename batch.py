@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+"""Пакетная симуляция: один машинный код на множестве входных данных.
+
+Машинный код и память микрокоманд загружаются один раз и передаются
+процессам `ProcessPoolExecutor` при их запуске. Там же один раз
+декодируются микрокоманды и компилируется машинный код (блок управления-образец,
+см. `init_worker`), после чего процессы исполняют задания (входные данные +
+настройки), копируя для каждого только память.
+
+Пример: `./batch.py target.bin in1.txt in2.txt --eam 0 --eam 1 --workers 4`.
+"""
+
+import argparse
+import itertools
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import machine
+import vector_engine
+
+ENGINES = [*machine.ENGINES, "vector"]
+
+
+class Config(namedtuple("Config", "eam memory_size wrap", defaults=(False, 1000, False))):
+    """Настройки одного запуска: режим арифметики, размер памяти и 32-битное АЛУ (`wrap`)."""
+
+
+_image = None
+"Машинный код и блок управления-образец процесса-исполнителя (см. `init_worker`)."
+
+
+def init_worker(binary, microcode, engine):
+    """Загрузить машинный код и подготовить блок управления-образец движка `engine`.
+
+    Образец построен над собственной копией кода: декодированные микрокоманды,
+    суперинструкции и блоки (`BlockUnit.compile_code`) задания берут у него.
+    """
+    global _image
+    first_exec_instr = int.from_bytes(binary[4:8], "big")
+    data_path = machine.DataPath(
+        machine.allocate_memory(binary, len(binary)), len(binary), len(binary), first_exec_instr, [], False
+    )
+    template = machine.make_control_unit(engine, microcode, data_path)
+    if engine == "block":
+        template.compile_code()
+    _image = (binary, microcode, template)
+
+
+def run_job(job):
+    """Исполнить одно задание (входные токены, `Config`, движок, предел тактов) на загруженном коде."""
+    tokens, config, engine, limit = job
+    binary, microcode, template = _image
+    output, ticks = machine.simulation(
+        machine.allocate_memory(binary, config.memory_size),
+        microcode,
+        input_tokens=machine.InputDevice(itertools.chain(tokens, [0])),  # 0 в конце, как в machine.main
+        data_memory_size=config.memory_size,
+        code_size=len(binary),
+        limit=limit,
+        eam=config.eam,
+        engine=engine,
+        wrap=config.wrap,
+        template=template,
+    )
+    return output, ticks
+
+
+def simulate_many(binary, inputs, configs=(Config(),), microcode=None, engine="block", limit=20000, workers=None):
+    """Исполнить машинный код `binary` на каждом входе из `inputs` с каждой настройкой из `configs`.
+
+    Вход -- последовательность токенов (символов или чисел, см. `machine.encode_input`).
+    Задания идут в порядке (вход, настройка); возвращается список (вывод, такты)
+    в том же порядке. `workers=0` -- исполнять в текущем процессе без пула.
+
+    Движок "vector" (`vector_engine`, нужен NumPy) исполняет все входы с одной
+    настройкой в ногу в текущем процессе; дорожки с ошибкой останавливаются
+    с предупреждением в журнале, а не прерывают весь пакет.
+    """
+    if microcode is None:
+        with open("microcode.bin", "rb") as file:
+            microcode = file.read()
+    binary = bytes(binary)
+    if engine == "vector":
+        inputs = [list(tokens) for tokens in inputs]
+        results = [None] * (len(inputs) * len(configs))
+        for index, config in enumerate(configs):
+            lanes = vector_engine.VectorMachine(binary, microcode, inputs, config.memory_size, config.eam, config.wrap)
+            results[index :: len(configs)] = lanes.run(limit)
+        return results
+
+    jobs = [(list(tokens), config, engine, limit) for tokens in inputs for config in configs]
+
+    if workers == 0:
+        init_worker(binary, microcode, engine)
+        return [run_job(job) for job in jobs]
+
+    workers = workers or os.cpu_count()
+    # задания раздаются пачками, по несколько пачек на процесс
+    chunksize = max(1, len(jobs) // (4 * workers))
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(binary, microcode, engine)
+    ) as executor:
+        return list(executor.map(run_job, jobs, chunksize=chunksize))
+
+
+def read_input(input_file, sim_mode):
+    """Входные токены файла `input_file` в режиме `sim_mode` (как в `machine.main`)."""
+    with open(input_file, encoding="utf-8") as file:
+        if sim_mode == "sym":
+            return list(machine.symbol_tokens(file))
+        return list(machine.number_tokens(file))
+
+
+def main(code_file, input_files, sim_mode, configs, engine="block", limit=20000, workers=None):
+    with open(code_file, "rb") as file:
+        binary = file.read()
+    inputs = [read_input(input_file, sim_mode) for input_file in input_files]
+
+    results = simulate_many(binary, inputs, configs, engine=engine, limit=limit, workers=workers)
+
+    jobs = itertools.product(input_files, configs)
+    for (input_file, config), (output, ticks) in zip(jobs, results):
+        print(
+            "{} eam={} memory_size={} wrap={}".format(input_file, int(config.eam), config.memory_size, int(config.wrap))
+        )
+        print(machine.format_output(output, sim_mode))
+        print("ticks:", ticks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AccForth processor model: batch simulation")
+    parser.add_argument("code_file")
+    parser.add_argument("input_files", nargs="+")
+    parser.add_argument("--mode", choices=["dec", "sym", "hex"], default="sym")
+    parser.add_argument("--eam", action="append", choices=["0", "1"], help="можно указать несколько раз")
+    parser.add_argument("--memory-size", action="append", type=int, help="можно указать несколько раз")
+    parser.add_argument("--wrap", action="store_true", help="32-битные результаты АЛУ (по модулю 2^32)")
+    parser.add_argument("--engine", choices=ENGINES, default="block")
+    parser.add_argument("--limit", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    configs = [
+        Config(eam == "1", memory_size, args.wrap)
+        for eam in args.eam or ["0"]
+        for memory_size in args.memory_size or [Config().memory_size]
+    ]
+    main(args.code_file, args.input_files, args.mode, configs, args.engine, args.limit, args.workers)
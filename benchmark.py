@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+"""Микробенчмарк модели процессора.
+
+Замеры (по умолчанию -- первые три, четвертый -- если задан `--batch`,
+пятый -- вместо остальных с `--superscalar`):
+
+- доступ к памяти: чтение и запись 32-битных слов побайтово (четыре сдвига
+  и четыре индексации `bytearray`, как было в `DataPath`) и через `isa.WORD`;
+
+- операция АЛУ за такт (`DataPath.signal_do_alu`): передача операнда
+  через мультиплексор и выбор операции по коду;
+
+- скорость симуляции программы (тактов в секунду) для каждого движка: до и после
+  перехода на `isa.WORD` -- с побайтовым `DataPath` (`BytewiseDataPath`) и с обычным;
+
+- суммарная скорость `vector_engine` на пакетах из `--batch` одинаковых машин;
+
+- модельное время суперскалярной модели (`superscalar`)
+  против обычной: такты, ускорение, IPC (инструкций за такт) и доля парной
+  выдачи (инструкций на группу выдачи).
+
+Пример: `./benchmark.py examples/euler.forth --repeat 5 --batch 1 --batch 100`,
+`./benchmark.py examples/*.forth --superscalar`.
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import machine
+import translator
+import vector_engine
+from isa import WORD
+
+
+def best_time(function, repeat):
+    """Лучшее из `repeat` времен выполнения `function()` в секундах."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_memory(repeat, count=200_000):
+    memory = bytearray(4096)
+    addresses = [(i * 4) % 4000 for i in range(count)]
+
+    def bytewise():
+        for address in addresses:
+            value = (
+                (memory[address] << 24) | (memory[address + 1] << 16) | (memory[address + 2] << 8) | memory[address + 3]
+            ) + 1
+            memory[address] = (value >> 24) & 0xFF
+            memory[address + 1] = (value >> 16) & 0xFF
+            memory[address + 2] = (value >> 8) & 0xFF
+            memory[address + 3] = value & 0xFF
+
+    def word():
+        load, store = WORD.unpack_from, WORD.pack_into
+        for address in addresses:
+            store(memory, address, (load(memory, address)[0] + 1) & 0xFFFFFFFF)
+
+    for name, body in (("bytewise", bytewise), ("word", word)):
+        print("memory {:10} {:>12,.0f} words/s".format(name, count / best_time(body, repeat)))
+
+
+def bench_alu(repeat, count=200_000):
+    data_path = machine.DataPath(bytearray(64), 64, 16, 8, [], False)
+    data_path.AC, data_path.DR = 7, 0x80000005
+    for sel in (0, 1, 11):
+
+        def body(sel=sel):
+            do_alu = data_path.signal_do_alu
+            for _ in range(count):
+                do_alu(0, sel)
+
+        print("alu sel {:<7} {:>12,.0f} ops/s".format(sel, count / best_time(body, repeat)))
+
+
+def load_program(source, input_file):
+    """Машинный код программы `source`, память микрокоманд и входные токены."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        target = os.path.join(tmpdirname, "target.bin")
+        with contextlib.redirect_stdout(io.StringIO()):
+            translator.main(source, target)
+        with open(target, "rb") as file:
+            code = file.read()
+    with open("microcode.bin", "rb") as file:
+        microcode = file.read()
+    with open(input_file, encoding="utf-8") as file:
+        tokens = list(machine.symbol_tokens(file))
+    return code, microcode, tokens
+
+
+class BytewiseDataPath(machine.DataPath):
+    """`DataPath` с побайтовым чтением и записью слов памяти, как до `isa.WORD`."""
+
+    def signal_latch_CR(self):
+        if self.DA == machine.MEMORY_MAPPED_INPUT_ADDRESS:
+            self.CR = self.input_device.read()
+        else:
+            self.CR = (
+                (self.data_memory[self.DA] << 24)
+                | (self.data_memory[self.DA + 1] << 16)
+                | (self.data_memory[self.DA + 2] << 8)
+                | (self.data_memory[self.DA + 3])
+            )
+
+    def signal_wr(self):
+        assert 0 <= self.AR < self.data_memory_size, "out of memory: {}".format(self.AR)
+        if self.AR == machine.MEMORY_MAPPED_OUTPUT_ADDRESS:
+            self.output_buffer.append(self.AC)
+        else:
+            self.data_memory[self.AR] = (self.AC >> 24) & 0xFF
+            self.data_memory[self.AR + 1] = (self.AC >> 16) & 0xFF
+            self.data_memory[self.AR + 2] = (self.AC >> 8) & 0xFF
+            self.data_memory[self.AR + 3] = (self.AC) & 0xFF
+            if self.code_write_hooks and self.AR < self.code_size:
+                for hook in self.code_write_hooks:
+                    hook(self.AR)
+
+
+def run_engine(engine, data_path_class, code, microcode, tokens, memory_size, limit):
+    """Исполнить программу движком `engine` над `data_path_class`; возвращает такты."""
+    memory = machine.allocate_memory(code, memory_size)
+    entry = WORD.unpack_from(code, 4)[0]
+    data_path = data_path_class(memory, memory_size, len(code), entry, [*tokens, 0], False)
+    unit = machine.make_control_unit(engine, microcode, data_path)
+    try:
+        machine.Execution(unit, engine, False).run_until(limit)
+    except (StopIteration, EOFError):
+        pass
+    return unit.current_tick()
+
+
+def bench_engines(code, microcode, tokens, memory_size, limit, engines, repeat):
+    """Тактов в секунду каждого движка с побайтовым доступом к памяти и через `isa.WORD`."""
+    for engine in engines:
+        speeds = []
+        for data_path_class in (BytewiseDataPath, machine.DataPath):
+            ticks = 0
+
+            def body(data_path_class=data_path_class):
+                nonlocal ticks
+                ticks = run_engine(engine, data_path_class, code, microcode, tokens, memory_size, limit)
+
+            seconds = best_time(body, repeat)
+            speeds.append(ticks / seconds)
+        print("engine {:11} {:>12,.0f} -> {:>12,.0f} ticks/s ({} ticks)".format(engine, *speeds, ticks))
+
+
+def bench_vector(code, microcode, tokens, memory_size, limit, batches, repeat):
+    """Суммарная скорость `vector_engine` (тактов всех дорожек в секунду) на пакетах разного размера."""
+    for batch in batches:
+        ticks = 0
+
+        def body():
+            nonlocal ticks
+            lanes = vector_engine.VectorMachine(code, microcode, [tokens] * batch, memory_size, False)
+            ticks = sum(lane_ticks for _, lane_ticks in lanes.run(limit))
+
+        seconds = best_time(body, repeat)
+        print("vector x{:<9} {:>12,.0f} ticks/s".format(batch, ticks / seconds))
+
+
+def compare_superscalar(source, code, microcode, tokens, memory_size, limit):
+    """Такты обычной и суперскалярной моделей на одной программе (вывод должен совпасть)."""
+    results = {}
+    for engine in ("instruction", "superscalar"):
+        memory = machine.allocate_memory(code, memory_size)
+        entry = WORD.unpack_from(code, 4)[0]
+        data_path = machine.DataPath(memory, memory_size, len(code), entry, [*tokens, 0], False)
+        unit = machine.make_control_unit(engine, microcode, data_path)
+        try:
+            unit.run(limit)
+        except (StopIteration, EOFError):
+            pass
+        results[engine] = (data_path.output_buffer, unit)
+    (output, scalar), (superscalar_output, superscalar) = results["instruction"], results["superscalar"]
+    assert output == superscalar_output, "superscalar output differs on {}".format(source)
+    counts = superscalar.issue_counts()
+    print(
+        "superscalar {:24} {:>9} -> {:>9} ticks  x{:.3f}  IPC {:.3f}  pairing {:.3f}".format(
+            Path(source).name,
+            scalar.current_tick(),
+            counts["ticks"],
+            scalar.current_tick() / max(counts["ticks"], 1),
+            counts["instructions"] / max(counts["ticks"], 1),
+            counts["instructions"] / max(counts["groups"], 1),
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AccForth processor model benchmark")
+    parser.add_argument("sources", nargs="+", help="программы на AccForth")
+    parser.add_argument("--input", default="examples/input_file.txt", help="входные данные (символы)")
+    parser.add_argument("--memory-size", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=10**7, help="предел числа тактов")
+    parser.add_argument("--engine", action="append", choices=machine.ENGINES, help="по умолчанию -- все")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch", action="append", type=int, help="размеры пакетов для vector_engine (нужен NumPy)")
+    parser.add_argument("--superscalar", action="store_true", help="сравнить такты суперскалярной и обычной моделей")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    if args.superscalar:
+        for source in args.sources:
+            compare_superscalar(source, *load_program(source, args.input), args.memory_size, args.limit)
+    else:
+        bench_memory(args.repeat)
+        bench_alu(args.repeat)
+        for source in args.sources:
+            print(source)
+            program = load_program(source, args.input)
+            bench_engines(*program, args.memory_size, args.limit, args.engine or machine.ENGINES, args.repeat)
+            if args.batch:
+                bench_vector(*program, args.memory_size, args.limit, args.batch, args.repeat)
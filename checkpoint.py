@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+"""Контрольные точки модели процессора: сохранение состояния в файл и загрузка.
+
+Состояние (`State`) -- регистры `DataPath`, состояние АЛУ, mpc и модельное
+время блока управления, память, позиция во входном потоке и уже выведенные
+значения. Восстановление блока управления из состояния -- `machine.restore_control_unit`.
+
+Формат файла (big-endian):
+
+- заголовок `HEADER`: сигнатура `MAGIC`, версия, движок, `eam`, `wrap`, признак
+  останова по `HALT`, mpc, такт, размеры кода и памяти, позиция ввода,
+  число выведенных значений и открытая группа выдачи суперскалярной модели
+  (признак и `GROUP_FIELDS`);
+- регистры `REGISTERS` и поля АЛУ `ALU_FIELDS` (`pack_ints`);
+- длина и содержимое памяти, сжатой zlib;
+- выведенные значения (`pack_ints`).
+
+Без `wrap` значения регистров, АЛУ и вывода не ограничены разрядностью,
+поэтому они записываются целыми произвольной величины: ширина значения
+в байтах (не меньше 8) и значения этой ширины со знаком.
+
+Сохранение и загрузка -- O(размер памяти), без циклов по байтам на Python.
+"""
+
+import struct
+import zlib
+from collections import namedtuple
+
+MAGIC = b"AKCP"
+VERSION = 4
+
+REGISTERS = ("CR", "AC", "DR", "PC", "DA", "IR", "BR", "AR", "RSP", "DSP")
+ALU_FIELDS = ("result", "n", "z", "v", "c")
+GROUP_FIELDS = 5  # см. `superscalar.SuperscalarUnit.open_group`
+
+HEADER = struct.Struct(">4sH16s???" + "q" * 6 + "?" + "q" * GROUP_FIELDS)
+MEMORY_SIZE = struct.Struct(">Q")
+WIDTH = struct.Struct(">I")
+
+
+def int_width(value):
+    """Сколько байт нужно, чтобы записать `value` со знаком."""
+    return ((value if value >= 0 else ~value).bit_length() + 8) // 8
+
+
+def pack_ints(values):
+    """Целые `values` произвольной величины: `WIDTH` и значения одной ширины (не меньше 8 байт)."""
+    width = max(8, int_width(max(values, default=0)), int_width(min(values, default=0)))
+    if width == 8:
+        return WIDTH.pack(width) + struct.pack(">{}q".format(len(values)), *values)
+    return WIDTH.pack(width) + b"".join(value.to_bytes(width, "big", signed=True) for value in values)
+
+
+def unpack_ints(file, count):
+    """Прочитать `count` целых, записанных `pack_ints`."""
+    (width,) = WIDTH.unpack(file.read(WIDTH.size))
+    data = file.read(width * count)
+    if width == 8:
+        return list(struct.unpack(">{}q".format(count), data))
+    return [int.from_bytes(data[i : i + width], "big", signed=True) for i in range(0, len(data), width)]
+
+
+class State(
+    namedtuple(
+        "State",
+        "engine eam wrap halted mpc tick code_size memory_size input_position registers alu group memory output",
+    )
+):
+    """Состояние модели процессора в контрольной точке.
+
+    `group` -- открытая группа выдачи суперскалярной модели или None.
+    """
+
+
+def capture(control_unit, engine, halted=False):
+    """Снять состояние блока управления `control_unit` (движок `engine`)."""
+    dp = control_unit.data_path
+    mpc, tick = control_unit.resume_point()
+    # потоковый вывод уже записан в файл, в контрольную точку попадает только список
+    output = dp.output_buffer if isinstance(dp.output_buffer, list) else []
+    return State(
+        engine=engine,
+        eam=bool(dp.ALU.eam),
+        wrap=bool(dp.ALU.wrap),
+        halted=halted,
+        mpc=mpc,
+        tick=tick,
+        code_size=dp.code_size,
+        memory_size=dp.data_memory_size,
+        input_position=dp.input_device.position,
+        registers=tuple(getattr(dp, name) for name in REGISTERS),
+        alu=tuple(int(getattr(dp.ALU, name)) for name in ALU_FIELDS),
+        group=getattr(control_unit, "open_group", None),
+        memory=dp.data_memory,
+        output=list(output),
+    )
+
+
+def save(file, state):
+    """Записать состояние `state` в двоичный файл `file`."""
+    file.write(
+        HEADER.pack(
+            MAGIC,
+            VERSION,
+            state.engine.encode(),
+            state.eam,
+            state.wrap,
+            state.halted,
+            state.mpc,
+            state.tick,
+            state.code_size,
+            state.memory_size,
+            state.input_position,
+            len(state.output),
+            state.group is not None,
+            *(state.group or (0,) * GROUP_FIELDS),
+        )
+    )
+    file.write(pack_ints([*state.registers, *state.alu]))
+    memory = zlib.compress(state.memory, 1)
+    file.write(MEMORY_SIZE.pack(len(memory)))
+    file.write(memory)
+    file.write(pack_ints(state.output))
+
+
+def load(file):
+    """Прочитать состояние из двоичного файла `file`."""
+    fields = HEADER.unpack(file.read(HEADER.size))
+    magic, version, engine, eam, wrap, halted = fields[:6]
+    assert magic == MAGIC, "not a checkpoint file"
+    assert version == VERSION, "unsupported checkpoint version: {}".format(version)
+    mpc, tick, code_size, memory_size, input_position, output_count = fields[6:12]
+    has_group = fields[-GROUP_FIELDS - 1]
+    group = fields[-GROUP_FIELDS:] if has_group else None
+    values = unpack_ints(file, len(REGISTERS) + len(ALU_FIELDS))
+    registers, alu = tuple(values[: len(REGISTERS)]), tuple(values[len(REGISTERS) :])
+
+    (length,) = MEMORY_SIZE.unpack(file.read(MEMORY_SIZE.size))
+    memory = zlib.decompress(file.read(length))
+    assert len(memory) == memory_size, "corrupted checkpoint memory"
+    output = unpack_ints(file, output_count)
+
+    return State(
+        engine=engine.rstrip(b"\0").decode(),
+        eam=eam,
+        wrap=wrap,
+        halted=halted,
+        mpc=mpc,
+        tick=tick,
+        code_size=code_size,
+        memory_size=memory_size,
+        input_position=input_position,
+        registers=registers,
+        alu=alu,
+        group=group,
+        memory=memory,
+        output=list(output),
+    )
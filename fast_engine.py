@@ -0,0 +1,641 @@
+#!/usr/bin/python3
+"""Быстрые модели процессора, исполняющие инструкции целиком.
+
+В отличие от `machine.ControlUnit`, здесь нет интерпретации микрокоманд:
+модельное время увеличивается на то число тактов, которое инструкции
+заняли бы в микропрограммной модели. Вывод и итоговое число тактов совпадают.
+
+- `InstructionUnit` -- одна инструкция за шаг.
+
+- `BlockUnit` -- машинный код разбивается на базовые блоки, каждый блок
+  один раз компилируется в функцию Python и кэшируется по адресу начала.
+
+Оба движка при загрузке находят в коде суперинструкции (`SUPERINSTRUCTIONS`)
+и исполняют каждую как одно действие, подсчитывая число срабатываний.
+"""
+
+from isa import WORD, Opcode, binary_to_opcode, opcode_to_binary, opcode_to_size
+from microcode_util import Signal, linking_table, microcode
+
+FETCH_TICKS = min(linking_table.values()) // 4
+"Число микрокоманд выборки инструкции (лежат в памяти микрокоманд перед первой инструкцией)."
+
+
+def instruction_ticks(opcode):
+    """Сколько тактов инструкция занимает в микропрограммной модели.
+
+    Последняя микрокоманда `HALT` останавливает процессор и не считается.
+    """
+    return FETCH_TICKS + sum(1 for step in microcode[opcode] if step.get(Signal.MPC, 0) == 1)
+
+
+def instruction_span(opcode):
+    """Сколько микрокоманд нужно начать выполнять, чтобы завершить инструкцию
+    (используется для проверки лимита тактов).
+    """
+    return FETCH_TICKS + len(microcode[opcode])
+
+
+ALU_OPERATIONS = {
+    opcode: steps[0].get(Signal.ALU, 0)
+    for opcode, steps in microcode.items()
+    if any(step.get(Signal.ALU, 0) != 0 for step in steps)
+}
+"Арифметические инструкции и код операции АЛУ, который им выставляет микропрограмма."
+
+
+def to_signed(word):
+    """Интерпретировать 32-битное слово как знаковое."""
+    if word & 0x80000000:
+        return word - 0x100000000
+    return word
+
+
+BLOCK_TERMINATORS = {
+    Opcode.IF,
+    Opcode.ELSE,
+    Opcode.WHILE,
+    Opcode.REPEAT,
+    Opcode.CALL,
+    Opcode.RETURN,
+    Opcode.HALT,
+}
+"Инструкции, завершающие базовый блок."
+
+BLOCK_ENDS = BLOCK_TERMINATORS | {Opcode.SAVE}
+"""Инструкции, после которых `BlockUnit` заканчивает скомпилированный блок: кроме
+переходов -- запись в память, которая может изменить код дальше в том же блоке.
+"""
+
+# стек данных лежит выше кода и ниже стека возвратов, поэтому обращения к нему
+# не попадают ни на ввод-вывод, ни в область кода
+PUSH_AC = (
+    "DSP = dp.DSP + 4; assert DSP < dp.RSP, 'stack overflow: {{}}'.format(DSP); "
+    "dp.DSP = dp.AR = dp.DA = DSP; store_word(memory, DSP, dp.AC & 0xFFFFFFFF)"
+)
+
+POP = (
+    "DSP = dp.DSP; dp.AR = dp.DA = DSP; dp.CR = CR = load_word(memory, DSP)[0]; "
+    "dp.DSP = DSP - 4; assert DSP - 4 >= {stack_bottom}, 'out of memory: {{}}'.format(DSP - 4)"
+)
+
+BLOCK_TEMPLATES = {
+    Opcode.LOAD_IMM: "dp.BR = dp.AC = {arg}; " + PUSH_AC,
+    Opcode.LOAD: "dp.AR = dp.AC & 0xFFFFFF; dp.signal_latch_DA(1); dp.signal_latch_CR(); dp.AC = to_signed(dp.CR); "
+    + PUSH_AC,
+    Opcode.SAVE: "dp.AR = dp.DR; dp.signal_latch_DA(1); dp.signal_wr()",
+    Opcode.POP_AC: POP + "; dp.AC = CR - 0x100000000 if CR & 0x80000000 else CR",
+    Opcode.POP_DR: POP + "; dp.DR = CR - 0x100000000 if CR & 0x80000000 else CR",
+    Opcode.DUP: "DSP = dp.DSP; dp.AR = dp.DA = DSP; dp.CR = CR = load_word(memory, DSP)[0]; "
+    "dp.AC = CR - 0x100000000 if CR & 0x80000000 else CR; " + PUSH_AC,
+    Opcode.IF: "dp.BR = {arg}; dp.PC = dp.DA = {next} if dp.ALU.z == 0 else {arg}",
+    Opcode.WHILE: "dp.BR = {arg}; dp.PC = dp.DA = {next} if dp.ALU.z == 0 else {arg}",
+    Opcode.ELSE: "dp.BR = {arg}; dp.PC = dp.DA = {arg}",
+    Opcode.REPEAT: "dp.BR = {arg}; dp.PC = dp.DA = {arg}",
+    Opcode.CALL: "dp.BR = {arg}; dp.AC = {next}; dp.AR = dp.RSP; dp.signal_latch_DA(1); dp.signal_latch_RSP(1); "
+    "dp.signal_wr(); dp.PC = dp.DA = {arg}",
+    Opcode.RETURN: "dp.signal_latch_RSP(0); dp.AR = dp.RSP; dp.signal_latch_DA(1); dp.signal_latch_CR(); "
+    "dp.signal_latch_BR(); dp.PC = dp.DA = dp.BR",
+    Opcode.HALT: "raise StopIteration()",
+}
+"""Шаблоны кода инструкций для компиляции блоков. Аргумент и адрес следующей
+инструкции известны при компиляции и подставляются как константы,
+PC, IR и CR выборки выставляются только для последней инструкции блока.
+"""
+
+for _opcode, _sel in ALU_OPERATIONS.items():
+    BLOCK_TEMPLATES[_opcode] = "dp.ALU.do_ALU(dp.AC, dp.DR, {}); dp.AC = dp.ALU.result; ".format(_sel) + PUSH_AC
+
+
+FUSED_POP_ALU = (
+    "DSP = dp.DSP; assert DSP - 8 >= {stack_bottom}, 'out of memory: {{}}'.format(DSP - 8); "
+    "AC = load_word(memory, DSP)[0]; DR = load_word(memory, DSP - 4)[0]; "
+    "dp.DR = DR = DR - 0x100000000 if DR & 0x80000000 else DR; "
+    "ALU = dp.ALU; ALU.do_ALU(AC - 0x100000000 if AC & 0x80000000 else AC, DR, SEL); dp.AC = AC = ALU.result; "
+    "DSP -= 4; dp.DSP = dp.AR = dp.DA = DSP; store_word(memory, DSP, AC & 0xFFFFFFFF); "
+    "dp.CR = {word}"
+)
+
+FUSED_POP_SAVE = (
+    "DSP = dp.DSP; assert DSP - 8 >= {stack_bottom}, 'out of memory: {{}}'.format(DSP - 8); "
+    "DR = load_word(memory, DSP)[0]; AC = load_word(memory, DSP - 4)[0]; "
+    "dp.AR = dp.DR = DR - 0x100000000 if DR & 0x80000000 else DR; dp.AC = AC - 0x100000000 if AC & 0x80000000 else AC; "
+    "dp.DSP = DSP - 8; dp.CR = {word}; dp.signal_latch_DA(1); dp.signal_wr()"
+)
+
+SUPERINSTRUCTIONS = {(Opcode.POP_DR, Opcode.POP_AC, Opcode.SAVE): FUSED_POP_SAVE}
+"""Суперинструкции: последовательности, в которые транслятор разворачивает
+арифметику (`POP_AC POP_DR <op>`) и `!` (`POP_DR POP_AC SAVE`), и шаблоны
+их слитного исполнения. Стоимость -- сумма тактов составляющих инструкций.
+"""
+
+for _opcode, _sel in ALU_OPERATIONS.items():
+    if _opcode != Opcode.NOT:
+        SUPERINSTRUCTIONS[(Opcode.POP_AC, Opcode.POP_DR, _opcode)] = FUSED_POP_ALU.replace("SEL", str(_sel))
+
+
+def superinstruction_name(sequence):
+    """Имя суперинструкции для счетчиков: `popac+popdr+add`."""
+    return "+".join(str(opcode) for opcode in sequence)
+
+
+def decode_instructions(memory, memory_size, start, stop_at):
+    """Последовательно декодировать инструкции, начиная с адреса `start`.
+
+    Декодирование останавливается на неизвестном коде операции, на конце памяти
+    или после инструкции, для которой `stop_at(адрес, код операции)` истинно.
+    Возвращает список (адрес, код операции, слово CR при выборке).
+    """
+    instructions = []
+    address = start
+    while address + 4 <= memory_size:
+        opcode = binary_to_opcode.get(memory[address])
+        if opcode is None:
+            break
+        word = WORD.unpack_from(memory, address)[0]
+        instructions.append((address, opcode, word))
+        if stop_at(address, opcode):
+            break
+        address += opcode_to_size[opcode]
+    return instructions
+
+
+def compile_function(name, lines, namespace):
+    """Собрать функцию `name(dp)` из строк кода.
+
+    В коде доступны `load_word(memory, address)[0]` и `store_word(memory, address, value)`.
+    """
+    namespace.setdefault("load_word", WORD.unpack_from)
+    namespace.setdefault("store_word", WORD.pack_into)
+    source = "def {}(dp):\n    {}\n".format(name, "\n    ".join(lines))
+    exec(compile(source, "<{}>".format(name), "exec"), namespace)
+    return namespace[name]
+
+
+class InstructionUnit:
+    """Блок управления, исполняющий по одной инструкции за шаг.
+
+    Состояние регистров `DataPath` после каждой инструкции такое же,
+    как у `machine.ControlUnit` на границе инструкций.
+    """
+
+    data_path = None
+    "Блок обработки данных."
+
+    handlers = None
+    "Обработчики инструкций по бинарному коду операции."
+
+    ticks = None
+    "Стоимость инструкций в тактах по бинарному коду операции."
+
+    spans = None
+    "Число микрокоманд, которые нужно начать, чтобы завершить инструкцию."
+
+    fused = None
+    "Слитые суперинструкции: адрес начала -> (функция, такты, имя)."
+
+    fused_hits = None
+    "Сколько раз исполнена каждая суперинструкция."
+
+    fused_ticks = None
+    "Стоимость суперинструкций в тактах по имени."
+
+    code_end = None
+    "Граница (не включительно) кода, из которого собраны суперинструкции и блоки."
+
+    _tick = None
+    "Текущее модельное время процессора (в тактах). Инициализируется нулём."
+
+    stopped_at = None
+    """Время остановки по лимиту: `_tick` доводится до лимита, но инструкция
+    по адресу PC не начата. None -- остановки по лимиту не было."""
+
+    def __init__(self, data_path, fuse=True):
+        self.data_path = data_path
+        self._tick = 0
+        self.stopped_at = None
+        handlers = {
+            Opcode.LOAD_IMM: self.exec_load_imm,
+            Opcode.LOAD: self.exec_load,
+            Opcode.SAVE: self.exec_save,
+            Opcode.CALL: self.exec_call,
+            Opcode.RETURN: self.exec_return,
+            Opcode.POP_AC: self.exec_pop_ac,
+            Opcode.POP_DR: self.exec_pop_dr,
+            Opcode.DUP: self.exec_dup,
+            Opcode.IF: self.exec_branch,
+            Opcode.WHILE: self.exec_branch,
+            Opcode.ELSE: self.exec_jump,
+            Opcode.REPEAT: self.exec_jump,
+            Opcode.HALT: self.exec_halt,
+        }
+        for opcode, sel in ALU_OPERATIONS.items():
+            handlers[opcode] = self.make_alu_handler(sel)
+
+        self.handlers = {opcode_to_binary[opcode]: handler for opcode, handler in handlers.items()}
+        self.ticks = {opcode_to_binary[opcode]: instruction_ticks(opcode) for opcode in handlers}
+        self.spans = {opcode_to_binary[opcode]: instruction_span(opcode) for opcode in handlers}
+
+        self.fused = {}
+        self.fused_hits = {}
+        self.code_end = 0
+        self.fused_ticks = {
+            superinstruction_name(sequence): sum(instruction_ticks(opcode) for opcode in sequence)
+            for sequence in SUPERINSTRUCTIONS
+        }
+        if fuse:
+            self.fuse_superinstructions()
+        data_path.code_write_hooks.append(self.invalidate)
+
+    def fuse_superinstructions(self):
+        """Найти в загруженном коде суперинструкции и скомпилировать их.
+
+        Код просматривается линейно от начала до `HALT` основной программы
+        (после него лежат переменные).
+        """
+        dp = self.data_path
+        entry = dp.PC
+        instructions = decode_instructions(
+            dp.data_memory,
+            dp.data_memory_size,
+            8,
+            lambda address, opcode: opcode == Opcode.HALT and address >= entry,
+        )
+        i = 0
+        while i + 3 <= len(instructions):
+            sequence = tuple(opcode for _, opcode, _ in instructions[i : i + 3])
+            if sequence not in SUPERINSTRUCTIONS:
+                i += 1
+                continue
+            address = instructions[i][0]
+            word = instructions[i + 2][2]
+            name = superinstruction_name(sequence)
+            lines = [
+                "memory = dp.data_memory",
+                self.superinstruction_code(sequence, word),
+                "dp.IR = {}; dp.PC = {}".format(word >> 24, address + 3),
+            ]
+            function = compile_function("fused_{}".format(address), lines, {})
+            self.fused[address] = (function, self.fused_ticks[name], name)
+            self.fused_hits.setdefault(name, 0)
+            self.code_end = address + 3
+            i += 3
+
+    def fork(self, data_path):
+        """Новый блок управления над `data_path` с тем же машинным кодом: суперинструкции не компилируются заново."""
+        unit = type(self)(data_path, fuse=False)
+        unit.fused = dict(self.fused)
+        unit.fused_hits = dict.fromkeys(self.fused_hits, 0)
+        unit.code_end = self.code_end
+        return unit
+
+    def superinstruction_code(self, sequence, word):
+        """Код суперинструкции; `word` -- слово CR при выборке последней инструкции."""
+        return SUPERINSTRUCTIONS[sequence].format(word=word, stack_bottom=self.data_path.code_size - 4)
+
+    def fusion_counts(self):
+        """Сколько раз исполнена каждая суперинструкция."""
+        return dict(self.fused_hits)
+
+    def invalidate(self, address):
+        """Сбросить суперинструкции, затронутые записью слова по адресу `address`."""
+        if address >= self.code_end:
+            return
+        for start in range(address - 2, address + 4):
+            self.fused.pop(start, None)
+
+    def current_tick(self):
+        """Текущее модельное время процессора (в тактах)."""
+        return self._tick
+
+    def resume_point(self):
+        """(mpc, такт), с которых исполнение можно продолжить после остановки.
+
+        Инструкции исполняются целиком, поэтому mpc всегда 0 (начало выборки).
+        """
+        if self.stopped_at is None:
+            return 0, self._tick
+        return 0, self.stopped_at
+
+    def resume(self, mpc, tick):
+        """Продолжить с точки, полученной `resume_point`."""
+        assert mpc == 0, "cannot resume inside an instruction (mpc {}), use the microcode engine".format(mpc)
+        self._tick = tick
+        self.stopped_at = None
+
+    def step(self, limit):
+        """Выполнить одну инструкцию, если она успевает завершиться до `limit` тактов.
+
+        Если не успевает -- время доводится до `limit`, как в микропрограммной модели.
+        Возвращает False, если лимит достигнут. Код операции для проверки лимита
+        читается из памяти напрямую: выборка (и ее подсчет `profiler.MemoryCounter`)
+        происходит, только если инструкция будет исполнена.
+        """
+        dp = self.data_path
+        if self._tick + self.spans[dp.data_memory[dp.PC]] > limit:
+            self.stopped_at = self._tick
+            self._tick = limit
+            return False
+        dp.DA = dp.PC
+        dp.signal_latch_CR()
+        dp.signal_latch_IR()
+        ir = dp.IR
+        self._tick += self.ticks[ir]
+        self.handlers[ir](dp)
+        return True
+
+    def run(self, limit):
+        """Исполнять инструкции до `HALT` (StopIteration) или исчерпания лимита тактов."""
+        dp = self.data_path
+        handlers = self.handlers
+        ticks = self.ticks
+        spans = self.spans
+        fused = self.fused
+        fused_hits = self.fused_hits
+        while True:
+            site = fused.get(dp.PC)
+            if site is not None and self._tick + site[1] <= limit:
+                function, fused_ticks, name = site
+                self._tick += fused_ticks
+                fused_hits[name] += 1
+                function(dp)
+                continue
+            dp.DA = dp.PC
+            dp.signal_latch_CR()
+            dp.signal_latch_IR()
+            ir = dp.IR
+            if self._tick + spans[ir] > limit:
+                self.stopped_at = self._tick
+                self._tick = limit
+                return
+            self._tick += ticks[ir]
+            handlers[ir](dp)
+
+    def push_AC(self, dp):
+        """DSP <- DSP + 4; AR <- DSP; mem[AR] <- AC."""
+        dp.signal_latch_DSP(0)
+        dp.AR = dp.DSP
+        dp.DA = dp.AR
+        dp.signal_wr()
+
+    def load_top(self, dp):
+        """AR <- DSP; CR <- mem[AR]. Возвращает значение вершины стека со знаком."""
+        dp.AR = dp.DSP
+        dp.signal_latch_DA(1)
+        dp.signal_latch_CR()
+        return to_signed(dp.CR)
+
+    def exec_load_imm(self, dp):
+        dp.signal_latch_PC(1)
+        dp.signal_latch_BR()
+        dp.AC = dp.BR
+        self.push_AC(dp)
+
+    def exec_load(self, dp):
+        dp.signal_latch_PC(2)
+        dp.AR = dp.AC & 0xFFFFFF
+        dp.signal_latch_DA(1)
+        dp.signal_latch_CR()
+        dp.AC = to_signed(dp.CR)
+        self.push_AC(dp)
+
+    def exec_save(self, dp):
+        dp.signal_latch_PC(2)
+        dp.AR = dp.DR
+        dp.signal_latch_DA(1)
+        dp.signal_wr()
+
+    def exec_call(self, dp):
+        dp.signal_latch_PC(1)
+        dp.signal_latch_BR()
+        dp.AC = dp.PC
+        dp.AR = dp.RSP
+        dp.signal_latch_DA(1)
+        dp.signal_latch_RSP(1)
+        dp.signal_wr()
+        dp.signal_latch_PC(0)
+        dp.signal_latch_DA(0)
+
+    def exec_return(self, dp):
+        dp.signal_latch_PC(2)
+        dp.signal_latch_RSP(0)
+        dp.AR = dp.RSP
+        dp.signal_latch_DA(1)
+        dp.signal_latch_CR()
+        dp.signal_latch_BR()
+        dp.signal_latch_PC(0)
+        dp.signal_latch_DA(0)
+
+    def exec_pop_ac(self, dp):
+        dp.signal_latch_PC(2)
+        dp.AC = self.load_top(dp)
+        dp.signal_latch_DSP(1)
+
+    def exec_pop_dr(self, dp):
+        dp.signal_latch_PC(2)
+        dp.DR = self.load_top(dp)
+        dp.signal_latch_DSP(1)
+
+    def exec_dup(self, dp):
+        dp.signal_latch_PC(2)
+        dp.AC = self.load_top(dp)
+        self.push_AC(dp)
+
+    def exec_branch(self, dp):
+        dp.signal_latch_BR()
+        # z == 0 -- условие выполнилось, идем дальше; иначе переход
+        dp.signal_latch_PC(1 - dp.ALU.z)
+        dp.signal_latch_DA(0)
+
+    def exec_jump(self, dp):
+        dp.signal_latch_BR()
+        dp.signal_latch_PC(0)
+        dp.signal_latch_DA(0)
+
+    def exec_halt(self, dp):
+        raise StopIteration()
+
+    def make_alu_handler(self, sel):
+        def exec_alu(dp):
+            dp.signal_latch_PC(2)
+            dp.ALU.do_ALU(dp.AC, dp.DR, sel)
+            dp.signal_latch_AC()
+            self.push_AC(dp)
+
+        return exec_alu
+
+
+class BlockUnit(InstructionUnit):
+    """Блок управления, исполняющий скомпилированные базовые блоки.
+
+    Блок -- линейная последовательность инструкций, которая заканчивается
+    инструкцией из `BLOCK_ENDS`. Стоимость блока в тактах считается
+    один раз при компиляции. Запись в память, затрагивающая скомпилированный
+    код, сбрасывает соответствующие блоки из кэша.
+    """
+
+    blocks = None
+    "Кэш скомпилированных блоков: адрес начала -> (функция, такты, микрокоманды)."
+
+    block_fusions = None
+    """Имена суперинструкций в блоках, которые их содержат; число исполнений
+    блока -- в `data_path.block_runs` под тем же индексом."""
+
+    block_owners = None
+    "Адрес байта кода -> адреса начала блоков, в которые он входит."
+
+    def __init__(self, data_path, fuse=True):
+        super().__init__(data_path, fuse)
+        self.blocks = {}
+        self.block_fusions = []
+        self.block_owners = {}
+        data_path.block_runs = []
+
+    def run(self, limit):
+        """Исполнять блоки до `HALT` (StopIteration) или исчерпания лимита тактов.
+
+        Если блок не укладывается в лимит, остаток доисполняется по инструкциям.
+        """
+        dp = self.data_path
+        blocks = self.blocks
+        while True:
+            block = blocks.get(dp.PC)
+            if block is None:
+                block = self.compile_block(dp.PC)
+            function, ticks, span = block
+            if function is None or self._tick + span > limit:
+                while self.step(limit):
+                    pass
+                return
+            self._tick += ticks
+            function(dp)
+
+    def fork(self, data_path):
+        """Новый блок управления над `data_path` с тем же машинным кодом и кэшем блоков.
+
+        Блоки считают свои исполнения в `data_path.block_runs`, поэтому у нового
+        блока управления счетчики свои.
+        """
+        unit = super().fork(data_path)
+        unit.blocks = dict(self.blocks)
+        unit.block_owners = {address: set(starts) for address, starts in self.block_owners.items()}
+        unit.block_fusions = list(self.block_fusions)
+        data_path.block_runs = [0] * len(unit.block_fusions)
+        return unit
+
+    def compile_code(self):
+        """Заранее скомпилировать блоки со всех адресов, с которых может начаться
+        исполнение: точки входа, адресов переходов и вызовов, инструкций после конца блока.
+
+        Код просматривается до `HALT` основной программы, как в `fuse_superinstructions`.
+        """
+        dp = self.data_path
+        entry = dp.PC
+        instructions = decode_instructions(
+            dp.data_memory,
+            dp.data_memory_size,
+            8,
+            lambda address, opcode: opcode == Opcode.HALT and address >= entry,
+        )
+        addresses = {address for address, _, _ in instructions}
+        starts = {entry}
+        for address, opcode, word in instructions:
+            if opcode in BLOCK_ENDS:
+                starts.add(address + opcode_to_size[opcode])
+            if opcode in BLOCK_TERMINATORS and opcode not in (Opcode.RETURN, Opcode.HALT):
+                starts.add(word & 0xFFFFFF)
+        for start in sorted(starts & addresses):
+            if start not in self.blocks:
+                self.compile_block(start)
+
+    def decode_block(self, start):
+        """Декодировать базовый блок, начинающийся с адреса `start`.
+
+        Возвращает список (адрес, код операции, слово CR при выборке).
+        """
+        dp = self.data_path
+        return decode_instructions(
+            dp.data_memory,
+            dp.data_memory_size,
+            start,
+            lambda address, opcode: opcode in BLOCK_ENDS,
+        )
+
+    def compile_block(self, start):
+        """Скомпилировать блок в функцию Python и положить его в кэш.
+
+        Суперинструкции внутри блока исполняются слитно; чтобы не увеличивать
+        счетчик каждой из них, блок считает свои исполнения в `dp.block_runs`
+        (см. `fusion_counts`).
+        """
+        instructions = self.decode_block(start)
+        if not instructions:
+            # неизвестная инструкция -- пусть ошибку обработает пошаговое исполнение
+            return None, 0, 0
+
+        lines = ["memory = dp.data_memory"]
+        fused_names = []
+        ticks = 0
+        span = 0
+        i = 0
+        while i < len(instructions):
+            address, opcode, word = instructions[i]
+            if address in self.fused and i + 3 <= len(instructions):
+                sequence = tuple(opcode for _, opcode, _ in instructions[i : i + 3])
+                word = instructions[i + 2][2]
+                name = superinstruction_name(sequence)
+                if i + 3 == len(instructions):
+                    lines.append("dp.IR = {}; dp.PC = {}".format(word >> 24, address + 3))
+                lines.append(self.superinstruction_code(sequence, word))
+                fused_names.append(name)
+                span = ticks + self.fused_ticks[name]
+                ticks += self.fused_ticks[name]
+                i += 3
+                continue
+
+            next_address = address + opcode_to_size[opcode]
+            if i == len(instructions) - 1:
+                # состояние после выборки последней инструкции, как в ControlUnit
+                lines.append("dp.CR = {}; dp.IR = {}; dp.PC = {}".format(word, word >> 24, next_address))
+            lines.append(
+                BLOCK_TEMPLATES[opcode].format(
+                    arg=word & 0xFFFFFF,
+                    next=next_address,
+                    stack_bottom=self.data_path.code_size - 4,
+                )
+            )
+            span = ticks + instruction_span(opcode)
+            ticks += instruction_ticks(opcode)
+            i += 1
+
+        end = instructions[-1][0] + opcode_to_size[instructions[-1][1]]
+        namespace = {"to_signed": to_signed}
+        if fused_names:
+            lines.insert(0, "dp.block_runs[{}] += 1".format(len(self.block_fusions)))
+            self.block_fusions.append(fused_names)
+            self.data_path.block_runs.append(0)
+        function = compile_function("block_{}".format(start), lines, namespace)
+
+        block = (function, ticks, span)
+        self.blocks[start] = block
+        for address in range(start, end):
+            self.block_owners.setdefault(address, set()).add(start)
+        self.code_end = max(self.code_end, end)
+        return block
+
+    def fusion_counts(self):
+        """Сколько раз исполнена каждая суперинструкция (пошагово и в составе блоков)."""
+        counts = super().fusion_counts()
+        for runs, names in zip(self.data_path.block_runs, self.block_fusions):
+            for name in names:
+                counts[name] += runs
+        return counts
+
+    def invalidate(self, address):
+        """Сбросить блоки и суперинструкции, которые содержат слово по адресу `address`."""
+        if address >= self.code_end:
+            return
+        super().invalidate(address)
+        for byte_address in range(address, address + 4):
+            for start in self.block_owners.pop(byte_address, ()):
+                self.blocks.pop(start, None)
@@ -1,5 +1,6 @@
 """Представление исходного и машинного кода."""
 
+import struct
 from collections import namedtuple
 from enum import Enum
 
@@ -112,6 +113,10 @@ opcode_to_size = {
 
 binary_to_opcode = {binary: opcode for opcode, binary in opcode_to_binary.items()}
 
+# Машинное слово: 32 бита, big-endian. `WORD.unpack_from(memory, address)[0]`
+# читает слово из памяти, `WORD.pack_into(memory, address, value)` -- записывает
+WORD = struct.Struct(">I")
+
 
 def to_bytes(code, first_ex_instr):
     """Преобразует машинный код в бинарное представление.
@@ -172,13 +177,17 @@ def to_bytes(code, first_ex_instr):
 
 
 def to_hex(code, variables_map):
-    addr_to_var = {addr: name for name, addr in variables_map.items()}
     """Преобразует машинный код в текстовый файл c шестнадцатеричным представлением.
 
     Формат вывода:
     <address> - <HEXCODE> - <mnemonic>
     """
-    binary_code = to_bytes(code, 8)
+    return binary_to_hex(to_bytes(code, 8), variables_map)
+
+
+def binary_to_hex(binary_code, variables_map):
+    """Шестнадцатеричное представление бинарного машинного кода (см. `to_hex`); заголовок не выводится."""
+    addr_to_var = {addr: name for name, addr in variables_map.items()}
     result = []
     after_halt = False
 
@@ -9,20 +9,212 @@
 - `ControlUnit` -- работа с памятью микрокоманд, интерпретация микрокоманд.
 
 - и набор вспомогательных функций: `simulation`, `main`.
+
+Кроме микропрограммного `ControlUnit` доступны более быстрые движки
+`fast_engine.InstructionUnit` (инструкции целиком) и `fast_engine.BlockUnit`
+(скомпилированные базовые блоки).
 """
 
+import argparse
+import itertools
 import logging
-import struct
+import mmap
 import sys
+import time
+from collections import namedtuple
+from functools import partial
 
+import checkpoint
+import profiler
 from alu import ALU
-from isa import binary_to_opcode, to_hex
+from fast_engine import BlockUnit, InstructionUnit, decode_instructions
+from isa import WORD, Opcode, binary_to_opcode, to_hex
 from microcode_util import SIGNAL_ORDER, Signal, linking_table
-from translator import Translator
+from superscalar import SuperscalarUnit
 
 MEMORY_MAPPED_INPUT_ADDRESS = 0
 MEMORY_MAPPED_OUTPUT_ADDRESS = 4
 MICROCOMAND_SIZE = 27
+MAX_MEMORY_SIZE = 1 << 24
+"Адреса 24-битные (аргумент инструкции, регистры AR и BR), поэтому память не больше 16 МБ."
+
+MMAP_MEMORY_SIZE = 1 << 20
+"Память этого размера и больше выделяется через анонимный `mmap`."
+
+INPUT_CHUNK_SIZE = 64 * 1024
+"Размер блока, которым читается файл ввода."
+
+CHECK_INTERVAL = 100_000
+"Период (в тактах) проверки бюджета времени и вызова `progress`."
+
+STOP_REASONS = ["halt", "input", "ticks", "instructions", "deadline"]
+"Причины остановки модели: HALT, конец ввода, бюджеты тактов, инструкций и времени."
+
+BUDGET_WARNINGS = {
+    "ticks": "Limit exceeded!",
+    "instructions": "Instruction limit exceeded!",
+    "deadline": "Deadline exceeded!",
+}
+
+ENGINES = ["microcode", "instruction", "block"]
+"Движки симуляции: по микрокомандам (`ControlUnit`), по инструкциям (`InstructionUnit`) и по блокам (`BlockUnit`)."
+
+TIMING_MODELS = [*ENGINES, "superscalar"]
+"""Движки и другие модели времени: `superscalar` (`superscalar.SuperscalarUnit`)
+выдает до двух инструкций за раз: тактов меньше, вывод тот же."""
+
+
+def encode_input(token):
+    """Представить токен ввода 32-битным словом: символ -- его код, число -- как есть."""
+    if isinstance(token, str):
+        token = ord(token)
+    return token & 0xFFFFFFFF
+
+
+def symbol_tokens(file, chunk_size=INPUT_CHUNK_SIZE):
+    """Лениво прочитать файл посимвольно (режим sym)."""
+    for chunk in iter(lambda: file.read(chunk_size), ""):
+        yield from chunk
+
+
+def number_tokens(file, chunk_size=INPUT_CHUNK_SIZE):
+    """Лениво прочитать из файла числа, разделенные запятыми (режимы dec, hex).
+
+    Пустые (пробельные) элементы пропускаются.
+    """
+    tail = ""
+    for chunk in iter(lambda: file.read(chunk_size), ""):
+        parts = (tail + chunk).split(",")
+        tail = parts.pop()
+        for part in parts:
+            if part.strip():
+                yield int(part)
+    if tail.strip():
+        yield int(tail)
+
+
+class InputDevice:
+    """Устройство ввода, отображенное на адрес `MEMORY_MAPPED_INPUT_ADDRESS`.
+
+    Токены берутся из итератора по одному (O(1) на чтение) и кодируются
+    в 32-битные слова, поэтому ввод из файла не загружается в память целиком.
+    """
+
+    tokens = None
+
+    position = None
+    "Сколько токенов уже прочитано."
+
+    def __init__(self, tokens):
+        self.tokens = map(encode_input, tokens)
+        self.position = 0
+
+    def read(self):
+        """Следующее слово ввода. Если ввод закончился -- EOFError."""
+        word = next(self.tokens, None)
+        if word is None:
+            raise EOFError()
+        self.position += 1
+        return word
+
+    def skip(self, count):
+        """Пропустить `count` токенов (уже прочитанных до контрольной точки)."""
+        self.tokens = itertools.islice(self.tokens, count, None)
+        self.position += count
+
+
+def format_output_value(value, sim_mode):
+    """Представление одного выведенного значения в режиме `sim_mode`."""
+    if sim_mode == "sym":
+        return chr(value)
+    if sim_mode == "dec":
+        return repr(value)
+    return repr(f"0x{(value & 0xFFFFFFFF):08X}")
+
+
+def format_output(output, sim_mode):
+    """Весь вывод программы в том виде, в котором его печатает `main`."""
+    if sim_mode == "sym":
+        return "".join(chr(code) for code in output)
+    return "[{}]".format(", ".join(format_output_value(value, sim_mode) for value in output))
+
+
+class OutputStream:
+    """Потоковое устройство вывода, отображенное на адрес `MEMORY_MAPPED_OUTPUT_ADDRESS`.
+
+    Подставляется в `DataPath` вместо списка `output_buffer`: каждое значение
+    сразу кодируется (sym/dec/hex) и копится в буфере, который сбрасывается
+    в поток блоками по `chunk_size` символов. После `close` в потоке тот же
+    текст, что печатает `main` без потокового вывода.
+    """
+
+    stream = None
+
+    sim_mode = None
+
+    chunk_size = None
+
+    pending = None
+    "Закодированные, но еще не записанные значения."
+
+    pending_size = None
+
+    count = None
+    "Сколько значений выведено."
+
+    def __init__(self, stream, sim_mode, chunk_size=4096):
+        self.stream = stream
+        self.sim_mode = sim_mode
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.pending_size = 0
+        self.count = 0
+        if sim_mode != "sym":
+            self.pending.append("[")
+
+    def append(self, value):
+        text = format_output_value(value, self.sim_mode)
+        if self.count > 0 and self.sim_mode != "sym":
+            text = ", " + text
+        self.count += 1
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.stream.write("".join(self.pending))
+        self.stream.flush()
+        self.pending = []
+        self.pending_size = 0
+
+    def close(self):
+        """Дописать окончание вывода и сбросить буфер."""
+        if self.sim_mode != "sym":
+            self.pending.append("]")
+        self.pending.append("\n")
+        self.flush()
+
+    def __repr__(self):
+        return "<output stream: {} values>".format(self.count)
+
+
+def allocate_memory(code, memory_size):
+    """Память процессора размером `memory_size` байт с загруженным в начало кодом.
+
+    Большая память выделяется анонимным `mmap`: страницы заполняются нулями
+    операционной системой при первом обращении, а не при запуске модели.
+    """
+    assert 0 < memory_size <= MAX_MEMORY_SIZE, "memory size should be in (0, {}]: {}".format(
+        MAX_MEMORY_SIZE, memory_size
+    )
+    assert len(code) <= memory_size, "code does not fit in memory: {} > {}".format(len(code), memory_size)
+    if memory_size >= MMAP_MEMORY_SIZE:
+        memory = mmap.mmap(-1, memory_size)
+    else:
+        memory = bytearray(memory_size)
+    memory[: len(code)] = code
+    return memory
 
 
 class DataPath:
@@ -58,9 +250,17 @@ class DataPath:
 
     DSP = None
 
-    input_buffer = None
+    input_device = None
+    "Устройство ввода (`InputDevice`)."
 
     output_buffer = None
+    "Вывод: список значений или `OutputStream`."
+
+    code_write_hooks = None
+    "Обработчики записи в область кода `[0, code_size)`: сбрасывают кэши декодированного кода."
+
+    block_runs = None
+    "Счетчики исполнения скомпилированных блоков, содержащих суперинструкции (см. `fast_engine.BlockUnit`)."
 
     def __init__(
         self,
@@ -68,10 +268,13 @@ class DataPath:
         data_memory_size,
         code_size,
         first_exec_instr,
-        input_buffer: list,
+        input_buffer,
         eam,
+        output_buffer=None,
+        wrap=False,
     ):
         assert data_memory_size > 0, "Data_memory size should be non-zero"
+        assert len(code) >= data_memory_size, "memory is smaller than data_memory_size: {}".format(len(code))
         self.code_size = code_size
         self.data_memory_size = data_memory_size
         self.data_memory = code
@@ -86,9 +289,22 @@ class DataPath:
         self.RSP = data_memory_size - 4
         self.DSP = code_size - 4
         # data stack будет расти вверх, а return stack вниз
-        self.input_buffer = input_buffer
-        self.output_buffer = []
-        self.ALU = ALU(eam)
+        if isinstance(input_buffer, InputDevice):
+            self.input_device = input_buffer
+        else:
+            self.input_device = InputDevice(input_buffer)
+        self.output_buffer = [] if output_buffer is None else output_buffer
+        self.ALU = ALU(eam, wrap)
+        self.code_write_hooks = []
+        self.block_runs = []
+
+    def load_word(self, address):
+        """Прочитать 32-битное слово (big-endian) по адресу `address`."""
+        return WORD.unpack_from(self.data_memory, address)[0]
+
+    def store_word(self, address, value):
+        """Записать 32-битное слово (big-endian) по адресу `address` в обход устройств вывода."""
+        WORD.pack_into(self.data_memory, address, value & 0xFFFFFFFF)
 
     def signal_latch_PC(self, sel):
         if sel == 3:
@@ -102,23 +318,14 @@ class DataPath:
 
     def signal_latch_CR(self):
         if self.DA == MEMORY_MAPPED_INPUT_ADDRESS:
-            element = self.input_buffer[0]
-            if isinstance(element, int):
-                num = element
-            elif isinstance(element, str) or isinstance(element, chr):
-                num = ord(element)
-
-            word = struct.pack(">I", num)  # Упаковываем в 4 байта (big-endian)
-            self.input_buffer.pop(0)
-            self.CR = (word[0] << 24) | (word[1] << 16) | (word[2] << 8) | (word[3])
+            self.CR = self.input_device.read()
 
         else:
-            self.CR = (
-                (self.data_memory[self.DA] << 24)
-                | (self.data_memory[self.DA + 1] << 16)
-                | (self.data_memory[self.DA + 2] << 8)
-                | (self.data_memory[self.DA + 3])
-            )
+            self.CR = WORD.unpack_from(self.data_memory, self.DA)[0]
+
+    def signal_branch(self):
+        """Условный переход: PC <- PC + 4, если условие выполнилось (z == 0), иначе PC <- BR."""
+        self.signal_latch_PC(1 - self.ALU.z)
 
     def signal_latch_IR(self):
         self.IR = (self.CR >> 24) & 0xFF
@@ -135,8 +342,9 @@ class DataPath:
             left = self.BR
         elif mux_sel == 3:
             left = self.CR
-        if left > 0:
-            left = struct.unpack("i", struct.pack("I", left))[0]
+        if left > 0x7FFFFFFF:
+            # 32-битное слово со знаком
+            left -= 0x100000000
         self.ALU.do_ALU(self.AC, left, operation)
 
     def signal_latch_AC(self):
@@ -183,10 +391,10 @@ class DataPath:
         if self.AR == MEMORY_MAPPED_OUTPUT_ADDRESS:
             self.output_buffer.append(self.AC)
         else:
-            self.data_memory[self.AR] = (self.AC >> 24) & 0xFF
-            self.data_memory[self.AR + 1] = (self.AC >> 16) & 0xFF
-            self.data_memory[self.AR + 2] = (self.AC >> 8) & 0xFF
-            self.data_memory[self.AR + 3] = (self.AC) & 0xFF
+            WORD.pack_into(self.data_memory, self.AR, self.AC & 0xFFFFFFFF)
+            if self.code_write_hooks and self.AR < self.code_size:
+                for hook in self.code_write_hooks:
+                    hook(self.AR)
 
 
 class ControlUnit:
@@ -204,10 +412,22 @@ class ControlUnit:
     _tick = None
     "Текущее модельное время процессора (в тактах). Инициализируется нулём."
 
-    def __init__(self, microprogram, data_path):
+    tracer = None
+    "Форматирование состояния для журнала. Создается при первом выводе."
+
+    rom = None
+    "Декодированная память микрокоманд: кортеж значений сигналов (в порядке `SIGNAL_ORDER`) на каждый адрес."
+
+    actions = None
+    "Действия микрокоманд по адресам `rom` (см. `compile_actions`)."
+
+    def __init__(self, microprogram, data_path, rom=None):
         self.microprogram = microprogram
+        self.rom = self.decode_microprogram(microprogram) if rom is None else rom
         self.mpc = 0
         self.data_path = data_path
+        self.actions = self.compile_actions() if data_path is not None else None
+        self.tracer = None
         self._tick = 0
 
     def tick(self):
@@ -226,6 +446,15 @@ class ControlUnit:
         """Текущее модельное время процессора (в тактах)."""
         return self._tick
 
+    def resume_point(self):
+        """(mpc, такт), с которых исполнение можно продолжить после остановки."""
+        return self.mpc, self._tick
+
+    def resume(self, mpc, tick):
+        """Продолжить с точки, полученной `resume_point`."""
+        self.mpc = mpc
+        self._tick = tick
+
     def instruction_decoder(self):
         opcode = binary_to_opcode[self.data_path.IR]
         if opcode in linking_table:
@@ -260,210 +489,691 @@ class ControlUnit:
 
         return signals
 
+    def decode_microprogram(self, microprogram):
+        """Однократно декодировать память микрокоманд.
+
+        Микрокоманды лежат по 4 байта (big-endian), `mpc` адресует байты,
+        поэтому микрокоманда с адресом `mpc` хранится в `rom[mpc >> 2]`.
+        """
+        rom = []
+        for address in range(0, len(microprogram) - 3, 4):
+            micro_instr = WORD.unpack_from(microprogram, address)[0]
+            signals = self.parse_microinstr(micro_instr)
+            rom.append(tuple(signals[name] for name in SIGNAL_ORDER))
+        return rom
+
+    def compile_actions(self):
+        """Один раз превратить каждую микрокоманду `rom` в список действий над `DataPath`.
+
+        Действие -- метод `data_path` с уже выставленными мультиплексорами,
+        в список попадают только активные сигналы, в том порядке, в котором
+        их выполняет аппаратура: CR раньше PC, АЛУ раньше защелок AC и DR и т.д.
+        Возвращает для каждого адреса (действия, MUX_mPC) или None, если
+        микрокоманда останавливает процессор (mPC = 0).
+        """
+        actions = []
+        dp = self.data_path
+        for (
+            signif,
+            lpc,
+            muxpc,
+            lcr,
+            lir,
+            lbr,
+            muxalu,
+            alu,
+            ldr,
+            lac,
+            muxar,
+            lar,
+            muxrsp,
+            lrsp,
+            muxdsp,
+            ldsp,
+            _oe,
+            wr,
+            mpc,
+            muxmpc,
+        ) in self.rom:
+            if mpc == 0:
+                actions.append(None)
+                continue
+            # по сути oe и lcr всегда равны
+            steps = []
+            if lcr == 1:
+                steps.append(dp.signal_latch_CR)
+            if lpc == 1 and signif == 1:
+                steps.append(dp.signal_branch)
+            elif lpc == 1:
+                steps.append(partial(dp.signal_latch_PC, muxpc))
+            if lir == 1:
+                steps.append(dp.signal_latch_IR)
+            if lbr == 1:
+                steps.append(dp.signal_latch_BR)
+            steps.append(partial(dp.signal_do_alu, muxalu, alu))  # что подаем на левый вход и какая операция
+            if ldr == 1:
+                steps.append(dp.signal_latch_DR)
+            if lac == 1:
+                steps.append(dp.signal_latch_AC)
+            if ldsp == 1:
+                steps.append(partial(dp.signal_latch_DSP, muxdsp))
+            if lar == 1:
+                steps.append(partial(dp.signal_latch_AR, muxar))
+            if lpc == 1 or lar == 1:
+                steps.append(partial(dp.signal_latch_DA, lar))
+            if lrsp == 1:
+                steps.append(partial(dp.signal_latch_RSP, muxrsp))
+            if wr == 1:
+                steps.append(dp.signal_wr)
+            actions.append((tuple(steps), muxmpc))
+        return actions
+
+    def rebind(self):
+        """Пересобрать действия после подмены методов `data_path` (см. `profiler.MemoryCounter`)."""
+        self.actions = self.compile_actions()
+
+    def fork(self, data_path):
+        """Новый блок управления над `data_path` с уже декодированной памятью микрокоманд."""
+        return ControlUnit(self.microprogram, data_path, self.rom)
+
     def process_next_tick(self):
-        micro_instr = (
-            (self.microprogram[self.mpc] << 24)
-            | (self.microprogram[self.mpc + 1] << 16)
-            | (self.microprogram[self.mpc + 2] << 8)
-            | (self.microprogram[self.mpc + 3])
-        )
-        signals = self.parse_microinstr(micro_instr)
-
-        # по сути oe и lcr всегда равны
-        PC_sel = signals[Signal.MUXPC]  # noqa: N806
-        if signals[Signal.SIGNIF] == 1:
-            PC_sel = 1 - self.data_path.ALU.z  # noqa: N806
-            # если z == 0, значит условие ВЫПОЛНИЛОСЬ, и нужно в мультиплексоре выбрать 1 (идти дальше)
-            # если z == 1, значит условие НЕ ВЫПОЛНИЛОСЬ, и нужно в мультиплексоре выбрать 0 (перепрыгнуть на else)
-        if signals[Signal.MPC] == 0:
+        action = self.actions[self.mpc >> 2]
+        if action is None:
             raise StopIteration()
+        steps, muxmpc = action
+        for step in steps:
+            step()
 
-        signal_LDA = signals[Signal.LPC] or signals[Signal.LAR]  # noqa: N806
-        if signals[Signal.LCR] == 1:
-            self.data_path.signal_latch_CR()
-        if signals[Signal.LPC] == 1:
-            self.data_path.signal_latch_PC(PC_sel)
-
-        if signals[Signal.LIR] == 1:
-            self.data_path.signal_latch_IR()
-        if signals[Signal.LBR] == 1:
-            self.data_path.signal_latch_BR()
-
-        self.data_path.signal_do_alu(
-            signals[Signal.MUXALU], signals[Signal.ALU]
-        )  # что подаем на левый вход и какая операция
-
-        if signals[Signal.LDR] == 1:
-            self.data_path.signal_latch_DR()
-        if signals[Signal.LAC] == 1:
-            self.data_path.signal_latch_AC()
-        if signals[Signal.LDSP] == 1:
-            self.data_path.signal_latch_DSP(signals[Signal.MUXDSP])
-        if signals[Signal.LAR] == 1:
-            self.data_path.signal_latch_AR(signals[Signal.MUXAR])
-        if signal_LDA == 1:
-            self.data_path.signal_latch_DA(signals[Signal.LAR])
-        if signals[Signal.LRSP] == 1:
-            self.data_path.signal_latch_RSP(signals[Signal.MUXRSP])
-        if signals[Signal.WR] == 1:
-            self.data_path.signal_wr()
-
-        if signals[Signal.MPC] == 1:
-            self.signal_latch_mpc(signals[Signal.MUXMPC])
-        else:
-            raise StopIteration()
+        self.signal_latch_mpc(muxmpc)
 
         self.tick()
 
     def __repr__(self):
         """Вернуть строковое представление состояния процессора."""
-        state_repr = "TICK: {:3} PC: {:3} DA: {:3} AC: {} DR: {} CR: {} BR: {} RSP: {} DSP: {}".format(
-            self._tick,
-            self.data_path.PC,
-            self.data_path.DA,
-            self.data_path.AC,
-            self.data_path.DR,
-            self.data_path.CR,
-            self.data_path.BR,
-            self.data_path.RSP,
-            self.data_path.DSP,
-        )
+        if self.tracer is None:
+            self.tracer = Tracer(self.data_path)
+        return self.tracer.state(self._tick)
+
 
-        # это бинарный код
-        index = self.data_path.PC
+class Tracer:
+    """Форматирование состояния процессора для журнала (уровень DEBUG).
+
+    Дизассемблер кэширует строки инструкций по адресу. Кэш строится один раз
+    по загруженному коду (от начала до `HALT` основной программы) и сбрасывается
+    только для адресов, в которые `DataPath.signal_wr` записал данные.
+    """
+
+    data_path = None
+
+    disassembly = None
+    "Кэш дизассемблера: адрес -> строка инструкции."
+
+    def __init__(self, data_path):
+        self.data_path = data_path
+        entry = data_path.PC
+        self.disassembly = {
+            address: self.disassemble(address)
+            for address, _, _ in decode_instructions(
+                data_path.data_memory,
+                data_path.data_memory_size,
+                8,
+                lambda address, opcode: opcode == Opcode.HALT and address >= entry,
+            )
+        }
+        data_path.code_write_hooks.append(self.invalidate)
+
+    def instruction(self, index):
+        """Строковое представление инструкции по адресу `index`."""
+        text = self.disassembly.get(index)
+        if text is None:
+            text = self.disassemble(index)
+            self.disassembly[index] = text
+        return text
+
+    def invalidate(self, address):
+        """Сбросить инструкции, которые пересекаются со словом по адресу `address`."""
+        for index in range(address - 3, address + 4):
+            self.disassembly.pop(index, None)
+
+    def disassemble(self, index):
         instr = self.data_path.data_memory[index]
         opcode = binary_to_opcode[instr]
         instr_repr = str(opcode)
         if (instr & 0x1) == 1:
-            arg = (
-                (self.data_path.data_memory[index + 1] << 16)
-                | (self.data_path.data_memory[index + 2] << 8)
-                | self.data_path.data_memory[index + 3]
-            )
+            arg = self.data_path.load_word(index) & 0xFFFFFF
             command = {"address": index, "opcode": opcode, "arg": arg}
             instr_repr += " {}".format(arg)
         else:
             command = {"address": index, "opcode": opcode}
 
-        trans = Translator()
-        instr_hex = to_hex([command], trans.variables_map)
+        instr_hex = to_hex([command], {})
+        return "{} [{}]".format(instr_repr, instr_hex)
+
+    def state(self, tick):
+        """Строка журнала: регистры и инструкция по адресу PC."""
+        dp = self.data_path
+        return "TICK: {:3} PC: {:3} DA: {:3} AC: {} DR: {} CR: {} BR: {} RSP: {} DSP: {} {}".format(
+            tick,
+            dp.PC,
+            dp.DA,
+            dp.AC,
+            dp.DR,
+            dp.CR,
+            dp.BR,
+            dp.RSP,
+            dp.DSP,
+            self.instruction(dp.PC),
+        )
 
-        return "{} {} [{}]".format(state_repr, instr_repr, instr_hex)
 
+class Execution:
+    """Исполнение блока управления отрезками: до заданного такта или до
+    исчерпания бюджета инструкций (см. `simulate`).
+    """
 
-def simulation(
-    binary_code, microcode, input_tokens, data_memory_size, code_size, limit, eam
-):
-    first_exec_instr = (
-        (binary_code[4] << 24)
-        | (binary_code[5] << 16)
-        | (binary_code[6] << 8)
-        | (binary_code[7])
-    )
+    retired = None
+    "Число исполненных инструкций (считается, только если задан бюджет инструкций, идет трассировка или профилирование)."
 
-    data_path = DataPath(
-        binary_code, data_memory_size, code_size, first_exec_instr, input_tokens, eam
-    )
-    control_unit = ControlUnit(microcode, data_path)
+    max_instructions = None
+    "Бюджет инструкций (бесконечность, если не задан)."
 
-    prev_pc = -1
+    profiler = None
+    "Профилировщик (`profiler.Profiler`, `MemoryCounter`, `Group`), которому передается каждая инструкция, или None."
 
-    try:
-        while control_unit._tick < limit:
-            if prev_pc != control_unit.data_path.PC:
+    started = None
+    """Начало исполняемой по микрокомандам инструкции: (PC, слово инструкции, такт) или None.
+
+    Хранится между вызовами `run_until`: инструкция, начатая в одном отрезке
+    и законченная в следующем, записывается в профиль целиком.
+    """
+
+    def __init__(self, control_unit, engine, trace, instruction_limit=None, profiler=None):
+        self.control_unit = control_unit
+        self.engine = engine
+        self.trace = trace
+        self.profiler = profiler
+        self.counted = trace or instruction_limit is not None or profiler is not None
+        self.max_instructions = float("inf") if instruction_limit is None else instruction_limit
+        self.tracer = Tracer(control_unit.data_path) if trace and engine != "microcode" else None
+        self.prev_pc = -1
+        self.retired = 0
+        if profiler is not None:
+            profiler.start(control_unit.current_tick(), control_unit.data_path)
+            if engine == "microcode":
+                control_unit.rebind()
+
+    def run_until(self, limit):
+        """Исполнять до `limit` тактов или до исчерпания бюджета инструкций."""
+        if self.engine == "microcode" and self.counted:
+            self.run_microcode(limit)
+        elif self.engine == "microcode":
+            control_unit = self.control_unit
+            while control_unit._tick < limit:
+                control_unit.process_next_tick()
+        elif self.counted:
+            self.run_instructions(limit)
+        else:
+            self.control_unit.run(limit)
+
+    def run_microcode(self, limit):
+        """Исполнять по микрокомандам, отмечая границы инструкций (mpc == 0)."""
+        control_unit = self.control_unit
+        data_path = control_unit.data_path
+        profiler = self.profiler
+        while control_unit._tick < limit and self.retired < self.max_instructions:
+            if self.trace and self.prev_pc != data_path.PC:
                 logging.debug("%s", control_unit)
-                prev_pc = control_unit.data_path.PC
-            control_unit.process_next_tick()
+                self.prev_pc = data_path.PC
+            if control_unit.mpc == 0:
+                self.started = (data_path.PC, data_path.data_memory[data_path.PC], control_unit._tick)
+            try:
+                control_unit.process_next_tick()
+            except StopIteration:
+                if profiler is not None and self.started is not None:
+                    profiler.record(*self.started, control_unit._tick, data_path.PC)
+                raise
+            if control_unit.mpc == 0:
+                self.retired += 1
+                if profiler is not None and self.started is not None:
+                    profiler.record(*self.started, control_unit._tick, data_path.PC)
+
+    def run_instructions(self, limit):
+        """Исполнять быстрым движком по одной инструкции."""
+        control_unit = self.control_unit
+        data_path = control_unit.data_path
+        profiler = self.profiler
+        while self.retired < self.max_instructions:
+            if self.trace:
+                logging.debug("%s", self.tracer.state(control_unit.current_tick()))
+            started = (data_path.PC, data_path.data_memory[data_path.PC], control_unit.current_tick())
+            try:
+                if not control_unit.step(limit):
+                    break
+            except StopIteration:
+                if profiler is not None:
+                    profiler.record(*started, control_unit.current_tick(), data_path.PC)
+                raise
+            self.retired += 1
+            if profiler is not None:
+                profiler.record(*started, control_unit.current_tick(), data_path.PC)
+
+
+class SimulationResult(namedtuple("SimulationResult", "output ticks instructions stop_reason")):
+    """Итог запуска модели: вывод, такты, число исполненных инструкций
+    (None, если не подсчитывалось) и причина остановки (`STOP_REASONS`).
+    """
+
+
+def simulate(
+    binary_code,
+    microcode,
+    input_tokens,
+    data_memory_size,
+    code_size,
+    limit,
+    eam,
+    engine="microcode",
+    fuse=True,
+    output_buffer=None,
+    restore=None,
+    checkpoint_file=None,
+    instruction_limit=None,
+    deadline=None,
+    progress=None,
+    check_interval=CHECK_INTERVAL,
+    profiler=None,
+    wrap=False,
+    template=None,
+):
+    """Запустить модель процессора до `HALT`, конца ввода или исчерпания бюджета.
+
+    Бюджеты: `limit` -- тактов, `instruction_limit` -- исполненных инструкций
+    (инструкции считаются только если он задан), `deadline` -- секунд реального
+    времени. Время проверяется раз в `check_interval` тактов (у быстрых
+    движков -- не чаще, чем длится самая долгая инструкция); тогда же
+    вызывается `progress(такты, тактов в секунду)`. Без `deadline` и `progress`
+    модель исполняется без остановок на проверки.
+
+    `restore` -- контрольная точка (`checkpoint.State`), с которой продолжить
+    исполнение; тогда `binary_code`, размеры, `eam` и `wrap` берутся из нее.
+    `checkpoint_file` -- куда сохранить состояние после остановки.
+    `profiler` -- `profiler.Profiler`, `profiler.MemoryCounter` или их
+    `profiler.Group`, который собирает профиль исполнения (модель исполняется
+    по одной инструкции). `wrap` -- 32-битная арифметика АЛУ (см. `alu`).
+    `template` -- готовый блок управления движка `engine` над тем же
+    машинным кодом (см. `make_control_unit`). Возвращает `SimulationResult`.
+    """
+    if restore is None:
+        first_exec_instr = (
+            (binary_code[4] << 24)
+            | (binary_code[5] << 16)
+            | (binary_code[6] << 8)
+            | (binary_code[7])
+        )
+        data_path = DataPath(
+            binary_code, data_memory_size, code_size, first_exec_instr, input_tokens, eam, output_buffer, wrap
+        )
+        control_unit = make_control_unit(engine, microcode, data_path, fuse, template)
+    else:
+        control_unit = restore_control_unit(restore, engine, microcode, input_tokens, fuse, output_buffer)
+        data_path = control_unit.data_path
+
+    # трассировка включается один раз, а не проверяется на каждом такте
+    trace = logging.getLogger().isEnabledFor(logging.DEBUG)
+    execution = Execution(control_unit, engine, trace, instruction_limit, profiler)
+
+    stop_reason = None
+    if restore is not None and restore.halted:
+        stop_reason = "halt"
+    sliced = deadline is not None or progress is not None
+    if sliced and engine != "microcode":
+        # быстрые движки не начинают инструкцию, которая не успевает завершиться до конца отрезка:
+        # отрезок должен вмещать хотя бы самую долгую инструкцию, иначе исполнение не продвинется
+        check_interval = max(check_interval, max(control_unit.spans.values()))
+    started = time.perf_counter()
+    try:
+        while stop_reason is None:
+            slice_start = (time.perf_counter(), control_unit.current_tick())
+            execution.run_until(min(limit, slice_start[1] + check_interval) if sliced else limit)
+            if execution.retired >= execution.max_instructions:
+                stop_reason = "instructions"
+            elif control_unit.current_tick() >= limit:
+                stop_reason = "ticks"
+            elif sliced:
+                # конец отрезка: быстрые движки доводят время до границы отрезка, откатываем
+                control_unit.resume(*control_unit.resume_point())
+                now = time.perf_counter()
+                if progress is not None:
+                    ticks = control_unit.current_tick()
+                    progress(ticks, (ticks - slice_start[1]) / max(now - slice_start[0], 1e-9))
+                if deadline is not None and now - started >= deadline:
+                    stop_reason = "deadline"
     except EOFError:
         logging.warning("Input buffer is empty!")
+        stop_reason = "input"
     except StopIteration:
-        pass
-
-    if control_unit._tick >= limit:
-        logging.warning("Limit exceeded!")
+        stop_reason = "halt"
+        execution.retired += 1
+    finally:
+        # и при ошибке в программе: профилировщик отключается от тракта данных
+        if profiler is not None:
+            profiler.finish(control_unit.current_tick())
+            if engine == "microcode":
+                control_unit.rebind()
+
+    if stop_reason in BUDGET_WARNINGS:
+        logging.warning(BUDGET_WARNINGS[stop_reason])
+    if engine == "superscalar":
+        log_issue(control_unit)
+    elif engine != "microcode":
+        log_fusion(control_unit)
     logging.info("output_buffer: %s", data_path.output_buffer)
-    return data_path.output_buffer, control_unit.current_tick()
+    if checkpoint_file is not None:
+        with open(checkpoint_file, "wb") as file:
+            checkpoint.save(file, checkpoint.capture(control_unit, engine, stop_reason == "halt"))
+    instructions = execution.retired if instruction_limit is not None else None
+    return SimulationResult(data_path.output_buffer, control_unit.current_tick(), instructions, stop_reason)
 
 
-def main(code_file, input_file, memory_size, sim_mode, eam):
+def simulation(*args, **kwargs):
+    """Запустить модель процессора (см. `simulate`). Возвращает (вывод, такты)."""
+    result = simulate(*args, **kwargs)
+    return result.output, result.ticks
+
+
+def make_control_unit(engine, microcode, data_path, fuse=True, template=None):
+    """Блок управления движка `engine` над `data_path`.
+
+    `template` -- блок управления того же движка над тем же машинным кодом:
+    новый блок берет у него декодированные микрокоманды и скомпилированный код (`fork`).
+    """
+    assert engine in TIMING_MODELS, "Unknown engine: {}".format(engine)
+    if template is not None:
+        return template.fork(data_path)
+    if engine == "instruction":
+        return InstructionUnit(data_path, fuse)
+    if engine == "block":
+        return BlockUnit(data_path, fuse)
+    if engine == "superscalar":
+        return SuperscalarUnit(data_path)
+    return ControlUnit(microcode, data_path)
+
+
+def restore_control_unit(state, engine, microcode, input_tokens, fuse=True, output_buffer=None):
+    """Восстановить блок управления движка `engine` из контрольной точки `state` (`checkpoint.State`).
+
+    `input_tokens` -- тот же ввод, что и у прерванного запуска: уже прочитанные
+    токены пропускаются. Движок может отличаться от сохранившего состояние,
+    если контрольная точка на границе инструкций. `eam` и разрядность АЛУ
+    (`wrap`) берутся из контрольной точки.
+    """
+    memory = allocate_memory(state.memory, state.memory_size)
+    if not isinstance(input_tokens, InputDevice):
+        input_tokens = InputDevice(input_tokens)
+    input_tokens.skip(state.input_position)
+    # PC точки входа нужен быстрым движкам, чтобы найти конец основной программы
+    first_exec_instr = WORD.unpack_from(memory, 4)[0]
+    data_path = DataPath(
+        memory, state.memory_size, state.code_size, first_exec_instr, input_tokens, state.eam, output_buffer, state.wrap
+    )
+    if isinstance(data_path.output_buffer, list):
+        data_path.output_buffer.extend(state.output)
+    control_unit = make_control_unit(engine, microcode, data_path, fuse)
+
+    for name, value in zip(checkpoint.REGISTERS, state.registers):
+        setattr(data_path, name, value)
+    for name, value in zip(checkpoint.ALU_FIELDS, state.alu):
+        setattr(data_path.ALU, name, value)
+    # модель, остановленная по HALT, дальше не исполняется, и mpc не важен
+    control_unit.resume(0 if state.halted and engine != "microcode" else state.mpc, state.tick)
+    if engine == "superscalar" and state.engine == "superscalar":
+        control_unit.open_group = state.group
+    return control_unit
+
+
+def log_fusion(control_unit):
+    """Записать в журнал, какую часть тактов покрыли суперинструкции."""
+    counts = control_unit.fusion_counts()
+    total_ticks = max(control_unit.current_tick(), 1)
+    fused_ticks = 0
+    for name, hits in sorted(counts.items(), key=lambda item: -item[1]):
+        ticks = hits * control_unit.fused_ticks[name]
+        fused_ticks += ticks
+        logging.info("fused %s: %d hits, %d ticks (%.1f%%)", name, hits, ticks, 100 * ticks / total_ticks)
+    if counts:
+        logging.info("fused total: %d ticks (%.1f%%)", fused_ticks, 100 * fused_ticks / total_ticks)
+
+
+def log_issue(control_unit):
+    """Записать в журнал статистику выдачи суперскалярной модели."""
+    counts = control_unit.issue_counts()
+    logging.info(
+        "issued %d instructions in %d groups (%d pairs), IPC %.3f, pairing ratio %.3f",
+        counts["instructions"],
+        counts["groups"],
+        counts["pairs"],
+        counts["instructions"] / max(counts["ticks"], 1),
+        counts["instructions"] / max(counts["groups"], 1),
+    )
+    logging.info(
+        "ticks %d, scalar %d (speedup %.3f)",
+        counts["ticks"],
+        counts["scalar_ticks"],
+        counts["scalar_ticks"] / max(counts["ticks"], 1),
+    )
+
+
+def main(
+    code_file,
+    input_file,
+    memory_size,
+    sim_mode,
+    eam,
+    engine="microcode",
+    fuse=True,
+    trace_level=None,
+    output_file=None,
+    checkpoint_file=None,
+    restore_file=None,
+    limit=20000,
+    instruction_limit=None,
+    deadline=None,
+    progress=None,
+    profile_file=None,
+    flamegraph_file=None,
+    heatmap_file=None,
+    wrap=False,
+):
     """Функция запуска модели процессора. Параметры -- имена файлов с машинным
     кодом и с входными данными для симуляции.
-    """
 
-    microcode_file = "microcode.bin"
+    `trace_level` -- уровень журнала (`logging.DEBUG` включает трассировку
+    состояния процессора); None -- оставить текущую настройку `logging`.
 
-    const_data_memory_size = 1000
-    # файл с бинарным кодом
-    with open(code_file, "rb") as file:
-        bin_code = file.read()
+    `output_file` -- куда выводить по мере исполнения: "-" -- stdout, иначе
+    имя файла. None -- собрать вывод в список и напечатать после останова.
 
-    code_size = len(bin_code)
+    `checkpoint_file` -- сохранить состояние после остановки; `restore_file` --
+    продолжить с сохраненного состояния (машинный код, размер памяти, `eam`
+    и `wrap` берутся из него, ввод -- тот же файл). Вывод до контрольной точки
+    сохраняется, только если он не потоковый.
 
-    bin_code += bytes(const_data_memory_size - code_size)
+    `limit`, `instruction_limit`, `deadline`, `progress` -- бюджеты и отчет
+    о прогрессе (см. `simulate`). Причина остановки печатается в stderr.
 
-    binary_code = bytearray(bin_code)
+    `profile_file` -- собрать профиль исполнения и записать его в этот файл
+    (JSON) и в `profile_file`.txt (таблицы). Имена слов берутся из файла
+    символов транслятора `code_file`.sym, если он есть. `flamegraph_file` --
+    записать такты по цепочкам вызовов в формате collapsed stacks.
+    `heatmap_file` -- записать тепловую карту обращений к памяти (CSV, или
+    NPY для имени `.npy`) и сводку по областям и опкодам в `heatmap_file`.txt.
+
+    `wrap` -- 32-битная арифметика АЛУ с переполнением (по умолчанию
+    результаты не ограничены, как в golden-тестах).
+    """
+    if trace_level is not None:
+        logging.getLogger().setLevel(trace_level)
+
+    microcode_file = "microcode.bin"
+
+    if restore_file is None:
+        restore = None
+        # файл с бинарным кодом
+        with open(code_file, "rb") as file:
+            bin_code = file.read()
+        code_size = len(bin_code)
+        binary_code = allocate_memory(bin_code, memory_size)
+    else:
+        with open(restore_file, "rb") as file:
+            restore = checkpoint.load(file)
+        binary_code = None
+        code_size = restore.code_size
+
+    profile = memory_counter = observer = None
+    if profile_file is not None or flamegraph_file is not None or heatmap_file is not None:
+        symbols = profiler.load_symbols(code_file + ".sym")
+        if profile_file is not None or flamegraph_file is not None:
+            profile = profiler.Profiler(symbols)
+        if heatmap_file is not None:
+            memory_counter = profiler.MemoryCounter(symbols)
+        observer = profiler.Group(*(item for item in (profile, memory_counter) if item is not None))
 
     # память микрокоманд
     with open(microcode_file, "rb") as mfile:
         microcode = mfile.read()
 
     with open(input_file, encoding="utf-8") as file:
-        input_text = file.read()
-        input_token = []
         if sim_mode == "sym":
-            for char in input_text:
-                input_token.append(char)
-        elif "," in input_text:
-            for el in input_text.split(","):
-                input_token.append(int(el))
-        input_token.append(0)  # чтобы сделать cstr
-
-    output, ticks = simulation(
-        binary_code,
-        microcode,
-        input_tokens=input_token,
-        data_memory_size=memory_size,
-        code_size=code_size,
-        limit=20000,
-        eam=eam,
-    )
+            tokens = symbol_tokens(file)
+        else:
+            tokens = number_tokens(file)
+        input_device = InputDevice(itertools.chain(tokens, [0]))  # 0 в конце, чтобы сделать cstr
 
-    if sim_mode == "sym":
-        symbol_output = "".join(chr(code) for code in output)
-        print(symbol_output)
-    elif sim_mode == "dec":
-        print(output)
+        if output_file is None:
+            output_stream = None
+        elif output_file == "-":
+            output_stream = OutputStream(sys.stdout, sim_mode)
+        else:
+            output_stream = OutputStream(open(output_file, "w", encoding="utf-8"), sim_mode)
+
+        output, ticks, _, stop_reason = simulate(
+            binary_code,
+            microcode,
+            input_tokens=input_device,
+            data_memory_size=memory_size,
+            code_size=code_size,
+            limit=limit,
+            eam=eam,
+            engine=engine,
+            fuse=fuse,
+            output_buffer=output_stream,
+            restore=restore,
+            checkpoint_file=checkpoint_file,
+            instruction_limit=instruction_limit,
+            deadline=deadline,
+            progress=progress,
+            profiler=observer,
+            wrap=wrap,
+        )
+
+    if profile_file is not None:
+        profile.save(profile_file)
+    if flamegraph_file is not None:
+        profile.save_collapsed(flamegraph_file)
+    if heatmap_file is not None:
+        memory_counter.save(heatmap_file)
+
+    if output_stream is None:
+        print(format_output(output, sim_mode))
     else:
-        hex_output = []
-        for el in output:
-            hex_el = f"0x{(el & 0xFFFFFFFF):08X}"
-            hex_output.append(hex_el)
-        print(hex_output)
+        output_stream.close()
+        if output_stream.stream is not sys.stdout:
+            output_stream.stream.close()
 
     print("ticks:", ticks)
+    print("stopped:", stop_reason, file=sys.stderr)
+
+
+def print_progress(ticks, ticks_per_second):
+    """Отчет о прогрессе для `simulate` в stderr."""
+    print("ticks: {} ({:,.0f} ticks/s)".format(ticks, ticks_per_second), file=sys.stderr)
+
+
+TRACE_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AccForth processor model")
+    parser.add_argument("code_file")
+    parser.add_argument("input_file")
+    parser.add_argument("memory_size", type=int)
+    # mode: dec, sym, hex
+    parser.add_argument("mode", choices=["dec", "sym", "hex"])
+    parser.add_argument("eam")
+    parser.add_argument("--engine", choices=TIMING_MODELS, default="microcode")
+    parser.add_argument(
+        "--no-fuse", dest="fuse", action="store_false", help="не сливать POP_AC/POP_DR/<op> в суперинструкции"
+    )
+    parser.add_argument(
+        "--trace-level",
+        choices=TRACE_LEVELS,
+        default="info",
+        help="уровень журнала machine.log (debug -- трассировка каждой инструкции)",
+    )
+    parser.add_argument(
+        "--output",
+        dest="output_file",
+        help="выводить по мере исполнения: '-' -- в stdout, иначе в указанный файл",
+    )
+    parser.add_argument("--checkpoint", dest="checkpoint_file", help="сохранить состояние модели после остановки")
+    parser.add_argument("--restore", dest="restore_file", help="продолжить исполнение из контрольной точки")
+    parser.add_argument("--limit", type=int, default=20000, help="предел числа тактов")
+    parser.add_argument("--instruction-limit", type=int, help="предел числа исполненных инструкций")
+    parser.add_argument("--deadline", type=float, help="предел реального времени исполнения, секунд")
+    parser.add_argument("--progress", action="store_true", help="печатать в stderr такты и тактов в секунду")
+    parser.add_argument(
+        "--profile", dest="profile_file", help="записать профиль исполнения (JSON и таблицы в <file>.txt)"
+    )
+    parser.add_argument(
+        "--flamegraph", dest="flamegraph_file", help="записать такты по цепочкам вызовов (collapsed stacks)"
+    )
+    parser.add_argument(
+        "--heatmap", dest="heatmap_file", help="записать тепловую карту обращений к памяти (CSV или .npy)"
+    )
+    parser.add_argument("--wrap", action="store_true", help="32-битные результаты АЛУ (по модулю 2^32)")
+    args = parser.parse_args()
+
     logging.basicConfig(
-        level=logging.DEBUG,
+        level=TRACE_LEVELS[args.trace_level],
         format="%(levelname)s   machine:simulation    %(message)s",
         filename="machine.log",
         filemode="w",
     )
-    assert len(sys.argv) == 6, (
-        "Signal.WRong arguments: machine.py <code_file> <input_file> <memory_size> <mode> <eam>"
-    )
-    code_file = sys.argv[1]
-    input_file = sys.argv[2]
-    memory_size = int(sys.argv[3])
-    # mode: dec, sym, hex
-    sim_mode = sys.argv[4]
-    assert sim_mode in ["dec", "sym", "hex"], (
-        "Simulation mode can be only: dec, sym, hex"
-    )
-    if sys.argv[5] == "True" or sys.argv[5] == "1":
-        eam = True
-    else:
-        eam = False
 
-    main(code_file, input_file, memory_size, sim_mode, eam)
+    eam = args.eam == "True" or args.eam == "1"
+
+    main(
+        args.code_file,
+        args.input_file,
+        args.memory_size,
+        args.mode,
+        eam,
+        engine=args.engine,
+        fuse=args.fuse,
+        output_file=args.output_file,
+        checkpoint_file=args.checkpoint_file,
+        restore_file=args.restore_file,
+        limit=args.limit,
+        instruction_limit=args.instruction_limit,
+        deadline=args.deadline,
+        progress=print_progress if args.progress else None,
+        profile_file=args.profile_file,
+        flamegraph_file=args.flamegraph_file,
+        heatmap_file=args.heatmap_file,
+        wrap=args.wrap,
+    )
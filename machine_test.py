@@ -0,0 +1,673 @@
+"""Тесты модели процессора: альтернативные движки симуляции, трассировка, ввод-вывод, пакетная симуляция.
+
+Вывод и число тактов быстрых движков на golden-программах должны совпадать
+с микропрограммной моделью. Трассировка в этих тестах выключена (уровень INFO),
+чтобы быстрые движки исполнялись блоками и суперинструкциями.
+"""
+
+import contextlib
+import io
+import itertools
+import logging
+import mmap
+import os
+import tempfile
+
+import alu
+import batch
+import checkpoint
+import fast_engine
+import machine
+import profiler
+import pytest
+import superscalar
+import translator
+from isa import Opcode
+from translator_test import compile_source
+
+
+def run_golden(golden, **kwargs):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        source = os.path.join(tmpdirname, "source.forth")
+        input_stream = os.path.join(tmpdirname, "input.txt")
+        target = os.path.join(tmpdirname, "target.bin")
+
+        with open(source, "w", encoding="utf-8") as file:
+            file.write(golden["in_source"])
+        with open(input_stream, "w", encoding="utf-8") as file:
+            file.write(golden["in_stdin"])
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            translator.main(source, target)
+            print("============================================================")
+            machine.main(
+                target,
+                input_stream,
+                golden["in_memory_size"],
+                golden["in_sim_mode"],
+                golden["in_eam"],
+                **kwargs,
+            )
+    return stdout.getvalue()
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_instruction_engine(golden, caplog):
+    caplog.set_level(logging.INFO)
+    assert run_golden(golden, engine="instruction") == golden.out["out_stdout"]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_block_engine(golden, caplog):
+    caplog.set_level(logging.INFO)
+    assert run_golden(golden, engine="block") == golden.out["out_stdout"]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_engines_without_fusion(golden, caplog):
+    caplog.set_level(logging.INFO)
+    assert run_golden(golden, engine="instruction", fuse=False) == golden.out["out_stdout"]
+    assert run_golden(golden, engine="block", fuse=False) == golden.out["out_stdout"]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_streaming_output(golden, caplog):
+    caplog.set_level(logging.INFO)
+    assert run_golden(golden, engine="block", output_file="-") == golden.out["out_stdout"]
+
+
+def make_data_path(tmp_path, text):
+    source = tmp_path / "source.forth"
+    target = tmp_path / "target.bin"
+    source.write_text(text, encoding="utf-8")
+    compile_source(source, target)
+    code = target.read_bytes()
+    first_exec_instr = int.from_bytes(code[4:8], "big")
+    return machine.DataPath(bytearray(code + bytes(100)), 100 + len(code), len(code), first_exec_instr, [0], False)
+
+
+@pytest.mark.parametrize("unit_class", [fast_engine.InstructionUnit, fast_engine.BlockUnit])
+def test_superinstruction_hits(tmp_path, unit_class):
+    data_path = make_data_path(tmp_path, "3 VARIABLE x BEGIN x @ 0 > WHILE x @ 1 - x ! REPEAT x @ 4 ! HALT")
+    unit = unit_class(data_path)
+    with pytest.raises(StopIteration):
+        unit.run(10000)
+    assert data_path.output_buffer == [0]
+    counts = unit.fusion_counts()
+    assert counts["popac+popdr+greater"] == 4
+    assert counts["popac+popdr+sub"] == 3
+    assert counts["popdr+popac+save"] == 4
+
+
+def test_block_fork_counts_its_own_superinstructions(tmp_path):
+    source = "3 VARIABLE x BEGIN x @ 0 > WHILE x @ 1 - x ! REPEAT x @ 4 ! HALT"
+    template = fast_engine.BlockUnit(make_data_path(tmp_path, source))
+    template.compile_code()
+    forks = [template.fork(make_data_path(tmp_path, source)) for _ in range(2)]
+    for unit in forks:
+        with pytest.raises(StopIteration):
+            unit.run(10000)
+        assert unit.fusion_counts()["popdr+popac+save"] == 4
+    assert forks[0].fusion_counts() == forks[1].fusion_counts()
+    assert not any(template.fusion_counts().values())
+
+
+def test_block_cache_invalidated_on_code_write(tmp_path):
+    data_path = make_data_path(tmp_path, "1 2 + 4 ! HALT")
+    unit = fast_engine.BlockUnit(data_path)
+    with pytest.raises(StopIteration):
+        unit.run(1000)
+    assert data_path.output_buffer == [3]
+    assert 8 in unit.blocks
+
+    data_path.AR = 12
+    data_path.signal_wr()
+    assert 8 not in unit.blocks
+
+
+def test_tracer_invalidated_on_code_write(tmp_path):
+    data_path = make_data_path(tmp_path, "1 2 + 4 ! HALT")
+    tracer = machine.Tracer(data_path)
+    assert tracer.instruction(8).startswith("loadimm 1 [")
+
+    data_path.AR = 8
+    data_path.AC = 0x26000000  # halt
+    data_path.signal_wr()
+    assert tracer.instruction(8) == "halt [0x8 -         26 - halt]"
+
+
+def test_number_tokens_across_chunks():
+    tokens = machine.number_tokens(io.StringIO("5,16,-3, 1000\n,2,"), chunk_size=3)
+    assert list(tokens) == [5, 16, -3, 1000, 2]
+
+
+def test_input_device_streams_tokens():
+    device = machine.InputDevice(machine.symbol_tokens(io.StringIO("ab"), chunk_size=1))
+    assert device.read() == ord("a")
+    assert device.read() == ord("b")
+    assert device.position == 2
+    with pytest.raises(EOFError):
+        device.read()
+
+
+@pytest.mark.parametrize("sim_mode", ["sym", "dec", "hex"])
+def test_output_stream_matches_print(sim_mode):
+    values = [72, 105, 33, 10, 0x7FFF] if sim_mode == "sym" else [72, 105, -1, 10, 0x7FFFFFFF]
+    stream = io.StringIO()
+    output = machine.OutputStream(stream, sim_mode, chunk_size=2)
+    for value in values[:2]:
+        output.append(value)
+    assert stream.getvalue() != ""
+    for value in values[2:]:
+        output.append(value)
+    output.close()
+    assert stream.getvalue() == machine.format_output(values, sim_mode) + "\n"
+
+
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_large_memory(tmp_path, caplog, engine):
+    caplog.set_level(logging.INFO)
+    target = tmp_path / "target.bin"
+    input_file = tmp_path / "input.txt"
+    input_file.write_text("Alice", encoding="utf-8")
+
+    def run(memory_size):
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            machine.main(str(target), str(input_file), memory_size, "sym", False, engine=engine)
+        return stdout.getvalue()
+
+    compile_source("examples/hello_user_name.forth", target)
+    assert run(machine.MAX_MEMORY_SIZE) == run(1000)
+
+
+def test_allocate_memory():
+    memory = machine.allocate_memory(b"\x01\x02", machine.MAX_MEMORY_SIZE)
+    assert isinstance(memory, mmap.mmap)
+    assert memory[:3] == b"\x01\x02\x00"
+    assert memory[-1] == 0
+    assert isinstance(machine.allocate_memory(b"\x01\x02", 1000), bytearray)
+    with pytest.raises(AssertionError):
+        machine.allocate_memory(b"\x01\x02", machine.MAX_MEMORY_SIZE + 4)
+    with pytest.raises(AssertionError):
+        machine.allocate_memory(bytes(100), 50)
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_simulate_many(tmp_path, workers):
+    target = tmp_path / "target.bin"
+    compile_source("examples/hello_user_name.forth", target)
+    binary = target.read_bytes()
+    configs = [batch.Config(eam=False, memory_size=1000), batch.Config(eam=True, memory_size=2000)]
+
+    results = batch.simulate_many(binary, ["Alice", "Bob", ""], configs, workers=workers)
+
+    assert len(results) == 6
+    for (tokens, config), (output, ticks) in zip(itertools.product(["Alice", "Bob", ""], configs), results):
+        expected = machine.simulation(
+            machine.allocate_memory(binary, config.memory_size),
+            None,
+            machine.InputDevice([*tokens, 0]),
+            config.memory_size,
+            len(binary),
+            20000,
+            config.eam,
+            engine="instruction",
+        )
+        assert (output, ticks) == expected
+    assert machine.format_output(results[2][0], "sym") == "What is your name? Hello, Bob!"
+
+
+@pytest.mark.parametrize("engine", machine.TIMING_MODELS)
+def test_batch_worker_reuses_template(tmp_path, monkeypatch, engine):
+    compile_source("examples/hello_user_name.forth", tmp_path / "target.bin")
+    binary = (tmp_path / "target.bin").read_bytes()
+    with open("microcode.bin", "rb") as file:
+        microcode = file.read()
+    expected = simulate_hello_user_name(tmp_path, limit=20000, engine=engine)
+    batch.init_worker(binary, microcode, engine)
+
+    # задания не декодируют микрокоманды и не компилируют код заново
+    def fail(*args):
+        raise AssertionError
+
+    with monkeypatch.context() as patch:
+        patch.setattr(machine.ControlUnit, "decode_microprogram", fail)
+        patch.setattr(fast_engine.BlockUnit, "compile_block", fail)
+        patch.setattr(fast_engine.InstructionUnit, "fuse_superinstructions", fail)
+        for _ in range(2):
+            assert batch.run_job((list("Alice"), batch.Config(), engine, 20000)) == (expected.output, expected.ticks)
+
+    # запись в код в одном задании не меняет образец для следующих
+    data_path = make_data_path(tmp_path, "50331657 VARIABLE v v @ 21 ! 7 4 ! HALT")
+    binary = bytes(data_path.data_memory[: data_path.code_size])
+    memory = machine.allocate_memory(binary, 1000)
+    expected = machine.simulation(memory, microcode, [0], 1000, len(binary), 20000, False, engine=engine)
+    batch.init_worker(binary, microcode, engine)
+    for _ in range(2):
+        assert batch.run_job(([], batch.Config(), engine, 20000)) == expected
+
+
+@pytest.mark.parametrize("program", ["hello_user_name", "sort"])
+def test_vector_engine(tmp_path, program):
+    pytest.importorskip("numpy")
+    target = tmp_path / "target.bin"
+    compile_source("examples/{}.forth".format(program), target)
+    binary = target.read_bytes()
+    if program == "sort":
+        inputs = [[5, 3, 1], [], [9, 8, 7, 6, 5, 4, 3, 2, 1], [-3, 100, 0]]
+    else:
+        inputs = ["Alice", "", "x" * 20]
+    configs = [batch.Config(eam=False), batch.Config(eam=True, memory_size=2000), batch.Config(wrap=True)]
+
+    for limit in (100, 20000):
+        expected = batch.simulate_many(binary, inputs, configs, engine="microcode", limit=limit, workers=0)
+        assert batch.simulate_many(binary, inputs, configs, engine="vector", limit=limit) == expected
+
+
+@pytest.mark.parametrize(("eam", "wrap"), list(itertools.product([False, True], repeat=2)))
+def test_vector_alu(eam, wrap):
+    np = pytest.importorskip("numpy")
+    import vector_engine
+
+    values = [0, 1, -1, 7, -7, 123456, -98765, alu.MAX_INT32, alu.MIN_INT32, alu.MAX_UINT32]
+    # точные результаты -- в 64 битах (см. docstring vector_engine)
+    pairs = [(right, left) for right, left in itertools.product(values, repeat=2) if abs(right * left) < 1 << 63]
+    lanes = [(right, left, carry) for right, left in pairs for carry in (0, 1)]
+    right, left, carry = (np.array(column, np.int64) for column in zip(*lanes))
+    mask = np.ones(len(lanes), bool)
+
+    # каждая операция из alu.OPERATIONS (и коды без операции) -- как у alu.ALU на каждой дорожке
+    for sel in range(16):
+        vector = vector_engine.VectorALU(len(lanes), eam, wrap)
+        vector.c[:] = carry
+        errors = vector.do_ALU(right, left, np.full(len(lanes), sel), mask)
+        for lane, (lane_right, lane_left, lane_carry) in enumerate(lanes):
+            scalar = alu.ALU(eam, wrap)
+            scalar.c = lane_carry
+            try:
+                scalar.do_ALU(lane_right, lane_left, sel)
+            except ZeroDivisionError:
+                assert errors[lane]
+                continue
+            assert not errors[lane]
+            flags = tuple(int(flag) for flag in scalar.get_flags())
+            assert (vector.result[lane], vector.n[lane], vector.z[lane], vector.v[lane], vector.c[lane]) == (
+                scalar.result,
+                *flags,
+            ), (sel, lanes[lane])
+
+
+def test_vector_engine_lane_error(tmp_path):
+    pytest.importorskip("numpy")
+    import vector_engine
+
+    source = tmp_path / "source.forth"
+    target = tmp_path / "target.bin"
+    source.write_text("0 VARIABLE in\n4 VARIABLE out\n100 in @ @ 48 - / out @ !\nHALT\n", encoding="utf-8")
+    compile_source(source, target)
+
+    with open("microcode.bin", "rb") as file:
+        microcode = file.read()
+    lanes = vector_engine.VectorMachine(target.read_bytes(), microcode, ["5", "0", "2"], 1000, False)
+    results = lanes.run(20000)
+    assert [output for output, _ in results] == [[20], [], [50]]
+    assert lanes.errors == [None, "division by zero", None]
+
+
+@pytest.mark.parametrize(
+    ("engine", "resume_engine"), [(engine, engine) for engine in machine.TIMING_MODELS] + [("block", "microcode")]
+)
+def test_checkpoint_chunks(tmp_path, caplog, engine, resume_engine):
+    caplog.set_level(logging.INFO)
+    target = tmp_path / "target.bin"
+    state_file = tmp_path / "state.bin"
+    compile_source("examples/hello_user_name.forth", target)
+    binary = target.read_bytes()
+    with open("microcode.bin", "rb") as file:
+        microcode = file.read()
+
+    def tokens():
+        return [*"Alice", 0]
+
+    expected = machine.simulation(
+        machine.allocate_memory(binary, 1000), microcode, tokens(), 1000, len(binary), 20000, False, engine=engine
+    )
+
+    machine.simulation(
+        machine.allocate_memory(binary, 1000),
+        microcode,
+        tokens(),
+        1000,
+        len(binary),
+        777,
+        False,
+        engine=engine,
+        checkpoint_file=str(state_file),
+    )
+    for limit in range(1077, 20001, 300):
+        with open(state_file, "rb") as file:
+            state = checkpoint.load(file)
+        result = machine.simulation(
+            None,
+            microcode,
+            tokens(),
+            None,
+            None,
+            limit,
+            None,
+            engine=resume_engine,
+            restore=state,
+            checkpoint_file=str(state_file),
+        )
+    assert state.halted
+    assert result == expected
+
+
+def test_checkpoint_large_memory_is_compact(tmp_path):
+    data_path = make_data_path(tmp_path, "1 2 + HALT")
+    data_path.data_memory = machine.allocate_memory(data_path.data_memory, machine.MAX_MEMORY_SIZE)
+    data_path.data_memory_size = machine.MAX_MEMORY_SIZE
+    data_path.output_buffer.extend([1, -2, 0x7FFFFFFF])
+    unit = fast_engine.InstructionUnit(data_path)
+
+    buffer = io.BytesIO()
+    checkpoint.save(buffer, checkpoint.capture(unit, "instruction"))
+    assert len(buffer.getvalue()) < machine.MAX_MEMORY_SIZE // 100
+    buffer.seek(0)
+    state = checkpoint.load(buffer)
+    assert state.memory == bytes(data_path.data_memory)
+    assert state.output == [1, -2, 0x7FFFFFFF]
+    assert state.registers == tuple(getattr(data_path, name) for name in checkpoint.REGISTERS)
+
+
+def test_checkpoint_big_values(tmp_path):
+    data_path = make_data_path(tmp_path, "HALT")
+    data_path.AC, data_path.DR = 2**63, -(2**200)
+    data_path.ALU.do_ALU(2**70, 1, 1)
+    data_path.output_buffer.extend([1, 2**64 + 5, -(2**63) - 1])
+    unit = fast_engine.InstructionUnit(data_path)
+
+    buffer = io.BytesIO()
+    checkpoint.save(buffer, checkpoint.capture(unit, "instruction"))
+    buffer.seek(0)
+    state = checkpoint.load(buffer)
+    assert state.registers == tuple(getattr(data_path, name) for name in checkpoint.REGISTERS)
+    assert state.alu[0] == data_path.ALU.result == 2**70 + 1
+    assert state.output == [1, 2**64 + 5, -(2**63) - 1]
+
+
+def test_checkpoint_keeps_wrap(tmp_path):
+    data_path = make_data_path(tmp_path, "1 2 + HALT")
+    memory, code_size = data_path.data_memory, data_path.code_size
+    state_file = tmp_path / "state.bin"
+    for wrap in (False, True):
+        machine.simulate(
+            memory,
+            None,
+            [0],
+            len(memory),
+            code_size,
+            10,
+            False,
+            "instruction",
+            checkpoint_file=str(state_file),
+            wrap=wrap,
+        )
+        with open(state_file, "rb") as file:
+            state = checkpoint.load(file)
+        assert state.wrap == wrap
+        # разрядность АЛУ берется из контрольной точки, как и eam
+        unit = machine.restore_control_unit(state, "instruction", None, [0])
+        assert unit.data_path.ALU.wrap == wrap
+
+
+def simulate_hello_user_name(tmp_path, **kwargs):
+    target = tmp_path / "target.bin"
+    compile_source("examples/hello_user_name.forth", target)
+    binary = target.read_bytes()
+    with open("microcode.bin", "rb") as file:
+        microcode = file.read()
+    return machine.simulate(
+        machine.allocate_memory(binary, 1000), microcode, [*"Alice", 0], 1000, len(binary), eam=False, **kwargs
+    )
+
+
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_instruction_limit(tmp_path, caplog, engine):
+    caplog.set_level(logging.INFO)
+    result = simulate_hello_user_name(tmp_path, limit=20000, engine=engine, instruction_limit=300)
+    assert result.stop_reason == "instructions"
+    assert result.instructions == 300
+    expected = simulate_hello_user_name(tmp_path, limit=20000, engine="microcode", instruction_limit=300)
+    assert result == expected
+
+    result = simulate_hello_user_name(tmp_path, limit=20000, engine=engine, instruction_limit=10**6)
+    assert result.stop_reason == "halt"
+    assert result.ticks == 3450
+
+
+@pytest.mark.parametrize("engine", machine.TIMING_MODELS)
+def test_progress_and_deadline(tmp_path, caplog, engine):
+    caplog.set_level(logging.INFO)
+    reports = []
+    result = simulate_hello_user_name(
+        tmp_path, limit=2500, engine=engine, progress=lambda *report: reports.append(report), check_interval=97
+    )
+    assert result == simulate_hello_user_name(tmp_path, limit=2500, engine=engine)
+    assert result.stop_reason == "ticks"
+    assert len(reports) > 20
+    assert [ticks for ticks, _ in reports] == sorted(ticks for ticks, _ in reports)
+
+    # отрезки, граница которых рвет пару инструкций, не меняют тактов до остановки
+    result = simulate_hello_user_name(tmp_path, limit=20000, engine=engine, progress=lambda *_: None, check_interval=29)
+    assert result == simulate_hello_user_name(tmp_path, limit=20000, engine=engine)
+
+    result = simulate_hello_user_name(tmp_path, limit=2500, engine=engine, deadline=0, check_interval=97)
+    assert result.stop_reason == "deadline"
+    assert 0 < result.ticks <= 97
+
+
+def test_profiler(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    compile_source("examples/hello_user_name.forth", tmp_path / "target.bin")
+    symbols = profiler.load_symbols(str(tmp_path / "target.bin.sym"))
+
+    reports = []
+    for engine in machine.ENGINES:
+        profile = profiler.Profiler(symbols)
+        result = simulate_hello_user_name(tmp_path, limit=20000, engine=engine, profiler=profile)
+        assert result.ticks == 3450
+        reports.append(profile.report())
+    assert reports[1:] == reports[:-1]
+
+    # инструкции на границе отрезков проверки прогресса попадают в профиль целиком
+    profile = profiler.Profiler(symbols)
+    simulate_hello_user_name(
+        tmp_path, limit=20000, engine="microcode", profiler=profile, progress=lambda *_: None, check_interval=29
+    )
+    assert profile.report() == reports[0]
+
+    report = reports[0]
+    assert report["ticks"] == sum(row["ticks"] for row in report["opcodes"])
+    assert report["ticks"] == sum(row["exclusive"] for row in report["words"])
+    words = {row["word"]: row for row in report["words"]}
+    assert words[profiler.MAIN]["inclusive"] == report["ticks"]
+    assert words["PRINT_STRING"]["calls"] == 2
+    assert words["SAVE_STRING"]["inclusive"] == words["SAVE_STRING"]["exclusive"]
+    assert {row["word"] for row in report["loops"]} == {"PRINT_STRING", "SAVE_STRING"}
+    assert "PRINT_STRING" in profiler.format_report(report)
+
+
+NESTED_CALLS = ": INNER 1 1 + ; : OUTER INNER INNER ; OUTER INNER HALT"
+
+
+def test_flamegraph(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    data_path = make_data_path(tmp_path, NESTED_CALLS)
+    symbols = profiler.load_symbols(str(tmp_path / "target.bin.sym"))
+    profile = profiler.Profiler(symbols)
+    memory = data_path.data_memory
+    result = machine.simulate(
+        memory, None, [0], len(memory), data_path.code_size, 20000, False, "block", profiler=profile
+    )
+
+    stacks = dict(line.rsplit(" ", 1) for line in profile.collapsed().splitlines())
+    assert set(stacks) == {"<main>", "<main>;OUTER", "<main>;OUTER;INNER", "<main>;INNER"}
+    assert sum(int(ticks) for ticks in stacks.values()) == result.ticks
+    words = {row["word"]: row for row in profile.report()["words"]}
+    assert int(stacks["<main>;OUTER;INNER"]) + int(stacks["<main>;INNER"]) == words["INNER"]["exclusive"]
+
+
+def test_call_stack_from_return_stack(tmp_path):
+    data_path = make_data_path(tmp_path, NESTED_CALLS)
+    functions = profiler.load_symbols(str(tmp_path / "target.bin.sym"))["functions"]
+    unit = fast_engine.InstructionUnit(data_path)
+    assert profiler.call_stack(data_path) == []
+    unit.step(20000)  # OUTER
+    unit.step(20000)  # INNER
+    assert profiler.call_stack(data_path) == [functions["OUTER"], functions["INNER"]]
+
+    profile = profiler.Profiler({"functions": functions})
+    profile.start(unit.current_tick(), data_path)
+    assert profile.path == ("<main>", "OUTER", "INNER")
+
+
+def test_memory_heatmap(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    compile_source("examples/hello_user_name.forth", tmp_path / "target.bin")
+    symbols = profiler.load_symbols(str(tmp_path / "target.bin.sym"))
+
+    counters = []
+    for engine in machine.ENGINES:
+        counter = profiler.MemoryCounter(symbols)
+        simulate_hello_user_name(tmp_path, limit=20000, engine=engine, profiler=counter)
+        counters.append(counter)
+        assert "signal_wr" not in vars(counter.data_path)
+    assert all(counter.heatmap() == counters[0].heatmap() for counter in counters)
+
+    # остановки на границах отрезков проверки прогресса не добавляют выборок
+    for engine in machine.TIMING_MODELS:
+        counter = profiler.MemoryCounter(symbols)
+        simulate_hello_user_name(
+            tmp_path, limit=20000, engine=engine, profiler=counter, progress=lambda *_: None, check_interval=29
+        )
+        assert counter.heatmap() == counters[0].heatmap()
+
+    counter = counters[0]
+    report = counter.report()
+    instructions = sum(row["count"] for row in report["opcodes"])
+    assert report["regions"]["code"] == {"reads": instructions, "writes": 0}
+    assert report["regions"]["mmio"] == {"reads": len("Alice") + 1, "writes": len("What is your name? Hello, Alice!")}
+    assert any(row[4] == "buffer" for row in counter.heatmap())
+
+    counter.save(str(tmp_path / "heatmap.csv"))
+    with open(tmp_path / "heatmap.csv", encoding="utf-8") as file:
+        assert file.readline().strip() == "address,region,reads,writes,variable"
+        assert sum(1 for _ in file) == len(counter.heatmap())
+
+
+@pytest.mark.parametrize("engine", machine.TIMING_MODELS)
+def test_memory_counter_detaches_on_error(tmp_path, engine):
+    data_path = make_data_path(tmp_path, "1 2 + + HALT")  # второй + снимает со стека лишнее значение
+    memory = data_path.data_memory
+    counter = profiler.MemoryCounter()
+    with open("microcode.bin", "rb") as file:
+        microcode = file.read()
+    with pytest.raises(AssertionError):
+        machine.simulate(
+            memory, microcode, [0], len(memory), data_path.code_size, 20000, False, engine, profiler=counter
+        )
+    assert "signal_latch_CR" not in vars(counter.data_path)
+    assert "signal_wr" not in vars(counter.data_path)
+    assert counter.pending == [0, 0]
+    moved = sum(row["bytes_read"] + row["bytes_written"] for row in counter.report()["opcodes"])
+    assert moved == 4 * sum(reads + writes for _, _, reads, writes, _ in counter.heatmap())
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_superscalar_engine(golden, caplog):
+    caplog.set_level(logging.INFO)
+    stdout = run_golden(golden, engine="superscalar")
+    *output, ticks = stdout.splitlines()
+    *expected_output, expected_ticks = golden.out["out_stdout"].splitlines()
+    assert output == expected_output
+    assert int(ticks.split()[1]) < int(expected_ticks.split()[1])
+    assert "IPC" in caplog.text
+    assert "pairing ratio" in caplog.text
+
+
+def test_superscalar_hazards():
+    assert superscalar.can_pair(Opcode.POP_AC, Opcode.POP_DR)
+    assert superscalar.can_pair(Opcode.SAVE, Opcode.REPEAT)
+    assert not superscalar.can_pair(Opcode.SAVE, Opcode.LOAD_IMM)  # ячейка над вершиной стека
+    assert not superscalar.can_pair(Opcode.PLUS, Opcode.POP_AC)  # вершина стека, записанная первой
+    assert not superscalar.can_pair(Opcode.POP_AC, Opcode.PLUS)  # AC
+    assert not superscalar.can_pair(Opcode.SAVE, Opcode.LOAD)  # память
+    assert not superscalar.can_pair(Opcode.SAVE, Opcode.POP_AC)  # SAVE может записать вершину стека
+    assert not superscalar.can_pair(Opcode.SAVE, Opcode.DUP)
+    assert not superscalar.can_pair(Opcode.LOAD_IMM, Opcode.CALL)  # AC
+    assert not superscalar.can_pair(Opcode.WHILE, Opcode.LOAD_IMM)  # переход
+
+
+def test_alu_wrap():
+    unbounded, wrapped = alu.ALU(False), alu.ALU(False, wrap=True)
+    for unit in (unbounded, wrapped):
+        unit.do_ALU(0x7FFFFFFF, 1, 1)
+        assert unit.v
+    assert unbounded.result == 0x80000000
+    assert (wrapped.result, wrapped.n) == (-0x80000000, 1)
+
+    wrapped.do_ALU(0x10000, 0x10000, 3)
+    assert (wrapped.result, wrapped.z) == (0, 1)
+    wrapped.do_ALU(1, 0x180000000, 0)
+    assert wrapped.result == -0x80000000
+    wrapped.do_ALU(1, 2, 12)  # код без операции
+    assert wrapped.result == -0x80000000
+
+
+def test_alu_operand_sign(tmp_path):
+    data_path = make_data_path(tmp_path, "HALT")
+    data_path.CR = 0xFFFFFFFE
+    data_path.signal_do_alu(3, 0)
+    assert data_path.ALU.result == -2
+
+
+def test_microinstruction_actions(tmp_path):
+    data_path = make_data_path(tmp_path, "HALT")
+    with open("microcode.bin", "rb") as file:
+        unit = machine.ControlUnit(file.read(), data_path)
+    assert len(unit.actions) == len(unit.rom)
+    for signals, action in zip(unit.rom, unit.actions):
+        if action is None:
+            continue
+        steps, muxmpc = action
+        latched = sum(signals[machine.SIGNAL_ORDER.index(name)] for name in ("lcr", "lpc", "lir", "lbr", "ldr", "lac"))
+        assert len(steps) >= latched + 1  # АЛУ -- в каждой микрокоманде
+        assert muxmpc == signals[-1]
+    assert None in unit.actions  # микрокоманда останова
+
+
+def test_alu_lazy_flags():
+    unit = alu.ALU(True)
+    unit.do_ALU(-1, 0xFFFFFFFF, 1)  # флаги откладываются до чтения
+    assert unit.pending is not None
+    assert (unit.result, unit.n, unit.z, unit.v, unit.c) == (0xFFFFFFFE, 0, 0, 0, 1)
+    assert unit.pending is None
+    unit.do_ALU(1, 5, 2)  # в режиме eam вычитание учитывает перенос предыдущей операции
+    assert (unit.result, unit.c) == (3, 0)
+    unit.do_ALU(0, 7, 0)  # plus_zero флаги не меняет
+    assert unit.z == 0
+    unit.z = 1
+    assert (unit.n, unit.z, unit.v, unit.c) == (0, 1, 0, 0)
+
+
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_progress_with_small_interval(tmp_path, caplog, engine):
+    caplog.set_level(logging.INFO)
+    reports = []
+    result = simulate_hello_user_name(
+        tmp_path, limit=20000, engine=engine, progress=lambda *report: reports.append(report), check_interval=3
+    )
+    assert result == simulate_hello_user_name(tmp_path, limit=20000, engine=engine)
+    assert result.stop_reason == "halt"
+    assert len(reports) > 100
@@ -0,0 +1,410 @@
+#!/usr/bin/python3
+"""Профилировщик программ AccForth на модели процессора.
+
+`Profiler` получает от `machine.simulate` каждую исполненную инструкцию
+(адрес, опкод, такты начала и конца, следующий PC) и считает:
+
+- число инструкций и тактов по каждому `Opcode`;
+- вызовы, включающие (вместе с вложенными вызовами) и исключающие такты
+  по каждому слову AccForth: стек вызовов строится по `CALL` и `RETURN`,
+  адреса слов называются по `Translator.functions_map`;
+- число проходов через начало каждого цикла (адрес после `BEGIN`);
+- такты по каждой цепочке вызовов -- для flame graph в формате collapsed
+  stacks Брендана Грегга (`save_collapsed`).
+
+Имена слов и начала циклов берутся из файла символов, который транслятор
+пишет рядом с машинным кодом (`target.bin.sym`). Без него слова называются
+адресами, а циклы не считаются.
+
+`MemoryCounter` считает чтения и записи памяти по 4-байтным ячейкам
+с разбивкой по областям (`REGIONS`) и байты, перенесенные инструкциями
+каждого опкода, и сохраняет тепловую карту памяти (CSV или NPY).
+Несколько профилировщиков за один запуск объединяет `Group`.
+
+Без профилировщика `simulate` исполняется как обычно, поэтому выключенное
+профилирование ничего не стоит.
+"""
+
+import csv
+import json
+
+from isa import Opcode, binary_to_opcode
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAIN = "<main>"
+"Имя корня стека вызовов: основная программа после последнего определения слова."
+
+
+REGIONS = ("code", "variables", "data_stack", "return_stack", "mmio")
+"Области памяти тепловой карты: код, статические переменные, стек данных, стек возвратов, ввод-вывод."
+
+MMIO_CELLS = 2
+"Ячейки 0 и 1 -- адреса ввода и вывода (`machine.MEMORY_MAPPED_INPUT_ADDRESS`, `MEMORY_MAPPED_OUTPUT_ADDRESS`)."
+
+
+def load_symbols(file_name):
+    """Прочитать файл символов транслятора (см. `Translator.symbols`). None, если файла нет."""
+    try:
+        with open(file_name, encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def call_stack(data_path):
+    """Адреса вызванных слов по стеку возвратов, от внешнего к внутреннему.
+
+    `CALL` кладет адрес возврата по адресу RSP и уменьшает RSP на 4, поэтому
+    занятые ячейки стека возвратов -- от `RSP + 4` до дна (`data_memory_size - 4`).
+    Адрес возврата указывает сразу за `CALL`, аргумент которого -- адрес слова.
+    """
+    bottom = data_path.data_memory_size - 4
+    return [
+        data_path.load_word(data_path.load_word(address) - 4) & 0xFFFFFF for address in range(bottom, data_path.RSP, -4)
+    ]
+
+
+class Profiler:
+    """Счетчики профиля одного запуска модели."""
+
+    names = None
+    "Адрес слова -> имя."
+
+    loop_heads = None
+
+    opcodes = None
+    "Опкод -> [инструкций, тактов]."
+
+    words = None
+    "Имя слова -> [адрес, вызовов, включающие такты, исключающие такты]."
+
+    loops = None
+    "Адрес начала цикла -> [слово, проходов]."
+
+    stack = None
+    "Стек вызовов: (имя слова, такт входа)."
+
+    path = None
+    "Имена слов текущего стека вызовов от `MAIN`."
+
+    stacks = None
+    "Цепочка вызовов (кортеж имен) -> исключающие такты."
+
+    started = None
+
+    finished = None
+
+    def __init__(self, symbols=None):
+        symbols = symbols or {}
+        self.names = {address: name for name, address in symbols.get("functions", {}).items()}
+        self.loop_heads = frozenset(symbols.get("loops", ()))
+        self.opcodes = {}
+        self.words = {MAIN: [None, 1, 0, 0]}
+        self.loops = {}
+        self.stack = []
+        self.path = ()
+        self.stacks = {}
+        self.started = None
+        self.finished = None
+
+    def start(self, tick, data_path=None):
+        """Начать профиль с такта `tick` (с ненулевого -- при восстановлении из контрольной точки).
+
+        Если модель остановилась внутри слова, стек вызовов восстанавливается
+        по стеку возвратов `data_path` (см. `call_stack`).
+        """
+        self.started = tick
+        self.stack = [(MAIN, tick)]
+        if data_path is not None:
+            self.stack.extend((self.word(target), tick) for target in call_stack(data_path))
+        self.path = tuple(name for name, _ in self.stack)
+
+    def word(self, address):
+        name = self.names.get(address)
+        if name is None:
+            name = "0x{:x}".format(address)
+        if name not in self.words:
+            self.words[name] = [address, 0, 0, 0]
+        return name
+
+    def record(self, pc, ir, start, end, next_pc):
+        """Учесть инструкцию с кодом `ir` по адресу `pc`, исполненную за такты [start, end).
+
+        Такты `CALL` относятся к вызванному слову, такты `RETURN` -- к слову,
+        из которого он возвращает.
+        """
+        opcode = binary_to_opcode[ir]
+        counts = self.opcodes.setdefault(opcode, [0, 0])
+        counts[0] += 1
+        counts[1] += end - start
+
+        if pc in self.loop_heads:
+            self.loops.setdefault(pc, [self.stack[-1][0], 0])[1] += 1
+
+        if opcode == Opcode.CALL:
+            name = self.word(next_pc)
+            self.words[name][1] += 1
+            self.stack.append((name, start))
+            self.path += (name,)
+        self.words[self.stack[-1][0]][3] += end - start
+        self.stacks[self.path] = self.stacks.get(self.path, 0) + end - start
+        if opcode == Opcode.RETURN and len(self.stack) > 1:
+            self.leave(end)
+
+    def leave(self, tick):
+        name, entered = self.stack.pop()
+        self.path = self.path[:-1]
+        # у рекурсивного слова включающее время считается по самому внешнему вызову
+        if all(name != outer for outer, _ in self.stack):
+            self.words[name][2] += tick - entered
+
+    def finish(self, tick):
+        """Закрыть незавершенные вызовы на такте `tick` (конец исполнения)."""
+        while self.stack:
+            self.leave(tick)
+        self.finished = tick
+
+    def report(self):
+        """Профиль в виде словаря (для JSON), строки отсортированы по убыванию тактов."""
+        return {
+            "ticks": self.finished - self.started,
+            "instructions": sum(count for count, _ in self.opcodes.values()),
+            "opcodes": [
+                {"opcode": str(opcode), "count": count, "ticks": ticks}
+                for opcode, (count, ticks) in sorted(self.opcodes.items(), key=lambda item: -item[1][1])
+            ],
+            "words": [
+                {"word": name, "address": address, "calls": calls, "inclusive": inclusive, "exclusive": exclusive}
+                for name, (address, calls, inclusive, exclusive) in sorted(
+                    self.words.items(), key=lambda item: (-item[1][2], -item[1][3])
+                )
+            ],
+            "loops": [
+                {"address": address, "word": name, "count": count}
+                for address, (name, count) in sorted(self.loops.items(), key=lambda item: -item[1][1])
+            ],
+        }
+
+    def collapsed(self):
+        """Строки collapsed stacks: `<main>;WORD;INNER такты`, по одной на цепочку вызовов."""
+        return "".join(
+            "{} {}\n".format(";".join(path), ticks) for path, ticks in sorted(self.stacks.items()) if ticks > 0
+        )
+
+    def save_collapsed(self, file_name):
+        """Записать collapsed stacks в `file_name` (вход для flamegraph.pl, speedscope, inferno)."""
+        with open(file_name, "w", encoding="utf-8") as file:
+            file.write(self.collapsed())
+
+    def save(self, file_name):
+        """Записать профиль в `file_name` (JSON) и таблицу в `file_name`.txt."""
+        report = self.report()
+        with open(file_name, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        with open(file_name + ".txt", "w", encoding="utf-8") as file:
+            file.write(format_report(report))
+
+
+def format_report(report):
+    """Текстовые таблицы профиля."""
+    total = max(report["ticks"], 1)
+    lines = ["ticks: {} instructions: {}".format(report["ticks"], report["instructions"]), ""]
+    lines.append("{:<12} {:>10} {:>10} {:>7}".format("opcode", "count", "ticks", "%"))
+    for row in report["opcodes"]:
+        lines.append(
+            "{:<12} {:>10} {:>10} {:>7.2f}".format(
+                row["opcode"], row["count"], row["ticks"], 100 * row["ticks"] / total
+            )
+        )
+    lines.append("")
+    lines.append("{:<24} {:>8} {:>10} {:>10} {:>7}".format("word", "calls", "inclusive", "exclusive", "%"))
+    for row in report["words"]:
+        lines.append(
+            "{:<24} {:>8} {:>10} {:>10} {:>7.2f}".format(
+                row["word"], row["calls"], row["inclusive"], row["exclusive"], 100 * row["inclusive"] / total
+            )
+        )
+    if report["loops"]:
+        lines.append("")
+        lines.append("{:<10} {:<24} {:>10}".format("loop", "word", "count"))
+        for row in report["loops"]:
+            lines.append("{:<10} {:<24} {:>10}".format(hex(row["address"]), row["word"], row["count"]))
+    return "\n".join(lines) + "\n"
+
+
+class MemoryCounter:
+    """Счетчики обращений к памяти: чтения (`DataPath.signal_latch_CR`) и записи (`signal_wr`).
+
+    На время запуска (`start` -- `finish`) эти методы тракта данных
+    подменяются на экземпляре считающими обертками, поэтому без счетчика
+    тракт данных не замедляется.
+
+    Переменные -- от первого адреса `Translator.variables_map` до конца кода
+    (без файла символов весь код -- "code"). Адреса за кодом до DSP -- стек
+    данных, выше -- стек возвратов.
+    """
+
+    cells = None
+    "Ячейка (адрес // 4) -> [чтений, записей, номер области в `REGIONS`]."
+
+    regions = None
+    "Область -> [чтений, записей]."
+
+    opcodes = None
+    "Опкод -> [инструкций, прочитано байт, записано байт]."
+
+    variables = None
+    "Адрес переменной -> имя."
+
+    def __init__(self, symbols=None):
+        symbols = symbols or {}
+        self.variables = {address: name for name, address in symbols.get("variables", {}).items()}
+        self.cells = {}
+        self.regions = {region: [0, 0] for region in REGIONS}
+        self.opcodes = {}
+        self.pending = [0, 0]
+        self.data_path = None
+
+    def start(self, tick, data_path=None):
+        """Подключиться к тракту данных `data_path`."""
+        dp = data_path
+        self.data_path = dp
+        variables_start = min((a for a in self.variables if a >= 4 * MMIO_CELLS), default=dp.code_size)
+        read, write = dp.signal_latch_CR, dp.signal_wr
+
+        def region(address):
+            if address < 4 * MMIO_CELLS:
+                return 4
+            if address < variables_start:
+                return 0
+            if address < dp.code_size:
+                return 1
+            if address <= dp.DSP:
+                return 2
+            return 3
+
+        def count(address, column):
+            cell = self.cells.get(address >> 2)
+            if cell is None:
+                cell = self.cells[address >> 2] = [0, 0, 0]
+            cell[column] += 1
+            cell[2] = region(address)
+            self.regions[REGIONS[cell[2]]][column] += 1
+            self.pending[column] += 4
+
+        def counted_read():
+            count(dp.DA, 0)
+            read()
+
+        def counted_write():
+            count(dp.AR, 1)
+            write()
+
+        dp.signal_latch_CR = counted_read
+        dp.signal_wr = counted_write
+
+    def record(self, pc, ir, start, end, next_pc):
+        """Отнести байты, перенесенные с прошлой инструкции, к опкоду `ir`."""
+        counts = self.opcodes.setdefault(binary_to_opcode[ir], [0, 0, 0])
+        counts[0] += 1
+        counts[1] += self.pending[0]
+        counts[2] += self.pending[1]
+        self.pending = [0, 0]
+
+    def finish(self, tick):
+        """Отключиться от тракта данных.
+
+        Байты незавершенной инструкции (остановка по лимиту или ошибка в ней)
+        относятся к ее опкоду по IR без увеличения числа инструкций.
+        """
+        opcode = binary_to_opcode.get(self.data_path.IR)
+        if any(self.pending) and opcode is not None:
+            counts = self.opcodes.setdefault(opcode, [0, 0, 0])
+            counts[1] += self.pending[0]
+            counts[2] += self.pending[1]
+            self.pending = [0, 0]
+        del self.data_path.signal_latch_CR
+        del self.data_path.signal_wr
+
+    def heatmap(self):
+        """Строки тепловой карты по возрастанию адреса: (адрес ячейки, область, чтений, записей, переменная).
+
+        Код и переменные не выровнены по 4 байтам, поэтому ячейка -- это адреса
+        от `адрес ячейки` до `адрес ячейки + 3`, а переменная -- та, что в ней начинается.
+        """
+        names = {address >> 2: name for address, name in sorted(self.variables.items(), reverse=True)}
+        return [
+            (cell * 4, REGIONS[region], reads, writes, names.get(cell, ""))
+            for cell, (reads, writes, region) in sorted(self.cells.items())
+        ]
+
+    def save_heatmap(self, file_name):
+        """Записать тепловую карту: `.npy` -- массив NumPy (адрес, чтений, записей), иначе CSV."""
+        rows = self.heatmap()
+        if file_name.endswith(".npy"):
+            assert np is not None, "NumPy is required for .npy heatmaps"
+            np.save(file_name, np.array([(address, reads, writes) for address, _, reads, writes, _ in rows]))
+            return
+        with open(file_name, "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(("address", "region", "reads", "writes", "variable"))
+            writer.writerows(rows)
+
+    def report(self):
+        """Обращения по областям и байты по опкодам, по убыванию."""
+        return {
+            "regions": {region: {"reads": reads, "writes": writes} for region, (reads, writes) in self.regions.items()},
+            "opcodes": [
+                {
+                    "opcode": str(opcode),
+                    "count": count,
+                    "bytes_read": read,
+                    "bytes_written": written,
+                    "bytes_per_instruction": (read + written) / max(count, 1),
+                }
+                for opcode, (count, read, written) in sorted(
+                    self.opcodes.items(), key=lambda item: -(item[1][1] + item[1][2])
+                )
+            ],
+        }
+
+    def save(self, file_name):
+        """Записать тепловую карту в `file_name` и сводку в `file_name`.txt."""
+        self.save_heatmap(file_name)
+        report = self.report()
+        lines = ["{:<14} {:>10} {:>10}".format("region", "reads", "writes")]
+        for region, counts in report["regions"].items():
+            lines.append("{:<14} {:>10} {:>10}".format(region, counts["reads"], counts["writes"]))
+        lines.append("")
+        lines.append("{:<12} {:>10} {:>10} {:>10} {:>9}".format("opcode", "count", "read", "written", "bytes/op"))
+        for row in report["opcodes"]:
+            lines.append(
+                "{:<12} {:>10} {:>10} {:>10} {:>9.2f}".format(
+                    row["opcode"], row["count"], row["bytes_read"], row["bytes_written"], row["bytes_per_instruction"]
+                )
+            )
+        with open(file_name + ".txt", "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+
+class Group:
+    """Несколько профилировщиков (`Profiler`, `MemoryCounter`) в одном запуске."""
+
+    def __init__(self, *profilers):
+        self.profilers = profilers
+
+    def start(self, tick, data_path=None):
+        for item in self.profilers:
+            item.start(tick, data_path)
+
+    def record(self, pc, ir, start, end, next_pc):
+        for item in self.profilers:
+            item.record(pc, ir, start, end, next_pc)
+
+    def finish(self, tick):
+        for item in self.profilers:
+            item.finish(tick)
@@ -0,0 +1,165 @@
+"""Модель суперскалярного процессора AccForth с выдачей до двух инструкций за раз.
+
+`SuperscalarUnit` исполняет инструкции так же, как `fast_engine.InstructionUnit`
+(вывод совпадает), но считает время иначе: две соседние инструкции выдаются
+вместе, если между ними нет конфликтов (`can_pair`), и пара занимает столько
+тактов, сколько более долгая из них.
+
+Конфликты считаются по эффектам инструкций (`EFFECTS`):
+
+- первая инструкция пары не должна передавать управление (`BLOCK_TERMINATORS`);
+- вторая не должна читать или писать то, что пишет первая: регистры AC, DR,
+  флаги АЛУ, память вне стеков (`LOAD`, `SAVE`, ввод-вывод), RSP;
+- DSP меняется на известную при декодировании величину, поэтому конфликт по
+  стеку данных -- только по его ячейкам (с поправкой на сдвиг DSP первой инструкцией);
+- адрес `SAVE` и `LOAD` известен только при исполнении и может попасть в стек
+  данных, поэтому запись в память конфликтует с любым обращением к ячейкам стека,
+  а запись в стек -- с любым обращением к памяти.
+
+Выборка -- по две инструкции, память данных -- двухпортовая.
+
+Движок `superscalar` в `machine.simulate`; сравнение с обычной моделью
+на примерах: `./benchmark.py examples/*.forth --superscalar`.
+"""
+
+from collections import namedtuple
+
+from fast_engine import ALU_OPERATIONS, BLOCK_TERMINATORS, InstructionUnit
+from isa import Opcode, opcode_to_binary, opcode_to_size
+
+
+class Effects(namedtuple("Effects", "reads writes stack_reads stack_writes stack_delta")):
+    """Эффекты инструкции: читаемые и записываемые ресурсы, ячейки стека данных
+    (0 -- вершина, 1 -- ячейка над ней) и изменение DSP в ячейках.
+    """
+
+
+EFFECTS = {
+    Opcode.LOAD_IMM: Effects(set(), {"AC"}, set(), {1}, 1),
+    Opcode.LOAD: Effects({"AC", "MEM"}, {"AC"}, set(), {1}, 1),
+    Opcode.SAVE: Effects({"AC", "DR"}, {"MEM"}, set(), set(), 0),
+    Opcode.POP_AC: Effects(set(), {"AC"}, {0}, set(), -1),
+    Opcode.POP_DR: Effects(set(), {"DR"}, {0}, set(), -1),
+    Opcode.DUP: Effects(set(), {"AC"}, {0}, {1}, 1),
+    Opcode.IF: Effects({"AC", "FLAGS"}, set(), set(), set(), 0),
+    Opcode.WHILE: Effects({"AC", "FLAGS"}, set(), set(), set(), 0),
+    Opcode.ELSE: Effects(set(), set(), set(), set(), 0),
+    Opcode.REPEAT: Effects(set(), set(), set(), set(), 0),
+    Opcode.CALL: Effects({"RSP"}, {"AC", "RSP"}, set(), set(), 0),
+    Opcode.RETURN: Effects({"RSP"}, {"RSP"}, set(), set(), 0),
+    Opcode.HALT: Effects(set(), set(), set(), set(), 0),
+}
+"Эффекты инструкций для проверки конфликтов. Арифметика добавляется ниже."
+
+for _opcode in ALU_OPERATIONS:
+    EFFECTS[_opcode] = Effects({"AC", "DR"}, {"AC", "FLAGS"}, set(), {1}, 1)
+
+
+def can_pair(first, second):
+    """Можно ли выдать инструкцию `second` вместе с предшествующей ей `first`."""
+    if first in BLOCK_TERMINATORS:
+        return False
+    a, b = EFFECTS[first], EFFECTS[second]
+    if a.writes & (b.reads | b.writes):
+        return False
+    # память и стек данных -- одна память: адрес SAVE и LOAD может указывать на ячейку стека
+    if "MEM" in a.writes and (b.stack_reads or b.stack_writes):
+        return False
+    if a.stack_writes and "MEM" in b.reads | b.writes:
+        return False
+    # ячейки второй инструкции -- относительно DSP после первой
+    return not a.stack_writes & {slot + a.stack_delta for slot in b.stack_reads | b.stack_writes}
+
+
+class SuperscalarUnit(InstructionUnit):
+    """Блок управления с выдачей до двух независимых инструкций за раз.
+
+    Инструкции исполняются по одной (`step`), а время пары считается так:
+    первая инструкция открывает группу выдачи, вторая, если может быть
+    выдана вместе с ней, добавляет только разницу длительностей.
+    Суперинструкции не используются.
+    """
+
+    pairable = None
+    "Пары кодов инструкций (первая, вторая), которые можно выдать вместе."
+
+    open_group = None
+    """Открытая группа выдачи: (адрес следующей инструкции, код первой, начало, такты, span).
+    Сохраняется при остановке по лимиту и в контрольной точке."""
+
+    instructions = None
+
+    groups = None
+    "Число групп выдачи (одиночных инструкций и пар)."
+
+    scalar_ticks = None
+    "Сколько тактов заняли бы те же инструкции без парной выдачи."
+
+    def __init__(self, data_path, fuse=True):
+        super().__init__(data_path, fuse=False)
+        self.pairable = {
+            (opcode_to_binary[first], opcode_to_binary[second])
+            for first in EFFECTS
+            for second in EFFECTS
+            if can_pair(first, second)
+        }
+        self.terminators = {opcode_to_binary[opcode] for opcode in BLOCK_TERMINATORS}
+        self.sizes = {opcode_to_binary[opcode]: size for opcode, size in opcode_to_size.items()}
+        self.open_group = None
+        self.instructions = 0
+        self.groups = 0
+        self.scalar_ticks = 0
+
+    def step(self, limit):
+        """Выполнить одну инструкцию, в паре с предыдущей, если это возможно."""
+        dp = self.data_path
+        pc = dp.PC
+        ir = dp.data_memory[pc]  # выборка -- только если инструкция успевает (см. `InstructionUnit.step`)
+        group = self.open_group
+        paired = group is not None and group[0] == pc and (group[1], ir) in self.pairable
+        if paired:
+            _, _, start, ticks, span = group
+            end = start + max(ticks, self.ticks[ir])
+            span_end = start + max(span, self.spans[ir])
+            next_group = None
+        else:
+            start = self._tick
+            end = start + self.ticks[ir]
+            span_end = start + self.spans[ir]
+            next_group = None
+            if ir not in self.terminators:
+                next_group = (pc + self.sizes[ir], ir, start, self.ticks[ir], self.spans[ir])
+        if span_end > limit:
+            # группа остается открытой: после продолжения инструкция выдается в пару, как и без остановки
+            self.stopped_at = self._tick
+            self._tick = limit
+            return False
+        dp.DA = pc
+        dp.signal_latch_CR()
+        dp.signal_latch_IR()
+        self.groups += not paired
+        self.open_group = next_group
+        self.instructions += 1
+        self.scalar_ticks += self.ticks[ir]
+        self._tick = end
+        self.handlers[ir](dp)
+        return True
+
+    def run(self, limit):
+        """Исполнять инструкции до `HALT` (StopIteration) или исчерпания лимита тактов."""
+        while self.step(limit):
+            pass
+
+    def issue_counts(self):
+        """Инструкции, группы выдачи, пары, такты и такты без парной выдачи.
+
+        IPC -- инструкций за такт: `instructions / ticks`; доля парной выдачи --
+        инструкций на группу выдачи: `instructions / groups`.
+        """
+        return {
+            "instructions": self.instructions,
+            "groups": self.groups,
+            "pairs": self.instructions - self.groups,
+            "ticks": self._tick,
+            "scalar_ticks": self.scalar_ticks,
+        }
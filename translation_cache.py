@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+"""Кэш трансляции: результаты `translator` по хэшу исходного текста.
+
+Ключ -- SHA-256 от версии транслятора (`translator.VERSION`) и исходного
+текста, поэтому один и тот же `.forth` транслируется один раз на все
+запуски, а изменение исходника или транслятора дает новый ключ.
+
+Запись кэша -- один JSON-файл `<ключ>.json` в каталоге кэша: машинный код
+в base64 (он же -- содержимое `.base64`), текст `.hex`, таблица символов
+(`variables_map`, `functions_map`, начала циклов) и число инструкций.
+Файл пишется во временный и переименовывается, так что параллельные
+запуски не видят недописанных записей.
+
+Размер кэша ограничен (`max_size` байт): время последнего использования --
+mtime записи, при переполнении удаляются самые давно использованные записи (LRU).
+
+Кэш в `translator.main` включается переменной окружения `AK_TRANSLATION_CACHE`
+(каталог); размер -- `AK_TRANSLATION_CACHE_SIZE` (байт).
+"""
+
+import base64
+import hashlib
+import json
+import os
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+class Artifacts(namedtuple("Artifacts", "binary hex symbols instructions")):
+    """Результат трансляции: машинный код, его hex-представление, таблица символов и число инструкций."""
+
+
+class TranslationCache:
+    """Каталог `directory` с результатами трансляции, не больше `max_size` байт."""
+
+    def __init__(self, directory, version, max_size=DEFAULT_MAX_SIZE):
+        self.directory = Path(directory)
+        self.version = version
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def key(self, text):
+        """Ключ записи: хэш версии транслятора и исходного текста."""
+        digest = hashlib.sha256("{}\0".format(self.version).encode())
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, text):
+        return self.directory / (self.key(text) + ".json")
+
+    def get(self, text):
+        """Результат трансляции текста `text` или None, если его нет в кэше."""
+        path = self.path(text)
+        try:
+            with open(path, encoding="utf-8") as file:
+                entry = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        path.touch()  # отметка использования для LRU
+        return Artifacts(
+            binary=base64.b64decode(entry["base64"]),
+            hex=entry["hex"],
+            symbols=entry["symbols"],
+            instructions=entry["instructions"],
+        )
+
+    def put(self, text, artifacts):
+        """Сохранить результат трансляции текста `text` и вытеснить лишние записи."""
+        entry = {
+            "version": self.version,
+            "base64": base64.b64encode(artifacts.binary).decode("utf-8"),
+            "hex": artifacts.hex,
+            "symbols": artifacts.symbols,
+            "instructions": artifacts.instructions,
+        }
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=self.directory, suffix=".tmp", delete=False
+        ) as file:
+            json.dump(entry, file)
+        Path(file.name).replace(self.path(text))
+        self.evict()
+
+    def evict(self):
+        """Удалять самые давно использованные записи, пока кэш больше `max_size`."""
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # удалена параллельным запуском
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+def from_environment(version):
+    """Кэш из переменных окружения `AK_TRANSLATION_CACHE` и `AK_TRANSLATION_CACHE_SIZE` или None."""
+    directory = os.environ.get("AK_TRANSLATION_CACHE")
+    if not directory:
+        return None
+    max_size = int(os.environ.get("AK_TRANSLATION_CACHE_SIZE", DEFAULT_MAX_SIZE))
+    return TranslationCache(directory, version, max_size)
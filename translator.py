@@ -2,125 +2,175 @@
 """Транслятор AccForth в машинный код."""
 
 import base64
+import json
 import os
 import re
 import sys
+from collections import namedtuple
+from enum import Enum
+from types import MappingProxyType
 
-from isa import Opcode, Term, opcode_to_size, to_bytes, to_hex
+import translation_cache
+from isa import Opcode, Term, binary_to_hex, opcode_to_binary, opcode_to_size, to_bytes, to_hex
+
+VERSION = 1
+"Версия транслятора для ключей `translation_cache`; увеличивается при любом изменении машинного кода на выходе."
 
 # комментарии разрешены только после #
 
+WORD_TO_OPCODE = MappingProxyType(
+    {
+        "@": Opcode.LOAD,
+        "!": Opcode.SAVE,
+        "VARIABLE": Opcode.VARIABLE,
+        "IF": Opcode.IF,
+        "ELSE": Opcode.ELSE,
+        "THEN": Opcode.THEN,
+        "BEGIN": Opcode.BEGIN,
+        "WHILE": Opcode.WHILE,
+        "REPEAT": Opcode.REPEAT,
+        ":": Opcode.DEFINE_FUNC,
+        ";": Opcode.RETURN,
+        "+": Opcode.PLUS,
+        "-": Opcode.MINUS,
+        "*": Opcode.MULT,
+        "/": Opcode.DIV,
+        "%": Opcode.MOD,
+        "AND": Opcode.AND,
+        "OR": Opcode.OR,
+        "NOT": Opcode.NOT,
+        "=": Opcode.EQUAL,
+        ">": Opcode.GREATER,
+        "<": Opcode.LESS,
+        "DUP": Opcode.DUP,
+        "HALT": Opcode.HALT,
+    }
+)
+"Отображение операторов исходного кода в коды операций."
+
+INSTRUCTIONS = frozenset(WORD_TO_OPCODE)
+
+# на этапе трансляции они будут развернуты в POP_AC + POP_DR + INSTR
+MATH_INSTRUCTIONS = frozenset({"+", "-", "*", "/", "%", "AND", "OR", "=", ">", "<"})
+
+# без аргумента
+INSTR_WITHOUT_ARG = frozenset(
+    {"@", "!", ";", "+", "-", "*", "/", "%", "AND", "OR", "NOT", "=", ">", "<", "DUP", "HALT"}
+)
+
+# с аргументом + LOAD_IMM + CALL
+SECOND_TYPE_INSTRUCTIONS = frozenset({"!", "IF", "ELSE", "WHILE", "REPEAT"})
+
+MATH_OPCODES = frozenset(WORD_TO_OPCODE[word] for word in MATH_INSTRUCTIONS)
+
+NUMBER_PATTERN = re.compile(r"(0[xX][0-9A-Fa-f]+)|([0-9]+)")
+"Числа: шестнадцатеричные (группа 1) или десятичные (группа 2)."
+
+
+class TokenKind(Enum):
+    """Вид токена исходного кода."""
+
+    OPCODE = "opcode"  # оператор языка из `WORD_TO_OPCODE`
+    NUMBER = "number"  # число, 10 или 16 сс
+    STRING = "string"  # начало строки S"
+    NAME = "name"  # имя переменной или функции
+
+
+class Token(namedtuple("Token", "kind opcode value term")):
+    """Классифицированный терм: вид, код операции (для OPCODE), значение
+    (число для NUMBER, имя для NAME) и сам терм.
+    """
+
+
+def classify(word):
+    """Вид, код операции и значение слова `word`."""
+    opcode = WORD_TO_OPCODE.get(word)
+    if opcode is not None:
+        return TokenKind.OPCODE, opcode, None
+    number = NUMBER_PATTERN.fullmatch(word)
+    if number is not None:
+        return TokenKind.NUMBER, Opcode.LOAD_IMM, int(word, 16 if number.group(1) else 10)
+    if word == 'S"':
+        return TokenKind.STRING, Opcode.LOAD_IMM, None
+    return TokenKind.NAME, None, word
+
+
+def tokenize(terms):
+    """Поток токенов по термам: каждое различное слово классифицируется один раз."""
+    classes = {}
+    for term in terms:
+        word_class = classes.get(term.word)
+        if word_class is None:
+            word_class = classes[term.word] = classify(term.word)
+        yield Token(*word_class, term)
+
+
+def stream_terms(lines):
+    """Поток термов по строкам исходного кода `lines` с проверкой парности IF-ELSE-THEN и BEGIN-WHILE-REPEAT."""
+    if_flag = 0
+    while_flag = 0
+    for line_num, line in enumerate(lines):
+        words = line.strip().split()
+        for pos, word in enumerate(words, 1):
+            if word == "#":
+                break  # если встретили хэштег, значит это комментарий, значит до конца строки все скипаем
+
+            if word == "IF":
+                if_flag += 2
+            if word == "ELSE":
+                if_flag -= 1
+            if word == "THEN":
+                if_flag -= 1
+            assert if_flag >= 0, "Unbalanced IF-ELSE-THEN!"
+
+            if word == "BEGIN":
+                while_flag += 2
+            if word == "WHILE":
+                while_flag -= 1
+            if word == "REPEAT":
+                while_flag -= 1
+            assert while_flag >= 0, "Unbalanced BEGIN-WHILE-REPEAT!"
+
+            # слово может быть: командой, числом, лейблом, названием переменной
+            yield Term(line_num, pos, word)
+    assert if_flag == 0, "Unbalanced IF-ELSE-THEN!"
+    assert while_flag == 0, "Unbalanced BEGIN-WHILE-REPEAT!"
+
+
 class Translator:
     variables_map = None # имя - адрес
     functions_map = None
     variables_queue = None  # переменные будут сохранены в конце кода, после хальта,
     # чтобы гарантированно не мешать коду; имя - значение
     addresses_in_conditions = None  # код, куда нужно вставить аргумент - аргумент
+    loop_heads = None  # адреса первых инструкций после BEGIN (для профилировщика)
 
     def __init__(self):
         self.variables_map = {}
         self.functions_map = {}
         self.variables_queue = {}
         self.addresses_in_conditions = {}
+        self.loop_heads = []
 
     def instructions(self):
-        return {
-            "@",
-            "!",
-            "VARIABLE",
-            "IF",
-            "ELSE",
-            "THEN",
-            "BEGIN",
-            "WHILE",
-            "REPEAT",
-            ":",
-            ";",
-            "+",
-            "-",
-            "*",
-            "/",
-            "%",
-            "AND",
-            "OR",
-            "NOT",
-            "=",
-            ">",
-            "<",
-            "DUP",
-            "HALT",
-        }
+        return INSTRUCTIONS
 
 
     def math_instructions(self):  # на этапе трансляции они будут развернуты в POP_AC + POP_DR + INSTR
-        return {
-            "+",
-            "-",
-            "*",
-            "/",
-            "%",
-            "AND",
-            "OR",
-            "=",
-            ">",
-            "<",
-        }
+        return MATH_INSTRUCTIONS
 
 
     def instr_without_arg(self):  # без аргумента
-        return {
-            "@",
-            "!",
-            ";",
-            "+",
-            "-",
-            "*",
-            "/",
-            "%",
-            "AND",
-            "OR",
-            "NOT",
-            "=",
-            ">",
-            "<",
-            "DUP",
-            "HALT",
-        }
+        return INSTR_WITHOUT_ARG
 
 
     def second_type_instructions(self):  # с аргументом + LOAD_IMM + CALL
-        return {"!", "IF", "ELSE", "WHILE", "REPEAT"}
+        return SECOND_TYPE_INSTRUCTIONS
 
 
     def word_to_opcode(self, symbol):
         """Отображение операторов исходного кода в коды операций."""
-        return {
-            "@": Opcode.LOAD,
-            "!": Opcode.SAVE,
-            "VARIABLE": Opcode.VARIABLE,
-            "IF": Opcode.IF,
-            "ELSE": Opcode.ELSE,
-            "THEN": Opcode.THEN,
-            "BEGIN": Opcode.BEGIN,
-            "WHILE": Opcode.WHILE,
-            "REPEAT": Opcode.REPEAT,
-            ":": Opcode.DEFINE_FUNC,
-            ";": Opcode.RETURN,
-            "+": Opcode.PLUS,
-            "-": Opcode.MINUS,
-            "*": Opcode.MULT,
-            "/": Opcode.DIV,
-            "%": Opcode.MOD,
-            "AND": Opcode.AND,
-            "OR": Opcode.OR,
-            "NOT": Opcode.NOT,
-            "=": Opcode.EQUAL,
-            ">": Opcode.GREATER,
-            "<": Opcode.LESS,
-            "DUP": Opcode.DUP,
-            "HALT": Opcode.HALT,
-        }.get(symbol)
-
+        return WORD_TO_OPCODE.get(symbol)
 
 
     def text_to_terms(self, text):
@@ -131,42 +181,7 @@ class Translator:
         - отсеивание всего, что не: команда, имя переменной, имя лейбла, число;
         - проверка формальной корректности программы (if - then; while - repeat)
         """
-
-        terms = []
-        for line_num, line in enumerate(text.split("\n")):
-            words = line.strip().split()
-            for pos, word in enumerate(words, 1):
-                if word == "#":
-                    break  # если встретили хэштег, значит это комментарий, значит до конца строки все скипаем
-
-                # слово может быть: командой, числом, лейблом, названием переменной
-                # если это число, потом я его распаршу
-                terms.append(Term(line_num, pos, word))  # Добавляем токен
-
-        # pos - адрес, потом переименую
-
-        if_flag = 0
-        while_flag = 0
-        for term in terms:
-            if term.word == "IF":
-                if_flag += 2
-            if term.word == "ELSE":
-                if_flag -= 1
-            if term.word == "THEN":
-                if_flag -= 1
-            assert if_flag >= 0, "Unbalanced IF-ELSE-THEN!"
-
-            if term.word == "BEGIN":
-                while_flag += 2
-            if term.word == "WHILE":
-                while_flag -= 1
-            if term.word == "REPEAT":
-                while_flag -= 1
-            assert while_flag >= 0, "Unbalanced BEGIN-WHILE-REPEAT!"
-        assert if_flag == 0, "Unbalanced IF-ELSE-THEN!"
-        assert while_flag == 0, "Unbalanced BEGIN-WHILE-REPEAT!"
-
-        return terms
+        return list(stream_terms(text.split("\n")))
 
 
     def translate_stage_1(self, text):
@@ -174,172 +189,139 @@ class Translator:
         Убираются все токены, которые не отображаются напрямую в команды,
         создается условная таблица линковки для лейблов функций и названий переменных.
         """
-        terms = self.text_to_terms(text)
+        return self.terms_to_code(self.text_to_terms(text))
+
 
-        # Транслируем термы в машинный код.
+    def terms_to_code(self, terms, address=8):
+        """Машинный код первого этапа для термов `terms`, начиная с адреса `address`.
+
+        Адреса переходов IF, ELSE, WHILE сохраняются в `addresses_in_conditions`
+        (в коде у этих инструкций заглушка -1).
+        """
         code = []
-        brackets_stack = []
+        for instr_address, opcode, arg, term in self.generate(tokenize(terms), address):
+            if opcode is None:
+                self.addresses_in_conditions[instr_address] = arg
+            elif arg is None:
+                code.append({"address": instr_address, "opcode": opcode, "term": term})
+            else:
+                code.append({"address": instr_address, "opcode": opcode, "arg": arg, "term": term})
+        return code
 
-        i = 0
-        address = 8
-        hex_number_pattern = r"^0[xX][0-9A-Fa-f]+$"
-        dec_number_pattern = r"^[0-9]+$"
+
+    def generate(self, tokens, address=8):
+        """Генератор первого этапа: по потоку токенов (`tokenize`) выдает инструкции (адрес, код операции, аргумент, терм).
+
+        Аргумент -- число, имя переменной (адрес станет известен на втором этапе)
+        или None для инструкций без аргумента. IF, ELSE и WHILE выдаются с
+        заглушкой -1, а когда адрес перехода становится известен -- обратная
+        ссылка (адрес инструкции, None, адрес перехода, терм).
+        Каждая инструкция выдается на одну позже (вместе с обратными ссылками,
+        пришедшими после нее): VARIABLE забирает значение у предыдущей
+        инструкции и отменяет ее, а обратные ссылки остаются.
+        """
+        brackets_stack = []  # адреса IF, ELSE, WHILE, ждущих адреса перехода
         last_begin = []
-        while i < len(terms):
-            term = terms[i]
-
-            # если это 16 cc число - load_imm
-            if re.fullmatch(hex_number_pattern, term.word):
-                arg = int(term.word, 16)
-                assert -2**63 <= arg <= 2**63-1, "Argument is not in range!"
-                code.append(
-                    {
-                        "address": address,
-                        "opcode": Opcode.LOAD_IMM,
-                        "arg": arg,
-                        "term": term,
-                    }
-                )
-            # или 10 сс
-            elif re.fullmatch(dec_number_pattern, term.word):
-                arg = int(term.word)
-                assert -2**63 <= arg <= 2**63-1, "Argument is not in range!"
-                code.append(
-                    {
-                        "address": address,
-                        "opcode": Opcode.LOAD_IMM,
-                        "arg": arg,
-                        "term": term,
-                    }
-                )
-
-            elif term.word == 'S"':
-                i += 1
-                string = ""
-                while not terms[i].word.endswith('"'):
-                    string += terms[i].word
-                    string += " "
-                    i += 1
-                string += terms[i].word[:-1]
-                code.append(
-                    {
-                        "address": address,
-                        "opcode": Opcode.LOAD_IMM,
-                        "arg": string,
-                        "term": term,
-                    }
-                )
+        pending = []  # последняя инструкция, еще не выданная, и пришедшие после нее обратные ссылки
+        tokens = iter(tokens)
+        for kind, opcode, value, term in tokens:
+            events = []
+
+            # если это число (16 или 10 сс) - load_imm
+            if kind is TokenKind.NUMBER:
+                assert -2**63 <= value <= 2**63-1, "Argument is not in range!"
+                events.append((address, Opcode.LOAD_IMM, value, term))
+
+            elif kind is TokenKind.STRING:
+                words = []
+                word = next(tokens).term.word
+                while not word.endswith('"'):
+                    words.append(word)
+                    word = next(tokens).term.word
+                words.append(word[:-1])
+                events.append((address, Opcode.LOAD_IMM, " ".join(words), term))
 
+            # если встретили переменную или вызов функции
+            elif kind is TokenKind.NAME:
+                if value in self.variables_queue:
+                    events.append((address, Opcode.LOAD_IMM, value, term))
+                elif value in self.functions_map:
+                    events.append((address, Opcode.CALL, self.functions_map[value], term))
+                else:
+                    assert value in self.variables_map or value in self.functions_map, "Label is not defined!"
 
             # если встретили определение слова
-            elif self.word_to_opcode(term.word) == Opcode.VARIABLE:
+            elif opcode is Opcode.VARIABLE:
                 # после обработки всех термов, мы добавим его в конец
-                value = code[-1]["arg"]  # берем отсюда, так как тут число уже прошло конвертацию
-                label = terms[i + 1].word
+                value = pending[0][2]  # берем отсюда, так как тут число уже прошло конвертацию
+                label = next(tokens).term.word  # перепрыгиваем через лейбл, тк  мы его обработали
                 self.variables_queue[label] = value
-                i += 1  # перепрыгиваем через лейбл, тк  мы его обработали
-                code.pop()
+                yield from pending[1:]
+                pending = []
                 address -= 8
 
             # если встретили определение функции
-            elif self.word_to_opcode(term.word) == Opcode.DEFINE_FUNC:
-                label = terms[i + 1].word
+            elif opcode is Opcode.DEFINE_FUNC:
+                label = next(tokens).term.word
                 self.functions_map[label] = address
-                i += 1
                 address -= 4
 
             # обработка if - else - then, чтобы вставить им потом в аругменты адреса переходов
-            elif self.word_to_opcode(term.word) == Opcode.IF:
-                code.append({"address": address, "opcode": Opcode.POP_AC, "term": term})
+            elif opcode is Opcode.IF or opcode is Opcode.WHILE:
+                events.append((address, Opcode.POP_AC, None, term))
                 address += opcode_to_size[Opcode.POP_AC]
-                brackets_stack.append({"address": address, "opcode": Opcode.IF})
-                code.append({"address": address, "opcode": Opcode.IF, "arg": -1, "term": term})
-            elif self.word_to_opcode(term.word) == Opcode.ELSE:
-                self.addresses_in_conditions[brackets_stack.pop()["address"]] = address + 4
-                brackets_stack.append({"address": address, "opcode": Opcode.ELSE})
-                code.append({"address": address, "opcode": Opcode.ELSE, "arg": -1, "term": term})
-            elif self.word_to_opcode(term.word) == Opcode.THEN:
-                self.addresses_in_conditions[brackets_stack.pop()["address"]] = address
+                brackets_stack.append(address)
+                events.append((address, opcode, -1, term))
+            elif opcode is Opcode.ELSE:
+                events.append((brackets_stack.pop(), None, address + 4, term))
+                brackets_stack.append(address)
+                events.append((address, Opcode.ELSE, -1, term))
+            elif opcode is Opcode.THEN:
+                events.append((brackets_stack.pop(), None, address, term))
                 address -= 4
 
             # обработка begin - while - repeat
-            elif self.word_to_opcode(term.word) == Opcode.BEGIN:
+            elif opcode is Opcode.BEGIN:
                 last_begin.append(address)
+                self.loop_heads.append(address)
                 address -= 4
-            elif self.word_to_opcode(term.word) == Opcode.WHILE:
-                code.append({"address": address, "opcode": Opcode.POP_AC, "term": term})
-                address += opcode_to_size[Opcode.POP_AC]
-                brackets_stack.append({"address": address, "opcode": Opcode.WHILE})
-                code.append({"address": address, "opcode": Opcode.WHILE, "arg": -1, "term": term})
-            elif self.word_to_opcode(term.word) == Opcode.REPEAT:
-                self.addresses_in_conditions[brackets_stack.pop()["address"]] = address + 4
-                code.append(
-                    {
-                        "address": address,
-                        "opcode": Opcode.REPEAT,
-                        "arg": last_begin.pop(),
-                        "term": term,
-                    }
-                )
+            elif opcode is Opcode.REPEAT:
+                events.append((brackets_stack.pop(), None, address + 4, term))
+                events.append((address, Opcode.REPEAT, last_begin.pop(), term))
 
-            # если встретили переменную или вызов функции
-            elif term.word not in self.instructions():
-                arg = term.word
-                if arg in self.variables_queue:
-                    code.append(
-                        {
-                            "address": address,
-                            "opcode": Opcode.LOAD_IMM,
-                            "arg": arg,
-                            "term": term,
-                        }
-                    )
-                elif arg in self.functions_map:
-                    code.append(
-                        {
-                            "address": address,
-                            "opcode": Opcode.CALL,
-                            "arg": self.functions_map[arg],
-                            "term": term,
-                        }
-                    )
-                else:
-                    assert arg in self.variables_map or arg in self.functions_map, "Label is not defined!"
-
-            elif self.word_to_opcode(term.word) == Opcode.NOT:
-                code.append({"address": address, "opcode": Opcode.POP_AC, "term": term})
+            elif opcode is Opcode.NOT or opcode is Opcode.LOAD:
+                events.append((address, Opcode.POP_AC, None, term))
                 address += 1
-                code.append({"address": address, "opcode": self.word_to_opcode(term.word), "term": term})
+                events.append((address, opcode, None, term))
 
-            elif term.word in self.math_instructions():
-                code.append({"address": address, "opcode": Opcode.POP_AC, "term": term})
+            elif opcode in MATH_OPCODES:
+                events.append((address, Opcode.POP_AC, None, term))
                 address += 1
-                code.append({"address": address, "opcode": Opcode.POP_DR, "term": term})
+                events.append((address, Opcode.POP_DR, None, term))
                 address += 1
-                code.append({"address": address, "opcode": self.word_to_opcode(term.word), "term": term})
+                events.append((address, opcode, None, term))
 
-            elif self.word_to_opcode(term.word) == Opcode.SAVE:
-                code.append({"address": address, "opcode": Opcode.POP_DR, "term": term})
+            elif opcode is Opcode.SAVE:
+                events.append((address, Opcode.POP_DR, None, term))
                 address += 1
-                code.append({"address": address, "opcode": Opcode.POP_AC, "term": term})
-                address += 1
-                code.append({"address": address, "opcode": self.word_to_opcode(term.word), "term": term})
-
-            elif self.word_to_opcode(term.word) == Opcode.LOAD:
-                code.append({"address": address, "opcode": Opcode.POP_AC, "term": term})
+                events.append((address, Opcode.POP_AC, None, term))
                 address += 1
-                code.append({"address": address, "opcode": self.word_to_opcode(term.word), "term": term})
+                events.append((address, opcode, None, term))
 
             else:
-                code.append({"address": address, "opcode": self.word_to_opcode(term.word), "term": term})
+                events.append((address, opcode, None, term))
 
-            if term.word in self.instr_without_arg():
+            if term.word in INSTR_WITHOUT_ARG:
                 address -= 3
-
-            i += 1
             address += 4
 
-        return code
+            for event in events:
+                if event[1] is None:
+                    pending.append(event)
+                else:
+                    yield from pending
+                    pending = [event]
+        yield from pending
 
 
     def translate_stage_2(self, code):
@@ -374,6 +356,15 @@ class Translator:
         return code
 
 
+    def symbols(self):
+        """Таблица символов для профилировщика: функции, переменные и начала циклов."""
+        return {
+            "functions": self.functions_map,
+            "variables": self.variables_map,
+            "loops": self.loop_heads,
+        }
+
+
     def get_first_executable_instr(self, code):
         address = 8
         for instr in code:
@@ -383,33 +374,273 @@ class Translator:
         return address
 
 
-def main(source, target):
-    """Функция запуска транслятора. Параметры -- исходный и целевой файлы."""
+class Unit(namedtuple("Unit", "code size functions variables loops")):
+    """Единица трансляции: машинный код первого этапа с адресами от 0, его размер,
+    определенные функции (имя - адрес от 0), объявленные переменные (имя - значение)
+    и начала циклов (адреса от 0).
+    """
+
+
+def split_units(terms):
+    """Разбить термы на единицы трансляции: каждое определение `: NAME ... ;`
+    и каждый участок кода между определениями.
+    """
+    units = []
+    current = []
+    in_definition = False
+    in_string = False
+    for term in terms:
+        if in_string:
+            in_string = not term.word.endswith('"')
+        elif term.word == 'S"':
+            in_string = True
+        elif term.word == ":" and not in_definition:
+            if current:
+                units.append(current)
+            current = []
+            in_definition = True
+        current.append(term)
+        if term.word == ";" and in_definition and not in_string:
+            units.append(current)
+            current = []
+            in_definition = False
+    if current:
+        units.append(current)
+    return units
+
+
+class IncrementalTranslator:
+    """Транслятор, повторно использующий неизмененные единицы трансляции.
+
+    Единица (`split_units`) транслируется первым этапом с адреса 0, переходы
+    IF, ELSE, WHILE, REPEAT внутри нее разрешаются сразу. Ключ единицы -- ее
+    слова и то, какие из них уже объявлены как переменные и функции (от этого
+    зависит трансляция имен). При сборке единицы раскладываются подряд с
+    адреса 8: адреса и переходы сдвигаются на начало единицы, CALL получают
+    адреса функций по именам, после чего второй этап размещает переменные
+    после HALT. Результат побайтно совпадает с `translate`.
+
+    Программы, в которых IF или BEGIN охватывает определение функции,
+    транслируются целиком.
+    """
+
+    units = None
+    "Единицы трансляции по ключам, от давно использованных к недавним."
+
+    max_units = None
+    "Сколько единиц хранить, включая прежние версии определений."
+
+    translated = None
+    "Сколько единиц пришлось транслировать в последней сборке."
+
+    def __init__(self, max_units=4096):
+        self.units = {}
+        self.max_units = max_units
+        self.translated = 0
+
+    def translate(self, text):
+        """Транслировать исходный текст `text` в `translation_cache.Artifacts`."""
+        terms = Translator().text_to_terms(text)
+        variables = {}
+        functions = {}
+        units = {}
+        layout = []
+        self.translated = 0
+        for unit_terms in split_units(terms):
+            words = tuple(term.word for term in unit_terms)
+            key = (words, tuple((word in variables, word in functions) for word in dict.fromkeys(words)))
+            unit = units.get(key) or self.units.get(key)
+            if unit is None:
+                try:
+                    unit = self.translate_unit(unit_terms, variables, functions)
+                except (IndexError, KeyError):  # ветвление или цикл не умещается в единицу
+                    return translate(text)
+                self.translated += 1
+            units[key] = unit
+            layout.append(unit)
+            variables.update(unit.variables)
+            functions.update(unit.functions)
+        for key, unit in units.items():
+            self.units.pop(key, None)
+            self.units[key] = unit
+        while len(self.units) > self.max_units:
+            del self.units[next(iter(self.units))]
+        return self.link(layout)
+
+    def translate_unit(self, terms, variables, functions):
+        """Первый этап трансляции единицы с адреса 0 при уже объявленных `variables` и `functions`."""
+        translator = Translator()
+        translator.variables_queue = dict.fromkeys(variables, UNDEFINED)
+        translator.functions_map = dict.fromkeys(functions, UNDEFINED)
+        code = translator.terms_to_code(terms, 0)
+        for instruction in code:
+            if instruction.get("arg") == -1:
+                instruction["arg"] = translator.addresses_in_conditions[instruction["address"]]
+        return Unit(
+            code=code,
+            size=sum(opcode_to_size[instruction["opcode"]] for instruction in code),
+            functions={name: address for name, address in translator.functions_map.items() if address is not UNDEFINED},
+            variables={name: value for name, value in translator.variables_queue.items() if value is not UNDEFINED},
+            loops=translator.loop_heads,
+        )
+
+    def link(self, layout):
+        """Разложить единицы подряд с адреса 8 и выполнить второй этап трансляции."""
+        translator = Translator()
+        code = []
+        base = 8
+        for unit in layout:
+            for name, address in unit.functions.items():
+                translator.functions_map[name] = base + address
+            translator.variables_queue.update(unit.variables)
+            translator.loop_heads.extend(base + address for address in unit.loops)
+            for instruction in unit.code:
+                instruction = dict(instruction, address=instruction["address"] + base)
+                opcode = instruction["opcode"]
+                if opcode in RELATIVE_JUMPS:
+                    instruction["arg"] += base
+                elif opcode == Opcode.CALL:
+                    instruction["arg"] = translator.functions_map[instruction["term"].word]
+                code.append(instruction)
+            base += unit.size
+        code = translator.translate_stage_2(code)
+        first_ex_instr = translator.get_first_executable_instr(code)
+        return translation_cache.Artifacts(
+            binary=to_bytes(code, first_ex_instr),
+            hex=to_hex(code, translator.variables_map),
+            symbols=translator.symbols(),
+            instructions=len(code),
+        )
+
+
+UNDEFINED = object()
+"Значение уже объявленных имен при трансляции единицы: их адреса и значения станут известны при сборке."
+
+RELATIVE_JUMPS = frozenset((Opcode.IF, Opcode.ELSE, Opcode.WHILE, Opcode.REPEAT))
+"Инструкции, аргумент которых -- адрес внутри единицы трансляции."
+
+
+def translate(text):
+    """Транслировать исходный текст `text` в `translation_cache.Artifacts`."""
     translator = Translator()
-    with open(source, encoding="utf-8") as f:
-        source = f.read()
-
-    code = translator.translate_stage_1(source)
+    code = translator.translate_stage_1(text)
     code = translator.translate_stage_2(code)
     first_ex_instr = translator.get_first_executable_instr(code)
-    binary_code = to_bytes(code, first_ex_instr)
-    hex_code = to_hex(code, translator.variables_map)
+    return translation_cache.Artifacts(
+        binary=to_bytes(code, first_ex_instr),
+        hex=to_hex(code, translator.variables_map),
+        symbols=translator.symbols(),
+        instructions=len(code),
+    )
+
+
+def translate_stream(lines):
+    """Потоковая трансляция строк исходного кода `lines` в `translation_cache.Artifacts`.
+
+    Термы, токены и инструкции первого этапа проходят цепочкой генераторов
+    (`stream_terms`, `tokenize`, `Translator.generate`), а байты инструкций
+    сразу дописываются в выходной буфер. Адреса переходов IF, ELSE, WHILE
+    вписываются в уже записанные инструкции по обратным ссылкам, адреса
+    переменных и первая исполняемая инструкция -- после размещения
+    переменных за последней инструкцией. Память -- выходной буфер, стек
+    вложенных конструкций и ссылки на переменные; исходный текст и список
+    инструкций целиком не хранятся. Результат побайтно совпадает с `translate`.
+    """
+    translator = Translator()
+    binary = bytearray(8)  # заголовок: 4 байта нулей и адрес первой исполняемой инструкции
+    references = []  # (адрес LOAD_IMM, имя переменной)
+    instructions = 0
+    last_address = None
+    first_ex_instr = 8
+    for address, opcode, arg, _ in translator.generate(tokenize(stream_terms(lines))):
+        if opcode is None:  # адрес инструкции совпадает с ее смещением в буфере
+            binary[address + 1 : address + 4] = (arg & 0xFFFFFF).to_bytes(3, "big")
+            continue
+        instructions += 1
+        last_address = address
+        binary.append(opcode_to_binary[opcode])
+        if isinstance(arg, str):
+            references.append((address, arg))
+            binary += bytes(3)
+        elif arg is not None:
+            binary += (arg & 0xFFFFFF).to_bytes(3, "big")
+        if opcode is Opcode.RETURN:
+            first_ex_instr = address + 1
+
+    # переменные -- после последней инструкции, как на втором этапе
+    curr_address = last_address + 1
+    for label, value in translator.variables_queue.items():
+        translator.variables_map[label] = curr_address
+        if isinstance(value, int):
+            size = 4 if -2**31 <= value <= 2**31-1 else 8
+            binary += (value & ((1 << (8 * size)) - 1)).to_bytes(size, "big")
+        elif isinstance(value, str):
+            size = len(value)*4
+            for char in value:
+                binary += bytes(3)
+                binary += char.encode("ascii")
+        curr_address += size
+    for address, label in references:
+        binary[address + 1 : address + 4] = (translator.variables_map[label] & 0xFFFFFF).to_bytes(3, "big")
+    binary[4:8] = first_ex_instr.to_bytes(4, "big")
+
+    return translation_cache.Artifacts(
+        binary=bytes(binary),
+        hex=binary_to_hex(binary, translator.variables_map),
+        symbols=translator.symbols(),
+        instructions=instructions + len(translator.variables_queue),
+    )
+
+
+def main(source, target, cache=None, incremental=None, stream=False):
+    """Функция запуска транслятора. Параметры -- исходный и целевой файлы.
+
+    `cache` -- `translation_cache.TranslationCache`; по умолчанию кэш берется
+    из переменной окружения `AK_TRANSLATION_CACHE` (если она задана).
+    При совпадении хэша исходника результат берется из кэша без трансляции.
+    `incremental` -- `IncrementalTranslator` для повторных трансляций
+    изменяемой программы в одном процессе.
+    `stream` -- потоковая трансляция (`translate_stream`) без чтения исходника
+    целиком; кэш и `incremental` при этом не используются.
+    Возвращает `translation_cache.Artifacts`.
+    """
+    if stream:
+        with open(source, encoding="utf-8") as f:
+            artifacts = translate_stream(f)
+            f.seek(0)
+            loc = 1 + sum(line.count(" ") for line in f)
+    else:
+        with open(source, encoding="utf-8") as f:
+            source = f.read()
+        loc = len(source.split(" "))
+
+        if cache is None:
+            cache = translation_cache.from_environment(VERSION)
+        artifacts = cache.get(source) if cache is not None else None
+        if artifacts is None:
+            artifacts = translate(source) if incremental is None else incremental.translate(source)
+            if cache is not None:
+                cache.put(source, artifacts)
 
     # Убедимся, что каталог назначения существует
     os.makedirs(os.path.dirname(os.path.abspath(target)) or ".", exist_ok=True)
 
     # Запишем выходные файлы
     with open(target, "wb") as f:
-        f.write(binary_code)
+        f.write(artifacts.binary)
     with open(target + ".hex", "w") as f:
-        f.write(hex_code)
+        f.write(artifacts.hex)
     with open(target + ".base64", "w") as f:
-        f.write(base64.b64encode(binary_code).decode("utf-8"))
+        f.write(base64.b64encode(artifacts.binary).decode("utf-8"))
+    with open(target + ".sym", "w") as f:
+        json.dump(artifacts.symbols, f, indent=2)
 
-    print("source LoC:", len(source.split(" ")), "code instr:", len(code))
+    print("source LoC:", loc, "code instr:", artifacts.instructions)
+    return artifacts
 
 
 if __name__ == "__main__":
-    assert len(sys.argv) == 3, "Wrong arguments: translator.py <input_file> <target_file>"
-    _, source, target = sys.argv
-    main(source, target)
+    assert len(sys.argv) in (3, 4), "Wrong arguments: translator.py <input_file> <target_file> [--stream]"
+    _, source, target, *flags = sys.argv
+    assert flags in ([], ["--stream"]), "Unknown flag: {}".format(flags[0])
+    main(source, target, stream=bool(flags))
@@ -0,0 +1,110 @@
+"""Тесты транслятора: кеш трансляции, инкрементальная и потоковая трансляция, токенизация."""
+
+import contextlib
+import io
+import os
+
+import pytest
+import translation_cache
+import translator
+from isa import Opcode
+
+
+def compile_source(source, target, *args, **kwargs):
+    """Транслировать `source` в `target` (`translator.main`), перехватив вывод транслятора.
+
+    Возвращает результат `translator.main` и напечатанный транслятором текст.
+    """
+    with contextlib.redirect_stdout(io.StringIO()) as stdout:
+        result = translator.main(str(source), str(target), *args, **kwargs)
+    return result, stdout.getvalue()
+
+
+def test_translation_cache(tmp_path, monkeypatch):
+    cache = translation_cache.TranslationCache(tmp_path / "cache", translator.VERSION)
+    source = tmp_path / "source.forth"
+    source.write_text("5 VARIABLE x x @ 4 ! HALT", encoding="utf-8")
+    files = ["target.bin", "target.bin.hex", "target.bin.base64", "target.bin.sym"]
+    _, fresh_log = compile_source(source, tmp_path / "fresh" / "target.bin")
+    first, first_log = compile_source(source, tmp_path / "miss" / "target.bin", cache)
+    monkeypatch.setattr(translator.Translator, "translate_stage_1", None)  # повторной трансляции нет
+    second, second_log = compile_source(source, tmp_path / "hit" / "target.bin", cache)
+    assert first == second
+    assert first_log == fresh_log == second_log
+    for name in files:
+        fresh = (tmp_path / "fresh" / name).read_bytes()
+        assert (tmp_path / "miss" / name).read_bytes() == fresh
+        assert (tmp_path / "hit" / name).read_bytes() == fresh
+
+
+def test_translation_cache_eviction(tmp_path):
+    cache = translation_cache.TranslationCache(tmp_path, translator.VERSION)
+    texts = ["1 4 ! HALT", "2 4 ! HALT", "3 4 ! HALT"]
+    for index, text in enumerate(texts):
+        cache.put(text, translator.translate(text))
+        os.utime(cache.path(text), ns=(index, index))
+    cache.get(texts[0])  # texts[1] -- самая давно использованная запись
+    cache.max_size = 2 * cache.path(texts[0]).stat().st_size
+    cache.evict()
+    assert [cache.get(text) is not None for text in texts] == [True, False, True]
+
+
+def test_incremental_translation():
+    with open("examples/euler.forth", encoding="utf-8") as file:
+        text = file.read()
+    edited = text.replace("DUP * +", "DUP * + 0 +")  # первая функция не меняется, вторая растет
+    edits = [
+        text,
+        edited,
+        edited.replace("DUP 1 - DUP", "DUP 2 - DUP"),  # меняется только первая функция
+        edited.replace("HALT", ": SQUARE_OF_SUM 1 ; SQUARE_OF_SUM HALT"),  # повторное определение
+        "1 VARIABLE x 1 IF : F x @ ; ELSE THEN F HALT",  # определение внутри IF -- трансляция целиком
+    ]
+    incremental = translator.IncrementalTranslator()
+    translated = []
+    for source in edits:
+        assert incremental.translate(source) == translator.translate(source)
+        translated.append(incremental.translated)
+    assert translated[:4] == [4, 1, 1, 3]
+
+
+def test_tokenize():
+    terms = translator.Translator().text_to_terms('0x1F 10 S" a b" VARIABLE s : F s @ ; # комментарий')
+    tokens = list(translator.tokenize(terms))
+    assert [(token.kind.value, token.value) for token in tokens[:5]] == [
+        ("number", 31),
+        ("number", 10),
+        ("string", None),
+        ("name", "a"),
+        ("name", 'b"'),
+    ]
+    assert [token.opcode for token in tokens[5:]] == [
+        Opcode.VARIABLE,
+        None,
+        Opcode.DEFINE_FUNC,
+        None,
+        None,
+        Opcode.LOAD,
+        Opcode.RETURN,
+    ]
+    assert tokens[-1].term == terms[-1]
+
+
+@pytest.mark.parametrize("program", ["euler", "sort", "hello_user_name"])
+def test_streaming_translation(tmp_path, program):
+    source = "examples/{}.forth".format(program)
+    full, full_log = compile_source(source, tmp_path / "full" / "target.bin")
+    streamed, streamed_log = compile_source(source, tmp_path / "stream" / "target.bin", stream=True)
+    assert streamed == full
+    assert streamed_log == full_log
+    for name in ["target.bin", "target.bin.hex", "target.bin.base64", "target.bin.sym"]:
+        assert (tmp_path / "stream" / name).read_bytes() == (tmp_path / "full" / name).read_bytes()
+
+
+def test_streaming_back_patching():
+    text = "0x1FFFFFFFFF VARIABLE big 1 VARIABLE x BEGIN x @ WHILE big @ IF 0 x ! ELSE THEN REPEAT HALT"
+    assert translator.translate_stream([text]) == translator.translate(text)
+
+    # VARIABLE сразу после THEN: отменяется число, а обратная ссылка остается
+    text = "1 IF 5 ELSE 6 THEN VARIABLE y y @ 4 ! HALT"
+    assert translator.translate_stream([text]) == translator.translate(text)
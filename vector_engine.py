@@ -0,0 +1,360 @@
+#!/usr/bin/python3
+"""Векторная модель процессора: много машин с одним машинным кодом в ногу.
+
+Регистры, флаги и память -- массивы NumPy, первое измерение которых -- номер
+машины (дорожки). На каждом такте каждая дорожка берет свою микрокоманду из
+декодированной памяти микрокоманд (`machine.ControlUnit.rom`), и сигналы
+выполняются над всеми дорожками сразу под масками. Поэтому дорожки, которые
+разошлись по разным ветвям программы, продолжают исполняться вместе, а
+остановившиеся (HALT, конец ввода, предел тактов, ошибка) просто маскируются.
+
+Вывод и число тактов каждой дорожки совпадают с `machine.ControlUnit`, пока
+значения регистров помещаются в 64 бита.
+
+NumPy -- необязательная зависимость: без нее модуль импортируется, но создать
+`VectorMachine` нельзя.
+"""
+
+import logging
+
+import machine
+from alu import MASK32, MAX_INT32, MAX_UINT32, MIN_INT32, OPERATIONS, SIGN32
+from isa import binary_to_opcode
+from microcode_util import SIGNAL_ORDER, Signal, linking_table
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STEP = np.array([4, -4, 0, 0]) if np is not None else None
+"Изменение RSP и DSP по значению мультиплексора (`signal_latch_RSP`, `signal_latch_DSP`)."
+
+# номера столбцов сигналов в `VectorMachine.rom` (порядок `SIGNAL_ORDER`)
+SIGNIF = SIGNAL_ORDER.index(Signal.SIGNIF)
+LPC = SIGNAL_ORDER.index(Signal.LPC)
+MUXPC = SIGNAL_ORDER.index(Signal.MUXPC)
+LCR = SIGNAL_ORDER.index(Signal.LCR)
+LIR = SIGNAL_ORDER.index(Signal.LIR)
+LBR = SIGNAL_ORDER.index(Signal.LBR)
+MUXALU = SIGNAL_ORDER.index(Signal.MUXALU)
+ALU_SEL = SIGNAL_ORDER.index(Signal.ALU)
+LDR = SIGNAL_ORDER.index(Signal.LDR)
+LAC = SIGNAL_ORDER.index(Signal.LAC)
+MUXAR = SIGNAL_ORDER.index(Signal.MUXAR)
+LAR = SIGNAL_ORDER.index(Signal.LAR)
+MUXRSP = SIGNAL_ORDER.index(Signal.MUXRSP)
+LRSP = SIGNAL_ORDER.index(Signal.LRSP)
+MUXDSP = SIGNAL_ORDER.index(Signal.MUXDSP)
+LDSP = SIGNAL_ORDER.index(Signal.LDSP)
+WR = SIGNAL_ORDER.index(Signal.WR)
+MPC = SIGNAL_ORDER.index(Signal.MPC)
+MUXMPC = SIGNAL_ORDER.index(Signal.MUXMPC)
+
+
+def wrap32(values):
+    """Знаковые 32 бита значений (как `alu.ALU` с `wrap=True`)."""
+    return ((values + SIGN32) & MASK32) - SIGN32
+
+
+def plus_flags(right, left, result):
+    """Флаги V и C сложения по дорожкам (см. `alu.plus_flags`)."""
+    c = np.where(
+        (left < 0) & (right > 0),
+        np.abs(left) <= np.abs(right),
+        np.where((left > 0) & (right < 0), np.abs(right) <= np.abs(left), result > MAX_UINT32),
+    )
+    v = ((right > 0) & (left > 0) & (result > MAX_INT32)) | ((right < 0) & (left < 0) & (result < MIN_INT32))
+    return v, c
+
+
+def minus_flags(right, left, result):
+    """Флаги V и C вычитания по дорожкам (см. `alu.minus_flags`)."""
+    v = ((right >= 0) & (left < 0) & (result < 0)) | ((right < 0) & (left >= 0) & (result > 0))
+    return v, left < right
+
+
+def multiply_flags(right, left, result):
+    """Флаги V и C умножения по дорожкам (см. `alu.multiply_flags`)."""
+    v = (right != 0) & (result // np.where(right == 0, 1, right) != left)
+    return v, 0
+
+
+def logic_flags(right, left, result):
+    """Флаги V и C остальных операций: сброшены (см. `alu.logic_flags`)."""
+    return 0, 0
+
+
+LANE_OPERATIONS = {
+    "plus_zero": (lambda right, left, carry: left, None),
+    "plus": (lambda right, left, carry: right + left + carry, plus_flags),
+    "minus": (lambda right, left, carry: left - right - carry, minus_flags),
+    "multiply": (lambda right, left, carry: left * right, multiply_flags),
+    "divide": (lambda right, left, carry: left // right, logic_flags),
+    "modulo": (lambda right, left, carry: left % right, logic_flags),
+    "logical_and": (lambda right, left, carry: left & right, logic_flags),
+    "logical_or": (lambda right, left, carry: left | right, logic_flags),
+    "logical_not": (lambda right, left, carry: ~right, logic_flags),
+    "equal": (lambda right, left, carry: np.where(right == left, -1, 0), logic_flags),
+    "less": (lambda right, left, carry: np.where(left < right, -1, 0), logic_flags),
+    "greater": (lambda right, left, carry: np.where(left > right, -1, 0), logic_flags),
+}
+"""Операции `alu.ALU` по дорожкам, по именам из `alu.OPERATIONS`: (результат
+по `(right, left, перенос)`, флаги V и C по точному результату). Флаги `None` --
+операция флаги не меняет. Перенос (C) учитывают только сложение и вычитание."""
+
+assert set(LANE_OPERATIONS) == set(OPERATIONS), "vector engine does not match alu.OPERATIONS"
+
+DIVISIONS = ("divide", "modulo")
+"Операции, на которых `alu.ALU` бросает ZeroDivisionError."
+
+
+class VectorALU:
+    """Векторный вариант `alu.ALU`: результат и флаги -- массивы по дорожкам,
+    номер операции у каждой дорожки свой.
+    """
+
+    def __init__(self, lanes, eam, wrap=False):
+        self.result = np.zeros(lanes, np.int64)
+        self.n = np.zeros(lanes, np.int64)
+        self.z = np.ones(lanes, np.int64)
+        self.v = np.zeros(lanes, np.int64)
+        self.c = np.zeros(lanes, np.int64)
+        self.eam = eam
+        self.wrap = wrap
+        self.operations = [(name, *LANE_OPERATIONS[name]) for name in OPERATIONS]
+
+    def do_ALU(self, right, left, sel, mask):
+        """Выполнить операцию `sel[i]` для каждой дорожки `i` из маски `mask`.
+
+        Возвращает маску дорожек, на которых `alu.ALU` бросил бы ZeroDivisionError.
+        """
+        errors = np.zeros_like(mask)
+        carry = self.c if self.eam else 0
+        for op in np.flatnonzero(np.bincount(sel[mask], minlength=16)):
+            if op >= len(self.operations):
+                continue
+            name, operation, flags_of = self.operations[op]
+            lanes = mask & (sel == op)
+            divisor = right
+            if name in DIVISIONS:
+                zero = lanes & ((left == 0) | (right == 0))
+                errors |= zero
+                lanes &= ~zero
+                divisor = np.where(right == 0, 1, right)
+
+            result = operation(divisor, left, carry)
+            if flags_of is not None:
+                v, c = flags_of(divisor, left, result)
+                np.copyto(self.c, c, where=lanes)
+                np.copyto(self.v, v, where=lanes)
+            if self.wrap:
+                result = wrap32(result)
+            np.copyto(self.result, result, where=lanes)
+            if flags_of is not None:
+                np.copyto(self.n, result < 0, where=lanes)
+                np.copyto(self.z, result == 0, where=lanes)
+        return errors
+
+
+class VectorMachine:
+    """Модель процессора, исполняющая машинный код `binary` сразу на нескольких входах.
+
+    Каждый вход -- последовательность токенов (см. `machine.encode_input`); в
+    конец, как в `machine.main`, добавляется 0. Настройки (`memory_size`, `eam`,
+    `wrap`) у всех дорожек общие.
+    """
+
+    rom = None
+    "Декодированная память микрокоманд: массив (адрес микрокоманды, сигнал)."
+
+    decoder = None
+    "Адрес микропрограммы по значению IR (-1 -- неизвестный код операции)."
+
+    active = None
+    "Маска дорожек, которые еще исполняются."
+
+    ticks = None
+    "Число тактов каждой дорожки."
+
+    outputs = None
+    "Вывод каждой дорожки (списки значений, как `DataPath.output_buffer`)."
+
+    errors = None
+    "Ошибка, на которой остановилась дорожка (`None` -- без ошибки)."
+
+    def __init__(self, binary, microcode, inputs, memory_size, eam, wrap=False):
+        if np is None:
+            raise ImportError("numpy is required for the vector engine")  # noqa: TRY003
+        code_size = len(binary)
+        assert 0 < memory_size <= machine.MAX_MEMORY_SIZE, "memory size should be in (0, {}]: {}".format(
+            machine.MAX_MEMORY_SIZE, memory_size
+        )
+        assert code_size <= memory_size, "code does not fit in memory: {} > {}".format(code_size, memory_size)
+        lanes = len(inputs)
+
+        self.rom = np.array(machine.ControlUnit(microcode, None).rom, np.int64)
+        self.decoder = np.full(256, -1, np.int64)
+        for binary_opcode, opcode in binary_to_opcode.items():
+            self.decoder[binary_opcode] = linking_table.get(opcode, 0)
+
+        self.code_size = code_size
+        self.memory_size = memory_size
+        self.memory = np.zeros((lanes, memory_size), np.uint8)
+        self.memory[:, :code_size] = np.frombuffer(bytes(binary), np.uint8)
+
+        tokens = [[machine.encode_input(token) for token in tokens] + [0] for tokens in inputs]
+        self.input = np.zeros((lanes, max(map(len, tokens), default=1)), np.int64)
+        for lane, lane_tokens in enumerate(tokens):
+            self.input[lane, : len(lane_tokens)] = lane_tokens
+        self.input_length = np.array([len(lane_tokens) for lane_tokens in tokens], np.int64)
+        self.input_position = np.zeros(lanes, np.int64)
+
+        first_exec_instr = int.from_bytes(bytes(binary[4:8]), "big")
+        self.CR = np.zeros(lanes, np.int64)
+        self.AC = np.zeros(lanes, np.int64)
+        self.DR = np.zeros(lanes, np.int64)
+        self.PC = np.full(lanes, first_exec_instr, np.int64)
+        self.DA = self.PC.copy()
+        self.IR = np.zeros(lanes, np.int64)
+        self.BR = np.zeros(lanes, np.int64)
+        self.AR = np.zeros(lanes, np.int64)
+        self.RSP = np.full(lanes, memory_size - 4, np.int64)
+        self.DSP = np.full(lanes, code_size - 4, np.int64)
+        self.ALU = VectorALU(lanes, eam, wrap)
+        self.mpc = np.zeros(lanes, np.int64)
+
+        self.active = np.ones(lanes, bool)
+        self.ticks = np.zeros(lanes, np.int64)
+        self.outputs = [[] for _ in range(lanes)]
+        self.errors = [None] * lanes
+
+    def stop(self, lanes, error):
+        """Остановить дорожки из маски `lanes` с ошибкой `error`."""
+        for lane in np.flatnonzero(lanes & self.active):
+            self.errors[lane] = error
+            logging.warning("lane %d: %s", lane, error)
+        self.active &= ~lanes
+
+    def load_word(self, lanes, addresses):
+        """Слова памяти по адресам `addresses` для дорожек с номерами `lanes`."""
+        memory = self.memory
+        return (
+            (memory[lanes, addresses].astype(np.int64) << 24)
+            | (memory[lanes, addresses + 1].astype(np.int64) << 16)
+            | (memory[lanes, addresses + 2].astype(np.int64) << 8)
+            | memory[lanes, addresses + 3]
+        )
+
+    def store_word(self, lanes, addresses, values):
+        values = values & 0xFFFFFFFF
+        self.memory[lanes, addresses] = values >> 24
+        self.memory[lanes, addresses + 1] = (values >> 16) & 0xFF
+        self.memory[lanes, addresses + 2] = (values >> 8) & 0xFF
+        self.memory[lanes, addresses + 3] = values & 0xFF
+
+    def latch_CR(self, mask):
+        """Сигнал `lcr`: чтение слова по адресу DA или токена ввода (адрес 0)."""
+        from_input = mask & (self.DA == machine.MEMORY_MAPPED_INPUT_ADDRESS)
+        if from_input.any():
+            eof = from_input & (self.input_position >= self.input_length)
+            if eof.any():
+                # как `simulation` на EOFError: дорожка останавливается без ошибки
+                self.active &= ~eof
+                from_input &= ~eof
+            lanes = np.flatnonzero(from_input)
+            self.CR[lanes] = self.input[lanes, self.input_position[lanes]]
+            self.input_position[lanes] += 1
+
+        from_memory = mask & self.active & (self.DA != machine.MEMORY_MAPPED_INPUT_ADDRESS)
+        self.stop(from_memory & (self.DA + 4 > self.memory_size), "out of memory")
+        lanes = np.flatnonzero(from_memory & self.active)
+        self.CR[lanes] = self.load_word(lanes, self.DA[lanes])
+
+    def signal_wr(self, mask):
+        """Сигнал `wr`: запись AC по адресу AR или вывод (адрес 4)."""
+        self.stop(mask & ((self.AR < 0) | (self.AR >= self.memory_size)), "out of memory")
+        mask = mask & self.active
+        for lane in np.flatnonzero(mask & (self.AR == machine.MEMORY_MAPPED_OUTPUT_ADDRESS)):
+            self.outputs[lane].append(int(self.AC[lane]))
+        to_memory = mask & (self.AR != machine.MEMORY_MAPPED_OUTPUT_ADDRESS)
+        self.stop(to_memory & (self.AR + 4 > self.memory_size), "out of memory")
+        lanes = np.flatnonzero(to_memory & self.active)
+        self.store_word(lanes, self.AR[lanes], self.AC[lanes])
+
+    def check(self, condition, error):
+        """Остановить дорожки, на которых не выполнено условие `condition` (как assert в `DataPath`)."""
+        failed = self.active & ~condition
+        if failed.any():
+            self.stop(failed, error)
+
+    def process_next_tick(self):
+        """Один такт всех дорожек, в порядке сигналов `ControlUnit.process_next_tick`."""
+        active = self.active
+        signals = self.rom[self.mpc >> 2]
+
+        halted = active & (signals[:, MPC] == 0)
+        if halted.any():
+            active &= ~halted
+
+        lcr = active & (signals[:, LCR] == 1)
+        if lcr.any():
+            self.latch_CR(lcr)
+
+        lpc = active & (signals[:, LPC] == 1)
+        pc_sel = np.where(signals[:, SIGNIF] == 1, 1 - self.ALU.z, signals[:, MUXPC])
+        self.PC = np.where(lpc, np.choose(pc_sel, [self.BR, self.PC + 4, self.PC + 1, self.PC]), self.PC)
+        self.IR = np.where(active & (signals[:, LIR] == 1), (self.CR >> 24) & 0xFF, self.IR)
+        self.BR = np.where(active & (signals[:, LBR] == 1), self.CR & 0xFFFFFF, self.BR)
+
+        left = np.choose(signals[:, MUXALU], [self.DR, self.PC, self.BR, self.CR])
+        self.check(left < 1 << 32, "value does not fit in 32 bits")
+        left = np.where(left > MAX_INT32, left - (1 << 32), left)
+        errors = self.ALU.do_ALU(self.AC, left, signals[:, ALU_SEL], active)
+        if errors.any():
+            self.stop(errors, "division by zero")
+        self.DR = np.where(active & (signals[:, LDR] == 1), self.ALU.result, self.DR)
+        self.AC = np.where(active & (signals[:, LAC] == 1), self.ALU.result, self.AC)
+
+        ldsp = active & (signals[:, LDSP] == 1)
+        if ldsp.any():
+            self.DSP = self.DSP + STEP[signals[:, MUXDSP]] * ldsp
+            self.check(~ldsp | (self.DSP >= self.code_size - 4), "out of memory")
+            self.check(~ldsp | (self.DSP < self.RSP), "stack overflow")
+
+        lar = active & (signals[:, LAR] == 1)
+        self.AR = np.where(
+            lar, np.choose(signals[:, MUXAR], [self.AC & 0xFFFFFF, self.RSP, self.DSP, self.DR]), self.AR
+        )
+        lda = lpc | lar
+        self.DA = np.where(lda, np.where(lar, self.AR, self.PC), self.DA)
+        self.check(~lda | ((self.DA >= 0) & (self.DA < self.memory_size)), "out of memory")
+
+        lrsp = active & (signals[:, LRSP] == 1)
+        if lrsp.any():
+            self.RSP = self.RSP + STEP[signals[:, MUXRSP]] * lrsp
+            self.check(~lrsp | (self.RSP < self.memory_size), "out of memory")
+            self.check(~lrsp | (self.DSP < self.RSP), "stack overflow")
+
+        wr = active & (signals[:, WR] == 1)
+        if wr.any():
+            self.signal_wr(wr)
+
+        muxmpc = signals[:, MUXMPC]
+        decoded = self.decoder[self.IR]
+        self.check((muxmpc != 2) | (decoded >= 0), "unknown opcode")
+        self.mpc = np.where(active, np.choose(muxmpc, [0, self.mpc + 4, decoded, self.mpc]), self.mpc)
+        self.ticks += active
+
+    def run(self, limit):
+        """Исполнять такты, пока есть активные дорожки, но не больше `limit` тактов.
+
+        Возвращает список (вывод, такты) по дорожкам, как `machine.simulation`.
+        """
+        tick = 0
+        while tick < limit and self.active.any():
+            self.process_next_tick()
+            tick += 1
+        if self.active.any():
+            logging.warning("Limit exceeded on %d lanes", np.count_nonzero(self.active))
+        return [(output, int(ticks)) for output, ticks in zip(self.outputs, self.ticks)]